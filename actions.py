@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Named action handlers run for the messages the routing rules resolve them for.
+
+The routing rules (keywords.json `action` fields and rules.json) name the
+actions of a message; the handlers are registered under those names by the
+app, e.g. `SlackSRE`, which replies with the sentiment and the keyword's
+template.
+"""
+
+import logging
+
+from metrics import REGISTRY
+
+actions_run = REGISTRY.counter("mtpm_actions_total", "Actions run for routed messages, by action and result.")
+
+
+class ActionRegistry:
+    """The action handlers, by name."""
+
+    def __init__(self):
+        self._handlers = {}
+        self._reported = set()
+
+    def register(self, name):
+        """
+        Register the decorated function as the handler of an action.
+
+        Parameters:
+            name (str): The name of the action, as used in the routing rules.
+
+        Returns:
+            callable: The decorator, which returns the handler unchanged. The handler is called
+                      with the message and its processing context.
+        """
+
+        def decorator(handler):
+            self._handlers[name] = handler
+            return handler
+
+        return decorator
+
+    def run(self, names, message, context) -> int:
+        """
+        Run the handlers of actions, an error in one of them not preventing the others.
+
+        Parameters:
+            names (tuple): The names of the actions, as resolved by the routing table.
+            message (dict): The message.
+            context (dict): The processing context returned by the pipeline.
+
+        Returns:
+            int: The number of handlers that ran successfully.
+        """
+        succeeded = 0
+        for name in names:
+            handler = self._handlers.get(name)
+            if handler is None:
+                if name not in self._reported:
+                    self._reported.add(name)
+                    logging.error(f"No handler is registered for the action {name}.")
+                actions_run.inc(action=name, result="unknown")
+                continue
+            try:
+                handler(message, context)
+            except Exception as e:
+                logging.error(f"Action {name} failed for message {message.get('ts')}: {e}")
+                actions_run.inc(action=name, result="error")
+                continue
+            actions_run.inc(action=name, result="ok")
+            succeeded += 1
+        return succeeded
@@ -5,54 +5,500 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
+import atexit
 import logging
+import multiprocessing
+import os
 import re
+import tempfile
 
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_bolt.middleware import IgnoringSelfEvents
 
-from lib.api.google.language import analyze_entities, analyze_sentiment
-from message import (check_keyword, check_member, process_message,
-                     process_message_for_keyword, process_score)
-from utils import get_slack_app_token, get_slack_bot_token
+import logs
+from actions import ActionRegistry
+from coalesce import AlertCoalescer
+from deadline import get_breakers
+from dispatch import (DEFAULT_CHANNEL_RATE, DEFAULT_METHOD_RATES,
+                      RateLimitedClient, SlackDispatcher)
+from idempotency import IdempotentEvents, build_store
+from message import (check_member, config, get_keyword_blocks, match_keywords,
+                     process_message_for_keyword, process_score,
+                     resolve_actions, template_fields)
+from metrics import REGISTRY, start_metrics_server
+from pipeline import build_pipeline, get_duplicate_index
+from scheduler import HIGH, LOW, Scheduler
+from startup import mark_startup, preload, startup_phases
+from utils import (get_alert_window, get_config_reload_interval,
+                   get_event_deadline, get_google_sheet_id,
+                   get_google_sheet_range, get_idempotency_store_path,
+                   get_llm_hedge_provider, get_llm_provider,
+                   get_llm_stream_update_interval, get_log_format,
+                   get_log_level, get_log_sample_per_second, get_metrics_port,
+                   get_metrics_profiling_enabled, get_nlp_backend,
+                   get_pipeline_report_interval, get_pipeline_stages,
+                   get_priority_channels, get_scheduler_aging,
+                   get_scheduler_high_workers, get_scheduler_low_workers,
+                   get_slack_app_token, get_slack_bot_token,
+                   get_stage_budgets, get_workers)
+
+# Slack allows up to 10 Socket Mode connections per app token.
+MAX_WORKERS = 10
 
 
 def setup_logging():
-    """Setup logging configuration."""
-    log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    logging.basicConfig(level=logging.DEBUG, format=log_format)
+    """Setup logging configuration: LOG_LEVEL, LOG_FORMAT and sampling, written by a background thread."""
+    logs.setup_logging(get_log_level(), get_log_format(), get_log_sample_per_second())
 
 
-def setup_app() -> App:
+def setup_app(store=None) -> App:
     try:
         app = App(token=get_slack_bot_token())
         app.middleware(IgnoringSelfEvents())
+        app.middleware(IdempotentEvents(store or build_store()))
         return app
     except Exception as e:
         logging.error(f"Failed to setup the app: {e}")
 
 
-def setup_message_listeners(app):
-    @app.message()
-    def message(message, say):
+def setup_pipeline():
+    return build_pipeline(
+        get_pipeline_stages(),
+        get_pipeline_report_interval(),
+        deadline=get_event_deadline(),
+        budgets=get_stage_budgets(),
+    )
+
+
+def setup_sheet_writer():
+    """Start the Google Sheets writer logging scored alerts, if a Google Sheet is configured."""
+    spreadsheet_id = get_google_sheet_id()
+    if not spreadsheet_id:
+        return None
+    from lib.api.google.sheets import SheetsBatchWriter
+
+    return SheetsBatchWriter(spreadsheet_id, get_google_sheet_range())
+
+
+def summarize_to_slack(client):
+    """
+    Build the pipeline hook streaming the SRE summary of a message into a thread reply.
+
+    Parameters:
+        client (RateLimitedClient): The Slack Web API client of the dispatcher.
+
+    Returns:
+        callable: The hook, called with the processing context and the timeout, returning the summary text.
+    """
+
+    def summarize(context, timeout=None):
+        from lib.api.llm import get_llm
+
+        message = context["message"]
+        deadline = context.get("deadline")
+        # The summary is posted within the time left to the deadline, not held up by a Slack back-off.
+        return get_llm().stream_to_slack(
+            client.within(None if deadline is None else deadline.remaining()),
+            message["channel"],
+            message["text"],
+            thread_ts=message.get("thread_ts") or message.get("ts"),
+            update_interval=get_llm_stream_update_interval(),
+            timeout=timeout,
+        )
+
+    return summarize
+
+
+def build_sheet_row(message, context) -> list:
+    """
+    Build the Google Sheets row logging a message that went through the pipeline.
+
+    Parameters:
+        message (dict): The message.
+        context (dict): The processing context returned by the pipeline.
+
+    Returns:
+        list: The timestamp, channel, user, keywords, sentiment score and magnitude of the message.
+    """
+    processed_message = context.get("nlp") or {}
+    matches = context.get("matches") or []
+    return [
+        message.get("ts", ""),
+        message.get("channel", ""),
+        message.get("user", ""),
+        ",".join(match.keyword for match in matches),
+        processed_message.get("score", ""),
+        processed_message.get("magnitude", ""),
+    ]
+
+
+def build_alert_summary(group) -> list:
+    """
+    Build the Slack blocks summarizing the alerts coalesced in a window.
+
+    Parameters:
+        group (AlertGroup): The closed group of alerts.
+
+    Returns:
+        list: The keyword's template blocks followed by the count, first/last seen and worst sentiment.
+    """
+    fields = template_fields(
+        {"channel": group.channel},
+        group.keyword,
+        {"score": group.worst_score} if group.worst_score is not None else None,
+    )
+    blocks = list(get_keyword_blocks(group.keyword, fields) or [])
+    first_seen = int(group.first_seen)
+    last_seen = int(group.last_seen)
+    if group.worst_score is None:
+        worst = "not analyzed"
+    else:
+        worst = f"{process_score(group.worst_score)} ({group.worst_score:.2f})"
+    blocks.append(
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": (
+                        f"*{group.count}* alert(s) "
+                        f"first seen <!date^{first_seen}^{{time_secs}}|{first_seen}>, "
+                        f"last seen <!date^{last_seen}^{{time_secs}}|{last_seen}>, "
+                        f"worst sentiment {worst}"
+                    ),
+                }
+            ],
+        }
+    )
+    return blocks
+
+
+def setup_coalescer(client):
+    """Start the coalescing of keyword alerts, if an alert window is configured."""
+    window = get_alert_window()
+    if window <= 0:
+        return None
+
+    def send(group):
+        client.chat_postMessage(
+            channel=group.channel,
+            blocks=build_alert_summary(group),
+            text=f"{group.count} {group.keyword} alert(s)",
+        )
+
+    coalescer = AlertCoalescer(window, send)
+    atexit.register(coalescer.close)
+    return coalescer
+
+
+def coalesce(coalescer, context) -> bool:
+    """
+    Add a keyword alert to its window, the first alert of a window being replied to at once.
+
+    Parameters:
+        coalescer (AlertCoalescer): The alert coalescer, None when coalescing is disabled.
+        context (dict): The processing context of the message.
+
+    Returns:
+        bool: True if the message was folded into an open window, False if it should be replied to.
+    """
+    matches = context.get("matches")
+    if coalescer is None or not matches:
+        return False
+    message = context["message"]
+    processed_message = context.get("nlp") or {}
+    return coalescer.add(
+        matches[0].keyword,
+        message.get("channel"),
+        ts=message.get("ts"),
+        score=processed_message.get("score"),
+    )
+
+
+def log_replies(message, matches, processed_message):
+    """Log what a message is replied to with, the caller checking that DEBUG records are enabled."""
+    fields = {
+        "ts": message.get("ts"),
+        "user": message.get("user"),
+        "keywords": [match.keyword for match in matches],
+    }
+    if processed_message is not None:
+        fields["score"] = processed_message["score"]
+        fields["magnitude"] = processed_message["magnitude"]
+        # Only the names: formatting the entities of the Natural Language API is expensive.
+        fields["entities"] = [entity.name for entity in processed_message.get("entities") or ()]
+    logging.debug(
+        "Replying to %s of %s, keywords %s", fields["ts"], fields["user"], fields["keywords"], extra=fields
+    )
+
+
+def build_replies(message, context) -> list:
+    """
+    Build the replies of a message that went through the pipeline.
+
+    Parameters:
+        message (dict): The message to reply to.
+        context (dict): The processing context returned by the pipeline.
 
-        processed_message = process_message(message)
-        logging.debug(f"Sentinment Score: {processed_message['score']}")
-        logging.debug(f"Entities: {processed_message['entities']}")
+    Returns:
+        list: The keyword arguments of each reply to post.
+    """
+    replies = []
+    processed_message = context.get("nlp")
+    if processed_message is not None:
+        replies.append({"text": f"{process_score(processed_message['score'])}"})
 
-        say(f"{process_score(processed_message['score'])}")
+    matches = context.get("matches")
+    if matches is None:
+        matches = match_keywords(message)
+    if logging.root.isEnabledFor(logging.DEBUG):
+        log_replies(message, matches, processed_message)
 
-        score, magnitude = analyze_sentiment(message["text"])
-        entities = analyze_entities(message["text"])
+    blocks = process_message_for_keyword(message, matches, processed_message)
+    if blocks:
+        replies.append({"blocks": blocks})
+    return replies
 
-        logging.debug(f"Sentiment Score: {score}, Magnitude: {magnitude}")
-        logging.debug(f"Entities: {entities}")
-        logging.debug(f"User: {message['user']}")
-        logging.debug(f"Member: {check_member(message)}")
-        logging.debug(f"Keywords: {check_keyword(message)}")
 
-        say(blocks=process_message_for_keyword(message))
+def setup_actions(dispatcher, coalescer=None) -> ActionRegistry:
+    """
+    Register the handlers of the actions named by the routing rules.
+
+    Parameters:
+        dispatcher (SlackDispatcher): The dispatcher of outbound Slack calls.
+        coalescer (AlertCoalescer): The alert coalescer, None when coalescing is disabled.
+
+    Returns:
+        ActionRegistry: The registry of the handlers.
+    """
+    actions = ActionRegistry()
+
+    @actions.register("SlackSRE")
+    def reply(message, context):
+        if not coalesce(coalescer, context):
+            for kwargs in build_replies(message, context):
+                dispatcher.post_message(message["channel"], **kwargs)
+
+    return actions
+
+
+def run_actions(actions, message, context):
+    """Run the actions the routing rules resolve for a message that went through the pipeline."""
+    processed_message = context.get("nlp") or {}
+    names = resolve_actions(message, context.get("matches"), processed_message.get("score"))
+    logging.debug("Actions of %s: %s", message.get("ts"), names)
+    actions.run(names, message, context)
+
+
+def setup_dispatcher(client) -> SlackDispatcher:
+    """
+    Start the rate limited dispatcher of outbound Slack calls, flushed at exit.
+
+    The Slack rate limits are shared by the worker processes, so each worker gets its share of them.
+    """
+    workers = max(1, get_workers())
+    channel_rate, channel_burst = DEFAULT_CHANNEL_RATE
+    dispatcher = SlackDispatcher(
+        client,
+        channel_rate=(channel_rate / workers, channel_burst),
+        method_rates={method: (rate / workers, burst) for method, (rate, burst) in DEFAULT_METHOD_RATES.items()},
+    )
+    atexit.register(dispatcher.close)
+    return dispatcher
+
+
+def setup_metrics_collectors(pipeline, dispatcher, coalescer=None, sheet_writer=None, scheduler=None):
+    """Export the counters kept by the processing components on the metrics endpoint."""
+    from lib.api.google.language import cache_stats
+
+    def collect():
+        cache = cache_stats()
+        stages = pipeline.stats()
+        families = [
+            (
+                "mtpm_nlp_cache_events_total",
+                "counter",
+                "Natural Language API result cache hits, misses, evictions and expirations.",
+                [
+                    ({"cache": name, "event": event}, stats[event])
+                    for name, stats in cache.items()
+                    for event in ("hits", "misses", "disk_hits", "evictions", "expirations")
+                ],
+            ),
+            (
+                "mtpm_pipeline_stage_messages_total",
+                "counter",
+                "Messages that entered and passed each pipeline stage.",
+                [
+                    ({"stage": name, "result": result}, stats[result])
+                    for name, stats in stages.items()
+                    for result in ("entered", "passed")
+                ],
+            ),
+            (
+                "mtpm_slack_queue_depth",
+                "gauge",
+                "Outbound Slack calls waiting in the dispatcher.",
+                [({}, dispatcher.queue_depth())],
+            ),
+            (
+                "mtpm_slack_rate_limited_total",
+                "counter",
+                "Outbound Slack calls that got a 429 response.",
+                [({}, dispatcher.rate_limited)],
+            ),
+            (
+                "mtpm_duplicates_total",
+                "counter",
+                "Messages dropped as near-duplicates of a recent alert.",
+                [({}, get_duplicate_index().duplicates)],
+            ),
+            (
+                "mtpm_circuit_breaker_open",
+                "gauge",
+                "Whether the circuit breaker of an external API is open (1) or half open (0.5).",
+                [
+                    ({"breaker": name}, {"closed": 0, "half_open": 0.5, "open": 1}[breaker.state])
+                    for name, breaker in get_breakers().items()
+                ],
+            ),
+            (
+                "mtpm_startup_seconds",
+                "gauge",
+                "Seconds after the start of the process each startup phase was reached.",
+                [({"phase": phase}, seconds) for phase, seconds in startup_phases().items()],
+            ),
+        ]
+        if coalescer is not None:
+            families.append(
+                (
+                    "mtpm_coalesced_alerts_total",
+                    "counter",
+                    "Keyword alerts folded into window summaries after the first one of their window.",
+                    [({}, coalescer.hits)],
+                )
+            )
+        if scheduler is not None:
+            families.append(
+                (
+                    "mtpm_scheduler_queue_depth",
+                    "gauge",
+                    "Messages waiting in the scheduler, by priority.",
+                    [({"priority": priority}, depth) for priority, depth in scheduler.queue_depth().items()],
+                )
+            )
+        if sheet_writer is not None:
+            families.append(
+                (
+                    "mtpm_sheet_rows_total",
+                    "counter",
+                    "Google Sheets rows written and dropped.",
+                    [
+                        ({"result": "written"}, sheet_writer.rows_written),
+                        ({"result": "dropped"}, sheet_writer.rows_dropped),
+                    ],
+                )
+            )
+        return families
+
+    REGISTRY.register_collector(collect)
+
+
+def preload_sdks():
+    """Import the SDKs used by the configured backends in the background."""
+    modules = []
+    if get_nlp_backend() != "local":
+        modules.append("google.cloud.language_v2")
+    if "llm" in get_pipeline_stages():
+        providers = {get_llm_provider(), get_llm_hedge_provider()}
+        if "vertex" in providers:
+            modules.append("vertexai.generative_models")
+        if "openai" in providers:
+            modules.append("openai")
+    if get_google_sheet_id():
+        modules.append("googleapiclient.discovery")
+    return preload(modules)
+
+
+def setup_metrics_server(worker=0):
+    """Start the local metrics endpoint, if a metrics port is configured, on the next ports for the other workers."""
+    port = get_metrics_port()
+    if port:
+        return start_metrics_server(port + worker, profiling_enabled=get_metrics_profiling_enabled())
+    return None
+
+
+def setup_scheduler():
+    """Start the priority scheduler of the message processing, unless it is disabled, stopped at exit."""
+    low_workers = get_scheduler_low_workers()
+    if low_workers <= 0:
+        return None
+    scheduler = Scheduler(get_scheduler_high_workers(), low_workers, get_scheduler_aging())
+    atexit.register(scheduler.close)
+    return scheduler
+
+
+def message_priority(message, priority_channels=frozenset()) -> tuple:
+    """
+    Rate the priority and urgency of a message from the signals that are cheap to get at intake.
+
+    Parameters:
+        message (dict): The message.
+        priority_channels (frozenset): The IDs of the channels whose messages are more urgent.
+
+    Returns:
+        tuple: The priority, HIGH for the messages matching a keyword and LOW otherwise, the urgency,
+               2 for a keyword match plus 1 for an allowed member and 1 for a priority channel,
+               and the keyword matches, which the pipeline reuses.
+    """
+    matches = match_keywords(message) if message.get("text") else []
+    urgency = 2 if matches else 0
+    if message.get("user") and check_member(message):
+        urgency += 1
+    if message.get("channel") in priority_channels:
+        urgency += 1
+    return HIGH if matches else LOW, urgency, matches
+
+
+def setup_message_listeners(app, pipeline, sheet_writer=None, dispatcher=None, scheduler=None):
+    dispatcher = dispatcher or setup_dispatcher(app.client)
+    client = RateLimitedClient(dispatcher)
+    summarize = summarize_to_slack(client)
+    coalescer = setup_coalescer(client)
+    actions = setup_actions(dispatcher, coalescer)
+    priority_channels = get_priority_channels()
+    setup_metrics_collectors(pipeline, dispatcher, coalescer, sheet_writer, scheduler)
+
+    def process(message, matches=None, deadline=None, urgency=0):
+        context = pipeline.run(
+            message,
+            matches=matches,
+            deadline=deadline,
+            summarize=summarize,
+            on_duplicate=lambda context: coalesce(coalescer, context),
+        )
+        if context is not None:
+            run_actions(actions, message, context)
+            if sheet_writer is not None:
+                sheet_writer.append(build_sheet_row(message, context))
+            if scheduler is not None and context.get("summary_requested"):
+                # Streamed as its own low priority item, so that the high priority workers only
+                # take the messages from intake to the keyword reply.
+                scheduler.submit(pipeline.finish, context, priority=LOW, urgency=urgency)
+            else:
+                pipeline.finish(context)
+
+    @app.message()
+    def message(message):
+        mark_startup("first_event")
+        if scheduler is None:
+            process(message)
+            return
+        # The deadline starts at intake, the time waited in the scheduler counts against it.
+        deadline = pipeline.start_deadline()
+        priority, urgency, matches = message_priority(message, priority_channels)
+        scheduler.submit(process, message, matches, deadline, urgency, priority=priority, urgency=urgency)
 
     @app.message(re.compile("Help", re.IGNORECASE))
     def message_help(message, say):
@@ -66,16 +512,56 @@ def setup_slash_command_listeners(app):
         say(f"You used the command: {command['command']} with text: {command['text']}")
 
 
-def main():
+def start_workers(target, count):
+    """
+    Run the app in several worker processes connected with the same app token.
+
+    Slack spreads the events over the Socket Mode connections of the workers. The
+    workers share the idempotency store through a SQLite file, so that an event
+    redelivered to another worker is still handled once.
+
+    Parameters:
+        target (callable): The main function of a worker, called with its index.
+        count (int): The number of workers, 1 runs the app in this process.
+    """
+    if count > MAX_WORKERS:
+        logging.warning(f"Slack allows {MAX_WORKERS} Socket Mode connections per app, starting {MAX_WORKERS} workers.")
+        count = MAX_WORKERS
+    if count <= 1:
+        target(0)
+        return
+    if not get_idempotency_store_path():
+        os.environ["IDEMPOTENCY_STORE_PATH"] = os.path.join(tempfile.gettempdir(), "mtpm-idempotency.sqlite3")
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=target, args=(worker,), name=f"worker-{worker}") for worker in range(count)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+def main(worker=0):
     setup_logging()
+    mark_startup("imported")
     app = setup_app()
     if app is not None:
-        setup_message_listeners(app)
+        setup_message_listeners(app, setup_pipeline(), setup_sheet_writer(), scheduler=setup_scheduler())
         setup_slash_command_listeners(app)
+        config.start(get_config_reload_interval())
+        setup_metrics_server(worker)
+        mark_startup("ready")
+        preload_sdks()
         SocketModeHandler(app, get_slack_app_token()).start()
     else:
         logging.error("Failed to setup the app.")
 
 
 if __name__ == "__main__":
-    main()
+    start_workers(main, get_workers())
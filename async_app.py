@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Asyncio mode of the application built on slack_bolt's AsyncApp.
+
+Bolt acknowledges each event before the listener runs, and every listener
+runs as its own task, so slow Natural Language API calls no longer hold up
+the events behind them. The number of messages processed at once is capped
+by MAX_IN_FLIGHT.
+"""
+
+import asyncio
+import logging
+import re
+
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_bolt.async_app import AsyncApp
+from slack_sdk import WebClient
+
+from app import (build_sheet_row, coalesce, preload_sdks, run_actions,
+                 setup_actions, setup_coalescer, setup_dispatcher,
+                 setup_logging, setup_metrics_collectors, setup_metrics_server,
+                 setup_pipeline, setup_sheet_writer, start_workers,
+                 summarize_to_slack)
+from dispatch import RateLimitedClient
+from idempotency import AsyncIdempotentEvents, build_store
+from message import config
+from startup import mark_startup
+from utils import (get_config_reload_interval, get_max_in_flight, get_slack_app_token,
+                   get_slack_bot_token, get_workers)
+
+
+def setup_app(store=None) -> AsyncApp:
+    try:
+        app = AsyncApp(token=get_slack_bot_token())
+        app.middleware(AsyncIdempotentEvents(store or build_store()))
+        return app
+    except Exception as e:
+        logging.error(f"Failed to setup the app: {e}")
+
+
+def setup_message_listeners(app, pipeline, max_in_flight, sheet_writer=None):
+    in_flight = asyncio.Semaphore(max_in_flight)
+    # Outbound calls go through the rate limited dispatcher's worker thread,
+    # which uses a synchronous client.
+    dispatcher = setup_dispatcher(WebClient(token=get_slack_bot_token()))
+    client = RateLimitedClient(dispatcher)
+    summarize = summarize_to_slack(client)
+    coalescer = setup_coalescer(client)
+    actions = setup_actions(dispatcher, coalescer)
+    setup_metrics_collectors(pipeline, dispatcher, coalescer, sheet_writer)
+
+    @app.message()
+    async def message(message):
+        mark_startup("first_event")
+        # The deadline starts before the wait for a slot, which counts against it.
+        deadline = pipeline.start_deadline()
+        async with in_flight:
+            context = await pipeline.run_async(
+                message,
+                deadline=deadline,
+                summarize=summarize,
+                on_duplicate=lambda context: coalesce(coalescer, context),
+            )
+            if context is not None:
+                run_actions(actions, message, context)
+                if sheet_writer is not None:
+                    sheet_writer.append(build_sheet_row(message, context))
+                await pipeline.finish_async(context)
+
+    @app.message(re.compile("Help", re.IGNORECASE))
+    async def message_help(message, say):
+        pass
+
+
+def setup_slash_command_listeners(app):
+    @app.command("/help")
+    async def command_echo(ack, say, command):
+        await ack()
+        await say(
+            f"You used the command: {command['command']} with text: {command['text']}"
+        )
+
+
+async def main(worker=0):
+    setup_logging()
+    mark_startup("imported")
+    app = setup_app()
+    if app is not None:
+        setup_message_listeners(
+            app, setup_pipeline(), get_max_in_flight(), setup_sheet_writer()
+        )
+        setup_slash_command_listeners(app)
+        config.start(get_config_reload_interval())
+        setup_metrics_server(worker)
+        mark_startup("ready")
+        preload_sdks()
+        await AsyncSocketModeHandler(app, get_slack_app_token()).start_async()
+    else:
+        logging.error("Failed to setup the app.")
+
+
+def run_worker(worker):
+    asyncio.run(main(worker))
+
+
+if __name__ == "__main__":
+    start_workers(run_worker, get_workers())
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Backfill of the messages posted while the app was not listening.
+
+The history of each channel, and the replies of its threads, are streamed page
+by page from `conversations.history` and `conversations.replies` and handled
+by the same listener as live messages, on a bounded pool of worker threads.
+Only one page per channel is held in memory at a time.
+
+The progress of each channel is checkpointed to a JSON file after every page,
+so an interrupted run resumes where it stopped. Slack returns the newest
+messages first, so a run walks each channel from now back to the end of the
+previous run:
+
+    {"C0123": {"done": "1700000000.000100", "newest": "1700003600.000200", "latest": "1700001800.000300"}}
+
+`done` is the newest message handled by the last complete run, `newest` the
+newest message of the current run and `latest` the oldest message it handled
+so far. When the run reaches `done`, `newest` becomes the new `done`.
+
+Messages the handler failed on are listed in `failed`, with the parent of the
+thread for a reply, and are fetched and handled again first by the next run:
+
+    {"C0123": {"done": "1700000000.000100", "failed": [{"ts": "1699999000.000200", "thread_ts": "1699998000.000100"}]}}
+
+A thread started before `done` may have new replies, but its parent message is
+not in the history after `done`. Once a channel reached `done`, its history
+over the thread lookback period before `done` is walked as well, for the
+threads whose latest reply is newer than `done`.
+
+Messages are claimed in the idempotency store of the app before they are
+handled, so with a shared IDEMPOTENCY_STORE_PATH the messages the app or an
+earlier run already handled are skipped.
+
+Usage:
+    python backfill.py --since 86400
+    python backfill.py --channel C0123 --channel C0456 --workers 8
+    python backfill.py --base-url http://127.0.0.1:8080/api/ --checkpoint /tmp/checkpoint.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from idempotency import build_store, message_key
+
+PAGE_SIZE = 200
+THREAD_LOOKBACK = 7 * 86400
+
+
+class Checkpoints:
+    """Progress of the backfill of each channel, written atomically to a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as file:
+                self._channels = json.load(file)
+        except FileNotFoundError:
+            self._channels = {}
+
+    def get(self, channel) -> dict:
+        with self._lock:
+            return dict(self._channels.get(channel, {}))
+
+    def update(self, channel, **values):
+        """Update the checkpoint of a channel, None values removing their key, and save the file."""
+        with self._lock:
+            checkpoint = self._channels.setdefault(channel, {})
+            for key, value in values.items():
+                if value is None:
+                    checkpoint.pop(key, None)
+                else:
+                    checkpoint[key] = value
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".checkpoint-", suffix=".json")
+        try:
+            with os.fdopen(descriptor, "w") as file:
+                json.dump(self._channels, file, indent=2, sort_keys=True)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+
+def iter_pages(method, key, **kwargs):
+    """
+    Stream the pages of a paginated Slack Web API method.
+
+    Parameters:
+        method (callable): The WebClient method, e.g. `client.conversations_history`.
+        key (str): The key of the items in the responses.
+        **kwargs: The arguments of the method.
+
+    Yields:
+        list: The items of each page.
+    """
+    cursor = None
+    while True:
+        response = method(cursor=cursor, **kwargs) if cursor else method(**kwargs)
+        yield response.get(key, [])
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            return
+
+
+def iter_history(client, channel, oldest=None, latest=None, limit=PAGE_SIZE):
+    """
+    Stream the pages of the history of a channel, newest messages first.
+
+    Parameters:
+        client (WebClient): The Slack Web API client.
+        channel (str): The ID of the channel.
+        oldest (str): Only messages after this timestamp.
+        latest (str): Only messages before this timestamp.
+        limit (int): The maximum number of messages per page.
+
+    Yields:
+        list: The messages of each page, with their channel.
+    """
+    kwargs = {"channel": channel, "limit": limit}
+    if oldest:
+        kwargs["oldest"] = oldest
+    if latest:
+        kwargs["latest"] = latest
+    for page in iter_pages(client.conversations_history, "messages", **kwargs):
+        yield [dict(message, channel=channel) for message in page]
+
+
+def iter_replies(client, channel, thread_ts, oldest=None, limit=PAGE_SIZE):
+    """
+    Stream the replies of a thread, without its parent message.
+
+    Parameters:
+        client (WebClient): The Slack Web API client.
+        channel (str): The ID of the channel.
+        thread_ts (str): The timestamp of the parent message.
+        oldest (str): Only replies after this timestamp.
+        limit (int): The maximum number of replies per page.
+
+    Yields:
+        dict: Each reply, with its channel.
+    """
+    kwargs = {"channel": channel, "ts": thread_ts, "limit": limit}
+    if oldest:
+        kwargs["oldest"] = oldest
+    for page in iter_pages(client.conversations_replies, "messages", **kwargs):
+        for message in page:
+            if message.get("ts") != thread_ts:
+                yield dict(message, channel=channel)
+
+
+def fetch_message(client, channel, ts, thread_ts=None):
+    """
+    Fetch a single message.
+
+    Parameters:
+        client (WebClient): The Slack Web API client.
+        channel (str): The ID of the channel.
+        ts (str): The timestamp of the message.
+        thread_ts (str): The timestamp of the parent message, for a thread reply.
+
+    Returns:
+        dict: The message with its channel, None if it no longer exists.
+    """
+    kwargs = {"channel": channel, "oldest": ts, "latest": ts, "inclusive": True, "limit": 1}
+    if thread_ts:
+        response = client.conversations_replies(ts=thread_ts, **dict(kwargs, limit=2))
+    else:
+        response = client.conversations_history(**kwargs)
+    for message in response.get("messages", []):
+        if message.get("ts") == ts:
+            return dict(message, channel=channel)
+    return None
+
+
+def iter_member_channels(client):
+    """Stream the IDs of the channels the app is a member of."""
+    for page in iter_pages(
+        client.users_conversations, "channels", types="public_channel,private_channel", limit=PAGE_SIZE
+    ):
+        for channel in page:
+            yield channel["id"]
+
+
+class Backfill:
+    """Feeds the missed messages of channels to the message listener."""
+
+    def __init__(self, client, handler, checkpoints, workers=4, store=None, thread_lookback=THREAD_LOOKBACK):
+        """
+        Parameters:
+            client (WebClient): The Slack Web API client.
+            handler (callable): The message listener, called with `message=`.
+            checkpoints (Checkpoints): The progress of each channel.
+            workers (int): The number of messages handled concurrently.
+            store (SQLiteIdempotencyStore): The idempotency store shared with the app, so that
+                                            messages it already handled are skipped.
+            thread_lookback (float): Number of seconds before the start of the backfill of a channel
+                                     in which threads are checked for new replies, 0 to disable.
+        """
+        self.client = client
+        self.handler = handler
+        self.checkpoints = checkpoints
+        self.store = store
+        self.thread_lookback = thread_lookback
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill")
+        self.handled = 0
+        self.skipped = 0
+        self.failed = 0
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def run_channel(self, channel, since):
+        """
+        Backfill a channel from its checkpoint, or from `since` for a new channel.
+
+        Parameters:
+            channel (str): The ID of the channel.
+            since (str): The timestamp to start from when the channel has no checkpoint.
+        """
+        checkpoint = self.checkpoints.get(channel)
+        oldest = checkpoint.get("done", since)
+        latest = checkpoint.get("latest")
+        newest = checkpoint.get("newest")
+        logging.info(f"Backfilling {channel} after {oldest}" + (f", resuming before {latest}" if latest else ""))
+
+        self._retry_failures(channel, checkpoint.get("failed", []))
+        self.checkpoints.update(channel, failed=self._failures_of(channel))
+        for page in iter_history(self.client, channel, oldest=oldest, latest=latest):
+            if not page:
+                continue
+            newest = newest or page[0]["ts"]
+            self._handle_page(channel, page, oldest)
+            self.checkpoints.update(
+                channel, newest=newest, latest=page[-1]["ts"], failed=self._failures_of(channel)
+            )
+        self._handle_earlier_threads(channel, oldest)
+        self.checkpoints.update(
+            channel, done=newest or oldest, newest=None, latest=None, failed=self._failures_of(channel)
+        )
+
+    def _retry_failures(self, channel, failures):
+        """Fetch and handle again the messages a previous run failed on."""
+        if failures:
+            logging.info(f"Retrying {len(failures)} messages of {channel} that failed before")
+        futures = [
+            self.executor.submit(self._retry, channel, failure["ts"], failure.get("thread_ts"))
+            for failure in failures
+        ]
+        for future in futures:
+            future.result()
+
+    def _retry(self, channel, ts, thread_ts=None):
+        try:
+            message = fetch_message(self.client, channel, ts, thread_ts)
+        except Exception as e:
+            logging.error(f"Failed to fetch message {ts} of {channel}: {e}")
+            self._record_failure({"channel": channel, "ts": ts, "thread_ts": thread_ts})
+            return
+        if message is None:
+            logging.info(f"Message {ts} of {channel} no longer exists, not retried")
+            return
+        self._handle(message)
+
+    def _record_failure(self, message):
+        failure = {"ts": message["ts"]}
+        if message.get("thread_ts") and message["thread_ts"] != message["ts"]:
+            failure["thread_ts"] = message["thread_ts"]
+        with self._lock:
+            self.failed += 1
+            self._failures.setdefault(message.get("channel"), []).append(failure)
+
+    def _failures_of(self, channel):
+        """Return the messages of a channel the handler failed on, None if there are none."""
+        with self._lock:
+            return list(self._failures.get(channel, ())) or None
+
+    def _handle_page(self, channel, page, oldest, threads_only=False):
+        """Handle the messages of a page and the replies of its threads, waiting for all of them."""
+        futures = []
+        for message in page:
+            if not threads_only:
+                futures.append(self.executor.submit(self._handle, message))
+            if message.get("reply_count") and float(message.get("latest_reply", 0)) > float(oldest or 0):
+                futures.append(self.executor.submit(self._handle_thread, channel, message["ts"], oldest))
+        for future in futures:
+            future.result()
+
+    def _handle_earlier_threads(self, channel, oldest):
+        """Handle the replies after `oldest` of the threads started within the thread lookback before it."""
+        if not self.thread_lookback or not oldest:
+            return
+        start = f"{float(oldest) - self.thread_lookback:.6f}"
+        for page in iter_history(self.client, channel, oldest=start, latest=oldest):
+            self._handle_page(channel, page, oldest, threads_only=True)
+
+    def _handle_thread(self, channel, thread_ts, oldest):
+        for reply in iter_replies(self.client, channel, thread_ts, oldest=oldest):
+            self._handle(reply)
+
+    def _handle(self, message):
+        key = message_key(message) if self.store is not None else None
+        if key is not None and not self.store.claim(key):
+            with self._lock:
+                self.skipped += 1
+            return
+        try:
+            self.handler(message=message)
+            with self._lock:
+                self.handled += 1
+        except Exception as e:
+            logging.error(f"Failed to backfill message {message.get('ts')} of {message.get('channel')}: {e}")
+            if key is not None:
+                # Released so that a rerun handles the message instead of skipping it as already handled.
+                self.store.release(key)
+            self._record_failure(message)
+
+    def run(self, channels, since):
+        """Backfill each channel in turn."""
+        for channel in channels:
+            start = time.perf_counter()
+            self.run_channel(channel, since)
+            logging.info(f"Backfilled {channel} in {time.perf_counter() - start:.1f}s")
+        return self.handled
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channel", action="append", help="channel to backfill, defaults to every channel the app is a member of")
+    parser.add_argument("--since", type=float, default=86400, help="seconds of history to backfill for channels without checkpoint")
+    parser.add_argument("--workers", type=int, default=4, help="number of messages handled concurrently")
+    parser.add_argument(
+        "--thread-lookback", type=float, default=THREAD_LOOKBACK,
+        help="seconds before the start of a channel's backfill in which threads are checked for new replies",
+    )
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json", help="JSON file of the progress of each channel")
+    parser.add_argument("--base-url", help="Slack Web API base URL, e.g. of a local fake API")
+    args = parser.parse_args()
+
+    from slack_sdk import WebClient
+    from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
+
+    import app
+    from message import config
+    from replay import ReplayApp
+    from utils import get_config_reload_interval, get_slack_bot_token
+
+    app.setup_logging()
+    client_kwargs = {"base_url": args.base_url} if args.base_url else {}
+    client = WebClient(token=get_slack_bot_token(), **client_kwargs)
+    client.retry_handlers.append(RateLimitErrorRetryHandler(max_retry_count=5))
+
+    replay_app = ReplayApp(client)
+    dispatcher = app.setup_dispatcher(client)
+    sheet_writer = app.setup_sheet_writer()
+    app.setup_message_listeners(replay_app, app.setup_pipeline(), sheet_writer, dispatcher)
+    config.start(get_config_reload_interval())
+
+    backfill = Backfill(
+        client,
+        replay_app.message_listeners[0],
+        Checkpoints(args.checkpoint),
+        args.workers,
+        build_store(),
+        args.thread_lookback,
+    )
+    try:
+        backfill.run(args.channel or iter_member_channels(client), f"{time.time() - args.since:.6f}")
+    finally:
+        backfill.close()
+        dispatcher.close()
+        if sheet_writer is not None:
+            sheet_writer.close()
+    logging.info(
+        f"Backfilled {backfill.handled} messages, {backfill.skipped} already handled, {backfill.failed} failed"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Offline replay benchmark of the message handler.
+
+Slack message events are replayed from a JSONL file, or generated, through the
+listener registered by `setup_message_listeners`. The Google Cloud Natural
+Language API, the LLM providers and Slack are replaced by local stub clients with
+configurable latency distributions, so the benchmark runs without network
+access. It reports the throughput and the p50/p95/p99 latencies of the main
+steps and, by priority, from the arrival of each event to the end of its
+processing.
+
+Usage:
+    python benchmark.py --synthetic 5000 --concurrency 8 --nlp-latency lognormal:40:0.5
+    python benchmark.py --events recorded_events.jsonl --json
+"""
+
+import argparse
+import atexit
+import json
+import os
+import random
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from replay import ReplayApp
+
+SYNTHETIC_CHATTER = [
+    "thanks!",
+    "looking now",
+    "can someone review my PR?",
+    "lunch?",
+    "the new build looks good to me",
+    "I'll be out tomorrow",
+]
+SYNTHETIC_ALERTS = [
+    "Bitrise build #{n} failed on main (commit {sha}) after {m} minutes",
+    "Firebase Test Lab is experiencing disruption on x86 virtual devices, incident {n}",
+    "github actions are queued for {m} minutes, workflow run {n}",
+]
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution, in milliseconds.
+
+    Parameters:
+        spec (str): 'fixed:MS', 'uniform:MIN:MAX', 'exp:MEAN' or 'lognormal:MEDIAN:SIGMA'.
+
+    Returns:
+        callable: Returns a latency sample in seconds.
+    """
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "exp":
+        return lambda: random.expovariate(1 / values[0]) / 1000 if values[0] else 0.0
+    if kind == "lognormal":
+        import math
+
+        return lambda: random.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class Timings:
+    """Thread-safe collection of latency samples by name."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def wrap(self, name, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+
+        return timed
+
+    def report(self) -> dict:
+        report = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            report[name] = {
+                "count": len(ordered),
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+        return report
+
+
+def percentile(ordered, percent) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class StubLanguageClient:
+    """Local stand-in for LanguageServiceClient returning a fixed-shape response after a sampled latency."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def _respond(self, request, timeout=None):
+        latency = self.latency()
+        if timeout is not None and latency > timeout:
+            from google.api_core.exceptions import DeadlineExceeded
+
+            time.sleep(timeout)
+            raise DeadlineExceeded("Stub request timed out")
+        time.sleep(latency)
+        text = request["document"].content
+        score = (len(text) % 21 - 10) / 10
+        return types.SimpleNamespace(
+            document_sentiment=types.SimpleNamespace(score=score, magnitude=abs(score) * 2),
+            entities=[],
+        )
+
+    annotate_text = analyze_sentiment = analyze_entities = _respond
+
+
+class StubSlackClient:
+    """Local stand-in for the Slack WebClient."""
+
+    def __init__(self, latency, timings):
+        self.latency = latency
+        self.timings = timings
+        self._ts = 0
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        start = time.perf_counter()
+        time.sleep(self.latency())
+        self.timings.add(f"slack.{name}", time.perf_counter() - start)
+        with self._lock:
+            self._ts += 1
+            return {"ok": True, "ts": f"{self._ts}.000000"}
+
+    def chat_postMessage(self, **kwargs):
+        return self._call("chat_postMessage")
+
+    def chat_update(self, **kwargs):
+        return self._call("chat_update")
+
+
+def synthetic_events(count, channels, users, alert_ratio):
+    """Generate Slack message events mixing chatter and near-duplicate alerts."""
+    for index in range(count):
+        if random.random() < alert_ratio:
+            text = random.choice(SYNTHETIC_ALERTS).format(
+                n=random.randint(1000, 9999),
+                m=random.randint(1, 59),
+                sha="%09x" % random.getrandbits(36),
+            )
+        else:
+            text = random.choice(SYNTHETIC_CHATTER)
+        yield {
+            "type": "message",
+            "channel": random.choice(channels),
+            "user": random.choice(users),
+            "text": text,
+            "ts": f"{1700000000 + index}.{index % 1000000:06d}",
+        }
+
+
+def recorded_events(path):
+    """Read Slack message events from a JSONL file of events or Events API envelopes."""
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                yield event.get("event", event)
+
+
+def run(args) -> dict:
+    os.environ["PIPELINE_STAGES"] = args.stages
+    os.environ["ALERT_WINDOW_SECONDS"] = str(args.alert_window)
+    os.environ["NLP_CACHE_SIZE"] = str(args.nlp_cache_size)
+    os.environ["EVENT_DEADLINE_SECONDS"] = str(args.deadline)
+    os.environ["STAGE_BUDGETS"] = args.stage_budgets
+    os.environ.pop("NLP_CACHE_PATH", None)
+    os.environ.pop("GOOGLE_SHEET_ID", None)
+    os.environ["LOG_LEVEL"] = args.log_level
+    os.environ["LOG_FORMAT"] = args.log_format
+    os.environ["SCHEDULER_HIGH_WORKERS"] = str(args.scheduler_high_workers)
+    os.environ["SCHEDULER_LOW_WORKERS"] = str(args.scheduler_low_workers)
+    random.seed(args.seed)
+
+    timings = Timings()
+
+    from lib.api import llm
+    from lib.api.google import language
+
+    language.set_language_client(StubLanguageClient(parse_latency(args.nlp_latency)))
+    hedge = None
+    if args.llm_hedge_latency:
+        hedge = llm.FakeProvider(parse_latency(args.llm_hedge_latency))
+    llm.set_llm(
+        llm.LLMRouter(
+            llm.FakeProvider(parse_latency(args.llm_latency)),
+            hedge,
+            hedge_percentile=args.llm_hedge_percentile,
+        )
+    )
+
+    import app
+    import message
+    from dispatch import SlackDispatcher
+
+    app.setup_logging()
+    # The SDKs are imported on first use: imported up front so that no timed step includes the import.
+    app.preload_sdks().join()
+
+    if args.events:
+        events = list(recorded_events(args.events))
+    else:
+        events = list(
+            synthetic_events(
+                args.synthetic,
+                [f"C{index:04d}" for index in range(args.channels)],
+                [f"U{index:04d}" for index in range(args.users)],
+                args.alert_ratio,
+            )
+        )
+    message.config.load()
+    if args.allow_all_members:
+        snapshot = message.config.current()
+        users = frozenset(event.get("user") for event in events if event.get("user"))
+        message.config._snapshot = snapshot._replace(members=snapshot.members | users)
+    # Classified before the steps are timed, so that the keyword scans it takes are not reported.
+    priorities = {id(event): app.message_priority(event)[0] for event in events}
+
+    message.find_keywords = timings.wrap("contains_keywords", message.find_keywords)
+    message.annotate_text = timings.wrap("nlp.annotate_text", message.annotate_text)
+    registry_class = message.reloader_module.template.TemplateRegistry
+    registry_class.get = timings.wrap("build_template", registry_class.get)
+    registry_class.render = timings.wrap("render_template", registry_class.render)
+    formatter = message.slack_module.SlackMessageFormatter
+    formatter.format_slack_message = staticmethod(
+        timings.wrap("format_slack_message", formatter.format_slack_message)
+    )
+
+    slack_client = StubSlackClient(parse_latency(args.slack_latency), timings)
+    dispatcher = SlackDispatcher(
+        slack_client,
+        channel_rate=(args.slack_rate, args.slack_rate),
+        method_rates={
+            "chat_postMessage": (args.slack_rate, args.slack_rate),
+            "chat_update": (args.slack_rate, args.slack_rate),
+        },
+    )
+    # Time from the arrival of an event to the end of its processing, by priority, which
+    # is what the scheduler changes (with it, the listener itself only queues the message).
+    received = {}
+    pipeline = app.setup_pipeline()
+    run_pipeline = pipeline.run
+
+    def timed_run(event, **context):
+        try:
+            return run_pipeline(event, **context)
+        finally:
+            timings.add(f"queued_to_done.{priorities[id(event)]}", time.perf_counter() - received[id(event)])
+
+    pipeline.run = timed_run
+    replay_app = ReplayApp(slack_client)
+    scheduler = app.setup_scheduler()
+    # Closed at exit after the alert coalescer registered by the listeners, which sends its summaries through it.
+    atexit.register(dispatcher.close)
+    app.setup_message_listeners(replay_app, pipeline, dispatcher=dispatcher, scheduler=scheduler)
+    listener = replay_app.message_listeners[0]
+
+    def receive(event):
+        received[id(event)] = time.perf_counter()
+        return executor.submit(listener, message=event)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [receive(event) for event in events]:
+            future.result()
+    if scheduler is not None:
+        scheduler.close(timeout=3600)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "events": len(events),
+        "seconds": elapsed,
+        "events_per_second": len(events) / elapsed if elapsed else 0.0,
+        "latency": timings.report(),
+    }
+
+
+def print_report(report):
+    print(
+        f"{report['events']} events in {report['seconds']:.3f}s "
+        f"({report['events_per_second']:.1f} events/s)"
+    )
+    print(f"{'step':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in report["latency"].items():
+        print(
+            f"{name:<24}{stats['count']:>8}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+            f"{stats['p99_ms']:>10.3f}{stats['max_ms']:>10.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--events", help="JSONL file of recorded Slack message events")
+    source.add_argument("--synthetic", type=int, default=2000, help="number of synthetic events")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of handler threads")
+    parser.add_argument("--stages", default="self,member,keyword,dedup,nlp")
+    parser.add_argument("--allow-all-members", action="store_true", help="treat every replayed user as an allowed member")
+    parser.add_argument("--alert-window", type=float, default=0, help="alert coalescing window in seconds")
+    parser.add_argument("--nlp-cache-size", type=int, default=1024)
+    parser.add_argument("--deadline", type=float, default=10.0, help="seconds allowed per event")
+    parser.add_argument("--stage-budgets", default="nlp=2,llm=6", help="seconds allowed per external API stage")
+    parser.add_argument("--nlp-latency", default="lognormal:40:0.5", help="Natural Language API latency (ms)")
+    parser.add_argument("--llm-latency", default="lognormal:1500:0.4", help="LLM provider latency (ms)")
+    parser.add_argument("--llm-hedge-latency", help="hedge LLM provider latency (ms), hedging is disabled without it")
+    parser.add_argument("--llm-hedge-percentile", type=float, default=95.0)
+    parser.add_argument("--slack-latency", default="lognormal:80:0.3", help="Slack Web API latency (ms)")
+    parser.add_argument("--slack-rate", type=float, default=1000.0, help="outbound Slack calls per second")
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--alert-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING", help="log level of the handler, e.g. DEBUG to measure the logging cost")
+    parser.add_argument("--log-format", default="text", choices=("text", "json"))
+    parser.add_argument("--scheduler-high-workers", type=int, default=2, help="workers processing high priority messages only")
+    parser.add_argument(
+        "--scheduler-low-workers", type=int, default=0, help="workers processing any message, 0 processes in the handler threads"
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Time-window coalescing of keyword alerts.
+
+The first hit of a keyword in a channel is replied to at once and opens a
+window. Every later hit of the same keyword in the same channel until the
+window closes is folded into one group, and a single summary is sent when the
+window closes instead of one reply per message. No summary is sent for a
+window without later hits.
+"""
+
+import logging
+import threading
+import time
+
+
+class AlertGroup:
+    """The hits of a keyword in a channel during one window."""
+
+    __slots__ = ("keyword", "channel", "count", "first_seen", "last_seen", "worst_score")
+
+    def __init__(self, keyword, channel, seen):
+        self.keyword = keyword
+        self.channel = channel
+        self.count = 0
+        self.first_seen = seen
+        self.last_seen = seen
+        self.worst_score = None
+
+    def add(self, seen, score=None):
+        self.count += 1
+        self.first_seen = min(self.first_seen, seen)
+        self.last_seen = max(self.last_seen, seen)
+        if score is not None and (self.worst_score is None or score < self.worst_score):
+            self.worst_score = score
+
+
+class AlertCoalescer:
+    def __init__(self, window, send):
+        """
+        Parameters:
+            window (float): Number of seconds hits are collected before the summary is sent.
+            send (callable): Called with each closed AlertGroup.
+        """
+        self.window = window
+        self.send = send
+        self.groups_sent = 0
+        self.hits = 0
+        self._groups = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add(self, keyword, channel, ts=None, score=None) -> bool:
+        """
+        Add a hit of a keyword to the group of its channel, opening a window if there is none.
+
+        Parameters:
+            keyword (str): The matched keyword.
+            channel (str): The channel of the message.
+            ts (str): The Slack timestamp of the message, defaults to now.
+            score (float): The sentiment score of the message, if it was analyzed.
+
+        Returns:
+            bool: True if the hit was folded into an open window, False if it opened the window
+                  and should be replied to at once.
+        """
+        seen = float(ts) if ts else time.time()
+        key = (keyword, channel)
+        with self._lock:
+            group = self._groups.get(key)
+            folded = group is not None
+            if group is None:
+                group = AlertGroup(keyword, channel, seen)
+                self._groups[key] = group
+                timer = threading.Timer(self.window, self.flush, args=(key,))
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+            else:
+                self.hits += 1
+            group.add(seen, score)
+        return folded
+
+    def flush(self, key):
+        """
+        Close the window of a group and send its summary.
+
+        Parameters:
+            key (tuple): The keyword and channel of the group.
+        """
+        with self._lock:
+            group = self._groups.pop(key, None)
+            timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if group is None or group.count < 2:
+            return
+        try:
+            self.send(group)
+            self.groups_sent += 1
+        except Exception as e:
+            logging.error(f"Failed to send the summary of {group.count} {group.keyword} alerts: {e}")
+
+    def close(self):
+        """Send the summaries of every open window."""
+        with self._lock:
+            keys = list(self._groups)
+        for key in keys:
+            self.flush(key)
+
+    def open_windows(self) -> int:
+        """Return the number of windows currently collecting hits."""
+        return len(self._groups)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Per-event deadlines and circuit breakers around the external APIs.
+
+Every message gets a `Deadline` when it enters the pipeline. The calls to the
+Natural Language API and to the LLM providers are given the smaller of their
+stage budget and the time left to the deadline as timeout, so the keyword
+template reply always goes out within a bounded time.
+
+A `CircuitBreaker` per external API tracks the recent calls. When too many of
+them failed (timeouts included) or were slow, it opens and the calls are
+skipped for a cooldown period: the messages take the fast path, local analysis
+and the keyword template only. After the cooldown, a single trial call decides
+whether the breaker closes again.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import REGISTRY
+from utils import (get_breaker_cooldown, get_breaker_error_rate,
+                   get_breaker_slow_rate, get_event_deadline, get_stage_budgets)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+degraded = REGISTRY.counter(
+    "mtpm_degraded_total", "Messages that skipped an external API call, by stage and reason."
+)
+
+
+class BreakerOpen(Exception):
+    """A call skipped because the circuit breaker of its API is open."""
+
+
+class Deadline:
+    """The time left to process an event, split into per-stage budgets."""
+
+    def __init__(self, seconds, budgets=None, now=None):
+        """
+        Parameters:
+            seconds (float): The time allowed for the whole event.
+            budgets (dict): The maximum number of seconds of each stage, keyed by stage name.
+            now (float): The start time, defaults to the monotonic clock.
+        """
+        self.started = time.monotonic() if now is None else now
+        self.expires = self.started + seconds
+        self.budgets = budgets or {}
+
+    def remaining(self, now=None) -> float:
+        """Return the number of seconds left to the deadline, 0 once it passed."""
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.expires - now)
+
+    def expired(self, now=None) -> bool:
+        return self.remaining(now) <= 0
+
+    def budget(self, stage, now=None) -> float:
+        """
+        Return the timeout of a stage: its budget, capped by the time left to the deadline.
+
+        Parameters:
+            stage (str): The name of the stage.
+            now (float): The current time, defaults to the monotonic clock.
+
+        Returns:
+            float: The number of seconds the stage may take, 0 if it must be skipped.
+        """
+        remaining = self.remaining(now)
+        budget = self.budgets.get(stage)
+        return remaining if budget is None else min(budget, remaining)
+
+
+class CircuitBreaker:
+    """Skips the calls to an external API while its recent error or slow call rates are too high."""
+
+    def __init__(
+        self, name, slow_call_seconds, error_rate=0.5, slow_rate=0.5, window=20, min_calls=10, cooldown=30.0
+    ):
+        """
+        Parameters:
+            name (str): The name of the API, used in logs and metrics.
+            slow_call_seconds (float): Calls taking longer than this are slow.
+            error_rate (float): The failed call rate over the window that opens the breaker.
+            slow_rate (float): The slow call rate over the window that opens the breaker.
+            window (int): The number of recent calls the rates are computed over.
+            min_calls (int): The minimum number of calls in the window before the breaker may open.
+            cooldown (float): Number of seconds the breaker stays open before a trial call.
+        """
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened = 0
+        self._calls = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self, now=None) -> bool:
+        """
+        Check whether a call may be made. In the half-open state only one trial call is allowed.
+
+        Parameters:
+            now (float): The current time, defaults to the monotonic clock.
+
+        Returns:
+            bool: True if the call may be made, False if it must be skipped.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self._opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._trial = False
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, seconds, failed, now=None):
+        """
+        Record the outcome of a call.
+
+        Parameters:
+            seconds (float): The duration of the call.
+            failed (bool): Whether the call failed.
+            now (float): The current time, defaults to the monotonic clock.
+        """
+        now = time.monotonic() if now is None else now
+        slow = seconds > self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.state = CLOSED
+                    self._calls.clear()
+                    logging.info(f"Circuit breaker {self.name} closed.")
+                return
+            self._calls.append((failed, slow))
+            if self.state == CLOSED and len(self._calls) >= self.min_calls:
+                errors = sum(1 for call_failed, _ in self._calls if call_failed) / len(self._calls)
+                slows = sum(1 for _, call_slow in self._calls if call_slow) / len(self._calls)
+                if errors >= self.error_rate or slows >= self.slow_rate:
+                    self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = now
+        self._calls.clear()
+        logging.warning(f"Circuit breaker {self.name} opened for {self.cooldown}s.")
+
+    @contextmanager
+    def track(self, is_failure=None):
+        """
+        Record the duration and outcome of the block as a call.
+
+        Parameters:
+            is_failure (callable): Tells whether an exception raised by the block is a failure
+                                   of the API, every exception is by default.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(time.monotonic() - start, failed=is_failure is None or is_failure(e))
+            raise
+        self.record(time.monotonic() - start, failed=False)
+
+    def call(self, function, *args, is_failure=None, **kwargs):
+        """
+        Make a call unless the breaker is open, recording its duration and outcome.
+
+        Wrap the request itself, not a cache in front of it: results served without
+        a request must neither take the half-open trial nor count as fast calls.
+
+        Parameters:
+            function (callable): The call, made with the other arguments.
+            is_failure (callable): Tells whether an exception raised by the call is a failure
+                                   of the API, every exception is by default.
+
+        Returns:
+            object: The result of the call.
+
+        Raises:
+            BreakerOpen: The breaker is open and the call was skipped.
+        """
+        if not self.allow():
+            raise BreakerOpen(self.name)
+        with self.track(is_failure):
+            return function(*args, **kwargs)
+
+    async def call_async(self, function, *args, is_failure=None, **kwargs):
+        """Asynchronous version of `call`, awaiting the coroutine returned by `function`."""
+        if not self.allow():
+            raise BreakerOpen(self.name)
+        with self.track(is_failure):
+            return await function(*args, **kwargs)
+
+
+def build_breakers() -> dict:
+    """Build the circuit breakers of the external APIs, a call being slow past half its stage budget."""
+    budgets = get_stage_budgets()
+    deadline = get_event_deadline()
+    return {
+        name: CircuitBreaker(
+            name,
+            slow_call_seconds=budgets.get(name, deadline) / 2,
+            error_rate=get_breaker_error_rate(),
+            slow_rate=get_breaker_slow_rate(),
+            cooldown=get_breaker_cooldown(),
+        )
+        for name in ("nlp", "llm")
+    }
+
+
+_breakers = None
+_breakers_lock = threading.Lock()
+
+
+def get_breakers() -> dict:
+    """
+    Return the shared circuit breakers of the external APIs, building them on first use.
+
+    Built on first use rather than at import, so that importing the app reads no configuration.
+
+    Returns:
+        dict: The breakers by stage name, 'nlp' and 'llm'.
+    """
+    global _breakers
+    if _breakers is None:
+        with _breakers_lock:
+            if _breakers is None:
+                _breakers = build_breakers()
+    return _breakers
+
+
+def open_call(stage, deadline=None, check_breaker=True):
+    """
+    Decide whether the external API call of a stage may be made, counting the skipped ones.
+
+    Parameters:
+        stage (str): The name of the stage, 'nlp' or 'llm'.
+        deadline (Deadline): The deadline of the event, if any.
+        check_breaker (bool): Whether to ask the circuit breaker of the stage, False when the
+                              breaker is checked by `CircuitBreaker.call` around the request.
+
+    Returns:
+        tuple: The timeout of the call (None without deadline) and None if the call may be made,
+               None and the reason ('deadline' or 'breaker') if it must be skipped.
+    """
+    timeout = None if deadline is None else deadline.budget(stage)
+    if timeout is not None and timeout <= 0:
+        reason = "deadline"
+    elif check_breaker and not get_breakers()[stage].allow():
+        reason = "breaker"
+    else:
+        return timeout, None
+    degraded.inc(stage=stage, reason=reason)
+    return None, reason
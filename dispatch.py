@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Rate limited dispatch of outbound Slack Web API calls.
+
+Calls are queued per channel and sent by a single worker thread when both the
+token bucket of their channel and the token bucket of their method have a
+token. A 429 response pauses the method for the duration given by its
+Retry-After header and the call is retried, so replies slow down under load
+instead of failing.
+
+Calls queued after the dispatcher is closed fail at once with
+`DispatcherClosed`, and `RateLimitedClient` waits for a response for a bounded
+time, so a long Retry-After never holds up its caller past its deadline.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from slack_sdk.errors import SlackApiError
+
+from metrics import api_errors, stage_seconds
+
+DEFAULT_METHOD_RATES = {
+    "chat_postMessage": (10.0, 20),
+    "chat_update": (0.8, 5),
+}
+DEFAULT_CHANNEL_RATE = (1.0, 5)
+DEFAULT_CALL_TIMEOUT = 30.0
+MAX_BLOCKS = 50
+
+
+class DispatcherClosed(RuntimeError):
+    """A call queued after the dispatcher was closed, which no thread would send."""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Parameters:
+            rate (float): Number of tokens added per second.
+            capacity (int): Maximum number of tokens, the allowed burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now) -> float:
+        """Return the number of seconds until a token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """Take a token, which must be available."""
+        self._refill(now)
+        self.tokens -= 1
+
+
+def as_blocks(kwargs) -> list:
+    """Return the blocks of a chat.postMessage call, turning a text-only message into a section block."""
+    if kwargs.get("blocks"):
+        return list(kwargs["blocks"])
+    if kwargs.get("text"):
+        return [{"type": "section", "text": {"type": "mrkdwn", "text": kwargs["text"]}}]
+    return []
+
+
+class Call:
+    __slots__ = ("method", "kwargs", "mergeable", "futures")
+
+    def __init__(self, method, kwargs, mergeable=False):
+        self.method = method
+        self.kwargs = kwargs
+        self.mergeable = mergeable
+        self.futures = [Future()]
+
+    def merge(self, other) -> bool:
+        """Merge a following chat.postMessage call to the same channel and thread into this one."""
+        if not (self.mergeable and other.mergeable):
+            return False
+        if self.method != "chat_postMessage" or other.method != "chat_postMessage":
+            return False
+        if not set(self.kwargs) | set(other.kwargs) <= {"channel", "thread_ts", "text", "blocks"}:
+            return False
+        if self.kwargs.get("thread_ts") != other.kwargs.get("thread_ts"):
+            return False
+        merged = {"channel": self.kwargs["channel"]}
+        if self.kwargs.get("thread_ts"):
+            merged["thread_ts"] = self.kwargs["thread_ts"]
+        if self.kwargs.get("blocks") or other.kwargs.get("blocks"):
+            blocks = as_blocks(self.kwargs) + as_blocks(other.kwargs)
+            if len(blocks) > MAX_BLOCKS:
+                return False
+            merged["blocks"] = blocks
+        texts = [kwargs["text"] for kwargs in (self.kwargs, other.kwargs) if kwargs.get("text")]
+        if texts:
+            merged["text"] = "\n".join(texts)
+        self.kwargs = merged
+        self.futures.extend(other.futures)
+        return True
+
+
+def resolve(futures, result=None, exception=None):
+    """Set the result or exception of the futures of a call, except the ones cancelled by their callers."""
+    for future in futures:
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+
+class SlackDispatcher:
+    def __init__(self, client, channel_rate=DEFAULT_CHANNEL_RATE, method_rates=None):
+        """
+        Parameters:
+            client (WebClient): The Slack Web API client.
+            channel_rate (tuple): The rate (calls per second) and burst of each channel.
+            method_rates (dict): The rate and burst of each Web API method, by client method name.
+        """
+        self.client = client
+        self.channel_rate = channel_rate
+        self.method_rates = dict(DEFAULT_METHOD_RATES, **(method_rates or {}))
+        self.sent = 0
+        self.merged = 0
+        self.rate_limited = 0
+        self._queues = {}
+        self._channel_buckets = {}
+        self._method_buckets = {}
+        self._paused_until = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="slack-dispatcher", daemon=True)
+        self._thread.start()
+
+    def send(self, method, mergeable=False, **kwargs) -> Future:
+        """
+        Queue a Web API call.
+
+        Parameters:
+            method (str): The WebClient method name (e.g. 'chat_postMessage').
+            mergeable (bool): Whether the call may be merged with the previous queued post to the same channel.
+                              The response of a merged call is the response of the combined message.
+            **kwargs: The arguments of the call, including its channel.
+
+        Returns:
+            Future: Resolved with the Slack response once the call is sent.
+        """
+        call = Call(method, kwargs, mergeable)
+        channel = kwargs.get("channel")
+        with self._condition:
+            if self._closed:
+                call.futures[0].set_exception(DispatcherClosed(f"Slack dispatcher is closed, {method} not sent"))
+                return call.futures[0]
+            queue = self._queues.setdefault(channel, deque())
+            if queue and queue[-1].merge(call):
+                self.merged += 1
+            else:
+                queue.append(call)
+            self._condition.notify()
+        return call.futures[0]
+
+    def post_message(self, channel, **kwargs) -> Future:
+        """Queue a chat.postMessage call to a channel, which may be merged with the previous queued post."""
+        return self.send("chat_postMessage", mergeable=True, channel=channel, **kwargs)
+
+    def queue_depth(self, channel=None) -> int:
+        """
+        Return the number of queued calls.
+
+        Parameters:
+            channel (str): Only count the calls to this channel.
+
+        Returns:
+            int: The number of calls waiting to be sent.
+        """
+        with self._condition:
+            if channel is not None:
+                return len(self._queues.get(channel, ()))
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _bucket(self, buckets, key, rate):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*rate)
+        return bucket
+
+    def _next_call(self, now):
+        """Pop the next call that can be sent, or return how long to wait for one."""
+        wait = None
+        for channel, queue in self._queues.items():
+            if not queue:
+                continue
+            call = queue[0]
+            method_bucket = self._bucket(
+                self._method_buckets,
+                call.method,
+                self.method_rates.get(call.method, self.channel_rate),
+            )
+            channel_bucket = self._bucket(self._channel_buckets, channel, self.channel_rate)
+            delay = max(
+                self._paused_until.get(call.method, 0.0) - now,
+                method_bucket.wait_time(now),
+                channel_bucket.wait_time(now),
+            )
+            if delay <= 0:
+                method_bucket.take(now)
+                channel_bucket.take(now)
+                queue.popleft()
+                if not queue:
+                    del self._queues[channel]
+                return call, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed and not self._queues:
+                        return
+                    call, wait = self._next_call(time.monotonic())
+                    if call is not None:
+                        break
+                    self._condition.wait(wait)
+            # Skip the calls whose callers all gave up waiting for them.
+            if all(future.cancelled() for future in call.futures):
+                continue
+            self._execute(call)
+
+    def _execute(self, call):
+        start = time.perf_counter()
+        try:
+            response = getattr(self.client, call.method)(**call.kwargs)
+        except SlackApiError as e:
+            api_errors.inc(api="slack", method=call.method)
+            if e.response is not None and e.response.status_code == 429:
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+                self.rate_limited += 1
+                logging.warning(f"Slack rate limited {call.method}, retrying in {retry_after}s.")
+                with self._condition:
+                    self._paused_until[call.method] = time.monotonic() + retry_after
+                    self._queues.setdefault(call.kwargs.get("channel"), deque()).appendleft(call)
+                    self._condition.notify()
+                return
+            logging.error(f"Slack {call.method} call failed: {e}")
+            resolve(call.futures, exception=e)
+            return
+        except Exception as e:
+            api_errors.inc(api="slack", method=call.method)
+            logging.error(f"Slack {call.method} call failed: {e}")
+            resolve(call.futures, exception=e)
+            return
+        finally:
+            stage_seconds.observe(time.perf_counter() - start, step=f"slack_{call.method}")
+        self.sent += 1
+        resolve(call.futures, response)
+
+    def close(self, timeout=30.0):
+        """
+        Send the queued calls and stop the dispatcher.
+
+        Parameters:
+            timeout (float): Maximum number of seconds to wait for the queued calls.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+
+class RateLimitedClient:
+    """WebClient-like wrapper sending chat.postMessage and chat.update calls through a dispatcher."""
+
+    def __init__(self, dispatcher, timeout=DEFAULT_CALL_TIMEOUT, expires=None):
+        """
+        Parameters:
+            dispatcher (SlackDispatcher): The dispatcher the calls are queued on.
+            timeout (float): Maximum number of seconds to wait for the response of a call.
+            expires (float): Monotonic time after which calls are no longer waited for, if any.
+        """
+        self.dispatcher = dispatcher
+        self.timeout = timeout
+        self.expires = expires
+
+    def within(self, seconds):
+        """
+        Return a client waiting for responses at most until `seconds` from now, e.g. the time left to a deadline.
+
+        Parameters:
+            seconds (float): The number of seconds, None to only apply the timeout of this client.
+
+        Returns:
+            RateLimitedClient: The bounded client, sharing the dispatcher.
+        """
+        if seconds is None:
+            return self
+        return RateLimitedClient(self.dispatcher, self.timeout, time.monotonic() + seconds)
+
+    def _call(self, method, kwargs):
+        future = self.dispatcher.send(method, **kwargs)
+        timeout = self.timeout
+        if self.expires is not None:
+            timeout = max(0.0, min(timeout, self.expires - time.monotonic()))
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Not sent if it is still queued, the caller no longer waits for it.
+            future.cancel()
+            raise TimeoutError(f"Slack {method} call not sent within {timeout:.1f}s") from None
+
+    def chat_postMessage(self, **kwargs):
+        return self._call("chat_postMessage", kwargs)
+
+    def chat_update(self, **kwargs):
+        return self._call("chat_update", kwargs)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Local fake of the Slack Web API, for running the backfill without Slack.
+
+`FakeSlackAPI` keeps the messages of a few channels in memory and serves the
+methods the backfill and the message listener call over HTTP, so a real
+`WebClient` can be pointed to it with `base_url`:
+
+- `conversations.history`: the thread parents and channel messages between
+  `oldest` and `latest`, newest first, with `reply_count` and `latest_reply`;
+- `conversations.replies`: the parent of a thread followed by its replies;
+- `users.conversations`: the channels;
+- `chat.postMessage` and `chat.update`: recorded in `posted`.
+
+Pages hold at most `page_size` items whatever the `limit` asked for, so that
+pagination is exercised with few messages.
+
+Usage:
+    python fake_slack.py --events recorded_events.jsonl --port 8080
+    python backfill.py --base-url http://127.0.0.1:8080/api/ --since 604800
+"""
+
+import argparse
+import json
+import logging
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeSlackAPI:
+    """In-memory channels served with the Slack Web API methods used by the app and the backfill."""
+
+    def __init__(self, page_size=100):
+        """
+        Parameters:
+            page_size (int): The maximum number of items per page.
+        """
+        self.page_size = page_size
+        self.channels = {}
+        self.posted = []
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def add_message(self, channel, ts, text="", user="U0001", thread_ts=None):
+        """
+        Add a message to a channel.
+
+        Parameters:
+            channel (str): The ID of the channel.
+            ts (str): The timestamp of the message.
+            text (str): The text of the message.
+            user (str): The ID of the author.
+            thread_ts (str): The timestamp of the parent message, for a thread reply.
+
+        Returns:
+            dict: The message.
+        """
+        message = {"type": "message", "ts": ts, "user": user, "text": text}
+        if thread_ts is not None:
+            message["thread_ts"] = thread_ts
+        with self._lock:
+            self.channels.setdefault(channel, []).append(message)
+        return message
+
+    def call(self, method, params) -> dict:
+        """
+        Answer a Web API call.
+
+        Parameters:
+            method (str): The name of the method, e.g. 'conversations.history'.
+            params (dict): The arguments of the call.
+
+        Returns:
+            dict: The response body.
+        """
+        with self._lock:
+            self.calls[method] += 1
+            handler = METHODS.get(method)
+            if handler is None:
+                return {"ok": False, "error": "unknown_method"}
+            return handler(self, params)
+
+    def _messages(self, params):
+        messages = self.channels.get(params.get("channel"))
+        if messages is None:
+            return None
+        oldest = float(params.get("oldest") or 0)
+        latest = float(params.get("latest") or "inf")
+        inclusive = str(params.get("inclusive", "")).lower() in ("1", "true")
+        if inclusive:
+            return [message for message in messages if oldest <= float(message["ts"]) <= latest]
+        return [message for message in messages if oldest < float(message["ts"]) < latest]
+
+    def _page(self, key, items, params) -> dict:
+        offset = int(params.get("cursor") or 0)
+        size = min(int(params.get("limit") or self.page_size), self.page_size)
+        end = offset + size
+        return {
+            "ok": True,
+            key: items[offset:end],
+            "has_more": end < len(items),
+            "response_metadata": {"next_cursor": str(end) if end < len(items) else ""},
+        }
+
+    def _history(self, params) -> dict:
+        messages = self._messages(params)
+        if messages is None:
+            return {"ok": False, "error": "channel_not_found"}
+        replies = {}
+        for message in self.channels[params["channel"]]:
+            thread_ts = message.get("thread_ts")
+            if thread_ts is not None and thread_ts != message["ts"]:
+                replies.setdefault(thread_ts, []).append(message["ts"])
+        parents = []
+        for message in messages:
+            if message.get("thread_ts", message["ts"]) != message["ts"]:
+                continue
+            thread = replies.get(message["ts"])
+            if thread:
+                message = dict(
+                    message,
+                    thread_ts=message["ts"],
+                    reply_count=len(thread),
+                    latest_reply=max(thread, key=float),
+                )
+            parents.append(message)
+        parents.sort(key=lambda message: float(message["ts"]), reverse=True)
+        return self._page("messages", parents, params)
+
+    def _replies(self, params) -> dict:
+        messages = self._messages(dict(params, oldest=None, latest=None))
+        if messages is None:
+            return {"ok": False, "error": "channel_not_found"}
+        thread_ts = params.get("ts")
+        parent = [message for message in messages if message["ts"] == thread_ts]
+        if not parent:
+            return {"ok": False, "error": "thread_not_found"}
+        in_range = self._messages(params)
+        thread = sorted(
+            (message for message in in_range if message.get("thread_ts") == thread_ts and message["ts"] != thread_ts),
+            key=lambda message: float(message["ts"]),
+        )
+        # Slack returns the parent first on every page.
+        response = self._page("messages", thread, params)
+        response["messages"] = parent + response["messages"]
+        return response
+
+    def _conversations(self, params) -> dict:
+        channels = [{"id": channel} for channel in sorted(self.channels)]
+        return self._page("channels", channels, params)
+
+    def _post(self, params) -> dict:
+        self.posted.append(dict(params))
+        ts = f"{1900000000 + len(self.posted)}.000000"
+        return {"ok": True, "channel": params.get("channel"), "ts": ts}
+
+    def start(self, host="127.0.0.1", port=0) -> str:
+        """
+        Serve the API on a background thread.
+
+        Parameters:
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 for any free port.
+
+        Returns:
+            str: The base URL of the API, to give to `WebClient(base_url=...)`.
+        """
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self, params):
+                method = urlparse(self.path).path.rsplit("/", 1)[-1]
+                body = json.dumps(api.call(method, params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                self._answer({key: values[-1] for key, values in query.items()})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                data = self.rfile.read(length).decode() if length else ""
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(data or "{}")
+                else:
+                    params = {key: values[-1] for key, values in parse_qs(data).items()}
+                query = parse_qs(urlparse(self.path).query)
+                params.update({key: values[-1] for key, values in query.items()})
+                self._answer(params)
+
+            def log_message(self, format, *args):
+                logging.debug("Fake Slack API: " + format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-slack", daemon=True).start()
+        return f"http://{host}:{self._server.server_address[1]}/api/"
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+METHODS = {
+    "conversations.history": FakeSlackAPI._history,
+    "conversations.replies": FakeSlackAPI._replies,
+    "users.conversations": FakeSlackAPI._conversations,
+    "chat.postMessage": FakeSlackAPI._post,
+    "chat.update": FakeSlackAPI._post,
+    "auth.test": lambda api, params: {"ok": True, "user_id": "UFAKE", "bot_id": "BFAKE"},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", help="JSONL file of recorded Slack message events to serve")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    api = FakeSlackAPI(page_size=args.page_size)
+    if args.events:
+        with open(args.events, "r") as file:
+            for line in file:
+                if line.strip():
+                    event = json.loads(line)
+                    event = event.get("event", event)
+                    api.add_message(
+                        event["channel"], event["ts"], event.get("text", ""), event.get("user", "U0001"),
+                        thread_ts=event.get("thread_ts"),
+                    )
+    base_url = api.start(port=args.port)
+    logging.info(f"Fake Slack Web API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        api.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Exactly-once handling of Slack events.
+
+Slack delivers an event again when it is not acknowledged in time, and with
+several Socket Mode connections the redelivery may reach another worker
+process. Before an event is handled, its key is claimed in an idempotency
+store: only the first claim succeeds within the TTL, later deliveries are
+acknowledged and dropped.
+
+A message is keyed by its `client_msg_id`, or its channel and timestamp, so
+that the same message replayed by the backfill is dropped as well. Other
+events are keyed by their `event_id`.
+
+`MemoryIdempotencyStore` is an LRU local to the process. `SQLiteIdempotencyStore`
+is shared by the worker processes through a SQLite file, whose locking makes
+each claim atomic across processes.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from slack_bolt.middleware import Middleware
+from slack_bolt.middleware.async_middleware import AsyncMiddleware
+
+from metrics import REGISTRY
+from utils import (get_idempotency_cache_size, get_idempotency_store_path,
+                   get_idempotency_ttl)
+
+PURGE_INTERVAL = 1000
+
+redeliveries = REGISTRY.counter(
+    "mtpm_redelivered_events_total", "Slack events dropped because they were already claimed."
+)
+
+
+def message_key(message):
+    """
+    Build the idempotency key of a message.
+
+    Parameters:
+        message (dict): The message event.
+
+    Returns:
+        str: The key, None if the message has neither client_msg_id nor channel and timestamp.
+    """
+    if message.get("client_msg_id"):
+        return f"message:{message['client_msg_id']}"
+    if message.get("channel") and message.get("ts"):
+        return f"message:{message['channel']}:{message['ts']}"
+    return None
+
+
+def event_key(body):
+    """
+    Build the idempotency key of an Events API request.
+
+    Parameters:
+        body (dict): The body of the request.
+
+    Returns:
+        str: The key, None for requests that are not events (commands, actions...).
+    """
+    event = body.get("event")
+    if not isinstance(event, dict):
+        return None
+    if event.get("type") == "message":
+        key = message_key(event)
+        if key is not None:
+            return key
+    event_id = body.get("event_id")
+    return f"event:{event_id}" if event_id else None
+
+
+class MemoryIdempotencyStore:
+    """In-process LRU of the claimed keys, each expiring after the TTL."""
+
+    def __init__(self, maxsize=10000, ttl=900):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key, now=None) -> bool:
+        """
+        Claim a key, unless it was claimed within the TTL.
+
+        Parameters:
+            key (str): The idempotency key.
+            now (float): The current time, defaults to the monotonic clock.
+
+        Returns:
+            bool: True if the key was claimed, False if it already was.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expires = self._keys.get(key)
+            if expires is not None and expires > now:
+                self._keys.move_to_end(key)
+                return False
+            self._keys[key] = now + self.ttl
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+            return True
+
+    def release(self, key):
+        """Forget a claimed key, e.g. when handling its event failed, so that it can be claimed again."""
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def close(self):
+        pass
+
+
+class SQLiteIdempotencyStore:
+    """Claimed keys shared by several processes through a SQLite file."""
+
+    def __init__(self, path, ttl=900):
+        self.path = path
+        self.ttl = ttl
+        self._claims = 0
+        self._lock = threading.Lock()
+        # Autocommit: each claim is a single atomic statement, serialized by the database lock.
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, expires REAL NOT NULL)"
+        )
+
+    def claim(self, key, now=None) -> bool:
+        """
+        Claim a key, unless it was claimed within the TTL by any process sharing the file.
+
+        Parameters:
+            key (str): The idempotency key.
+            now (float): The current time, defaults to the wall clock.
+
+        Returns:
+            bool: True if the key was claimed, False if it already was. Database errors
+                  count as claimed, handling an event twice being better than dropping it.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            try:
+                cursor = self._db.execute(
+                    "INSERT INTO claims (key, expires) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET expires = excluded.expires WHERE claims.expires <= ?",
+                    (key, now + self.ttl, now),
+                )
+                claimed = cursor.rowcount == 1
+                self._claims += 1
+                if self._claims % PURGE_INTERVAL == 0:
+                    self._db.execute("DELETE FROM claims WHERE expires <= ?", (now,))
+            except sqlite3.Error as e:
+                logging.error(f"Failed to claim {key} in the idempotency store {self.path}: {e}")
+                return True
+        return claimed
+
+    def release(self, key):
+        """Forget a claimed key, e.g. when handling its event failed, so that it can be claimed again."""
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM claims WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                logging.error(f"Failed to release {key} in the idempotency store {self.path}: {e}")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM claims").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def build_store(path=None):
+    """
+    Build the idempotency store of the configuration.
+
+    Parameters:
+        path (str): The SQLite file shared by the worker processes, defaults to IDEMPOTENCY_STORE_PATH.
+
+    Returns:
+        SQLiteIdempotencyStore or MemoryIdempotencyStore: The shared store if a path is configured,
+                                                          the in-process one otherwise.
+    """
+    path = path or get_idempotency_store_path()
+    if path:
+        try:
+            return SQLiteIdempotencyStore(path, get_idempotency_ttl())
+        except sqlite3.Error as e:
+            logging.error(f"Failed to open the idempotency store {path}, falling back to memory: {e}")
+    return MemoryIdempotencyStore(get_idempotency_cache_size(), get_idempotency_ttl())
+
+
+def is_redelivery(store, body) -> bool:
+    """Claim the key of an event, counting and logging the events that were already claimed."""
+    key = event_key(body)
+    if key is None or store.claim(key):
+        return False
+    redeliveries.inc()
+    logging.debug("Dropped redelivered event %s", key, extra={"key": key})
+    return True
+
+
+class IdempotentEvents(Middleware):
+    """Acknowledges and drops the events already handled, by this process or another worker."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def process(self, *, req, resp, next):
+        if is_redelivery(self.store, req.body):
+            return req.context.ack()
+        return next()
+
+
+class AsyncIdempotentEvents(AsyncMiddleware):
+    """Asyncio version of IdempotentEvents. A claim is a short local call, made inline."""
+
+    def __init__(self, store):
+        self.store = store
+
+    async def async_process(self, *, req, resp, next):
+        if is_redelivery(self.store, req.body):
+            return await req.context.ack()
+        return await next()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+"""Content-addressed cache for Google Cloud Natural Language API results."""
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text) -> str:
+    """
+    Normalize a text so that trivially different copies share a cache entry.
+
+    Parameters:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The NFKC normalized text with whitespace collapsed and trimmed.
+    """
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def text_key(text) -> str:
+    """
+    Build the cache key of a text.
+
+    Parameters:
+        text (str): The text to hash.
+
+    Returns:
+        str: The SHA-256 hex digest of the normalized text.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class NLPResultCache:
+    """
+    In-memory LRU cache with a TTL, backed by an optional SQLite tier that
+    survives restarts.
+
+    Values are kept as Python objects in memory. The SQLite tier stores the
+    bytes produced by `serializer` and restores them with `deserializer`, so
+    it is only enabled when both are given along with a `path`.
+    """
+
+    def __init__(
+        self,
+        namespace,
+        maxsize=1024,
+        ttl=3600,
+        path=None,
+        serializer=None,
+        deserializer=None,
+    ):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.serializer = serializer
+        self.deserializer = deserializer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._in_flight = {}
+        self._db = None
+        if path and serializer and deserializer:
+            self._db = self._open_database(path)
+
+    def _open_database(self, path):
+        try:
+            db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS nlp_cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "expires REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            db.execute(
+                "DELETE FROM nlp_cache WHERE namespace = ? AND expires <= ?",
+                (self.namespace, time.time()),
+            )
+            db.commit()
+            return db
+        except sqlite3.Error as e:
+            logging.error(f"Failed to open the NLP cache database {path}: {e}")
+            return None
+
+    def _get_from_disk(self, key):
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT value, expires FROM nlp_cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read from the NLP cache database: {e}")
+            return None
+        if row is None or row[1] <= time.time():
+            return None
+        return self.deserializer(row[0]), row[1]
+
+    def _put_to_disk(self, key, value, expires):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO nlp_cache (namespace, key, value, expires) "
+                "VALUES (?, ?, ?, ?)",
+                (self.namespace, key, self.serializer(value), expires),
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write to the NLP cache database: {e}")
+
+    def _store(self, key, value, expires):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, text):
+        """
+        Look up the cached result of a text.
+
+        Parameters:
+            text (str): The text that was analyzed.
+
+        Returns:
+            object: The cached result, or None if it is missing or expired.
+        """
+        key = text_key(text)
+        with self._lock:
+            return self._get(key)
+
+    def _get_from_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._entries[key]
+            self.expirations += 1
+        return None
+
+    def _get(self, key):
+        value = self._get_from_memory(key)
+        if value is not None:
+            return value
+        stored = self._get_from_disk(key)
+        if stored is not None:
+            self._store(key, *stored)
+            self.hits += 1
+            self.disk_hits += 1
+            return stored[0]
+        self.misses += 1
+        return None
+
+    def put(self, text, value):
+        """
+        Store the result of a text.
+
+        Parameters:
+            text (str): The text that was analyzed.
+            value (object): The result to cache.
+        """
+        key = text_key(text)
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        expires = time.time() + self.ttl
+        self._store(key, value, expires)
+        self._put_to_disk(key, value, expires)
+
+    def get_or_compute(self, text, compute):
+        """
+        Return the cached result of a text, computing and storing it on a miss.
+
+        Concurrent misses for the same text wait for the first computation
+        instead of issuing their own request.
+
+        Parameters:
+            text (str): The text to analyze.
+            compute (callable): Called with the text to produce the result.
+
+        Returns:
+            object: The cached or freshly computed result.
+        """
+        key = text_key(text)
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and entry[1] > time.time():
+                        return entry[0]
+                value = compute(text)
+                with self._lock:
+                    self._put(key, value)
+                return value
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    async def async_get_or_compute(self, text, compute):
+        """
+        Asynchronous version of `get_or_compute`, for the event loop.
+
+        Memory hits are returned inline, the SQLite tier is read and written
+        in a worker thread. Concurrent misses for the same text await the
+        first computation instead of issuing their own request.
+
+        Parameters:
+            text (str): The text to analyze.
+            compute (callable): Called with the text, returning an awaitable of the result.
+
+        Returns:
+            object: The cached or freshly computed result.
+        """
+        key = text_key(text)
+        with self._lock:
+            value = self._get_from_memory(key)
+        if value is not None:
+            return value
+        future = self._in_flight.get(key)
+        if future is None:
+            value = await asyncio.to_thread(self._locked_get, key)
+            if value is not None:
+                return value
+            future = self._in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await compute(text)
+            await asyncio.to_thread(self._locked_put, key, value)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved so that an error without waiters is not reported as never retrieved.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    def _locked_get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def _locked_put(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def clear(self):
+        """Remove every entry from the memory and SQLite tiers."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute(
+                    "DELETE FROM nlp_cache WHERE namespace = ?", (self.namespace,)
+                )
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """
+        Report the cache counters.
+
+        Returns:
+            dict: The hit, miss, eviction and expiration counters and the current size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._entries),
+            }
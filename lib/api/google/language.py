@@ -5,59 +5,317 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
-from google.api_core.exceptions import GoogleAPICallError, InvalidArgument
-from google.cloud import language_v2
+import threading
+from functools import partial
 
-"""Google Cloud Natural Language API sentiment analysis."""
+from lib.api.google.cache import NLPResultCache
+from metrics import api_errors, stage_seconds, timed
+from utils import (get_nlp_cache_path, get_nlp_cache_size, get_nlp_cache_ttl,
+                   load_environment)
 
+"""Google Cloud Natural Language API sentiment analysis.
 
-def analyze_entities(text) -> list:
+The google-cloud-language SDK and gRPC are imported on the first request,
+not when this module is imported, so they do not slow down the start of the
+app when the local analysis handles the messages.
+"""
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_language_client():
+    """
+    Return the shared Google Cloud Natural Language API client.
+
+    The client owns a gRPC channel, so it is created once and reused by every
+    call instead of opening a new channel per request.
+
+    Returns:
+        LanguageServiceClient: The shared client instance.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google.cloud import language_v2
+
+                load_environment()
+                _client = language_v2.LanguageServiceClient()
+    return _client
+
+
+def set_language_client(client):
+    """
+    Replace the shared Google Cloud Natural Language API client, e.g. with a local stub.
+
+    Parameters:
+        client: An object providing the LanguageServiceClient methods used by this module.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def get_async_language_client():
+    """
+    Return the shared asynchronous Google Cloud Natural Language API client.
+
+    The client is bound to the event loop it is first used on, so it must only
+    be called from the application's event loop.
+
+    Returns:
+        LanguageServiceAsyncClient: The shared asynchronous client instance.
+    """
+    global _async_client
+    if _async_client is None:
+        from google.cloud import language_v2
+
+        load_environment()
+        _async_client = language_v2.LanguageServiceAsyncClient()
+    return _async_client
+
+
+def get_cache(namespace, response_type) -> NLPResultCache:
+    """
+    Return the shared result cache of a request type.
+
+    Parameters:
+        namespace (str): The name of the request type (e.g. 'sentiment').
+        response_type: The protobuf response class stored in the cache.
+
+    Returns:
+        NLPResultCache: The cache for the request type.
+    """
+    cache = _caches.get(namespace)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(namespace)
+            if cache is None:
+                cache = NLPResultCache(
+                    namespace,
+                    maxsize=get_nlp_cache_size(),
+                    ttl=get_nlp_cache_ttl(),
+                    path=get_nlp_cache_path(),
+                    serializer=response_type.serialize,
+                    deserializer=response_type.deserialize,
+                )
+                _caches[namespace] = cache
+    return cache
+
+
+def cache_stats() -> dict:
+    """
+    Report the counters of every result cache.
+
+    Returns:
+        dict: The cache counters keyed by request type.
+    """
+    return {namespace: cache.stats() for namespace, cache in _caches.items()}
+
+
+def build_document(text):
+    """
+    Build a plain text document for the Google Cloud Natural Language API.
+
+    Parameters:
+        text (str): The text to wrap.
+
+    Returns:
+        Document: The document to send with a request.
+    """
+    from google.cloud import language_v2
+
+    return language_v2.Document(
+        content=text, type_=language_v2.Document.Type.PLAIN_TEXT
+    )
+
+
+def call_options(timeout=None) -> dict:
+    """Return the keyword arguments setting the timeout of a request, none to keep the client's default."""
+    return {} if timeout is None else {"timeout": timeout}
+
+
+def is_server_error(exception) -> bool:
+    """
+    Tell whether an exception is a failure of the API rather than a request it rejected.
+
+    Parameters:
+        exception (Exception): The exception raised by a request.
+
+    Returns:
+        bool: False for invalid arguments (e.g. unsupported languages), True otherwise.
+    """
+    from google.api_core.exceptions import InvalidArgument
+
+    return not isinstance(exception, InvalidArgument)
+
+
+@timed("nlp_annotate_text")
+def annotate_text(text, timeout=None, breaker=None) -> dict:
+    """
+    Analyzes the sentiment and entities of a given text in a single request
+    using the Google Cloud Natural Language API.
+
+    Parameters:
+        text (str): The text to analyze.
+        timeout (float): The timeout of the request in seconds, the client's default if None.
+        breaker (CircuitBreaker): The circuit breaker the request goes through, cached results
+                                  being returned without it.
+
+    Returns:
+        dict: A dictionary containing the sentiment score, magnitude, and entities.
+    """
+    from google.api_core.exceptions import GoogleAPICallError, InvalidArgument
+    from google.cloud import language_v2
+
+    try:
+        cache = get_cache("annotate", language_v2.AnnotateTextResponse)
+        response = cache.get_or_compute(text, partial(_annotate_text, timeout=timeout, breaker=breaker))
+        sentiment = response.document_sentiment
+        return {
+            "score": sentiment.score,
+            "magnitude": sentiment.magnitude,
+            "entities": response.entities,
+        }
+    except InvalidArgument as invalid_arg:
+        raise invalid_arg
+    except GoogleAPICallError as api_error:
+        api_errors.inc(api="language")
+        raise api_error
+    except Exception as exception:
+        raise exception
+
+
+async def async_annotate_text(text, timeout=None, breaker=None) -> dict:
+    """
+    Asynchronous version of `annotate_text` using the asynchronous client.
+
+    Parameters:
+        text (str): The text to analyze.
+        timeout (float): The timeout of the request in seconds, the client's default if None.
+        breaker (CircuitBreaker): The circuit breaker the request goes through, cached results
+                                  being returned without it.
+
+    Returns:
+        dict: A dictionary containing the sentiment score, magnitude, and entities.
+    """
+    from google.api_core.exceptions import GoogleAPICallError
+    from google.cloud import language_v2
+
+    features = language_v2.AnnotateTextRequest.Features(
+        extract_entities=True, extract_document_sentiment=True
+    )
+
+    async def request(text):
+        call = partial(
+            get_async_language_client().annotate_text,
+            request={"document": build_document(text), "features": features},
+            **call_options(timeout),
+        )
+        with stage_seconds.time(step="nlp_annotate_text"):
+            try:
+                if breaker is None:
+                    return await call()
+                return await breaker.call_async(call, is_failure=is_server_error)
+            except GoogleAPICallError:
+                api_errors.inc(api="language")
+                raise
+
+    cache = get_cache("annotate", language_v2.AnnotateTextResponse)
+    response = await cache.async_get_or_compute(text, request)
+    sentiment = response.document_sentiment
+    return {
+        "score": sentiment.score,
+        "magnitude": sentiment.magnitude,
+        "entities": response.entities,
+    }
+
+
+def _annotate_text(text, timeout=None, breaker=None):
+    from google.cloud import language_v2
+
+    features = language_v2.AnnotateTextRequest.Features(
+        extract_entities=True, extract_document_sentiment=True
+    )
+    request = partial(
+        get_language_client().annotate_text,
+        request={"document": build_document(text), "features": features},
+        **call_options(timeout),
+    )
+    if breaker is None:
+        return request()
+    return breaker.call(request, is_failure=is_server_error)
+
+
+def _analyze_entities(text, timeout=None):
+    return get_language_client().analyze_entities(
+        request={"document": build_document(text)}, **call_options(timeout)
+    )
+
+
+def _analyze_sentiment(text, timeout=None):
+    return get_language_client().analyze_sentiment(
+        request={"document": build_document(text)}, **call_options(timeout)
+    )
+
+
+@timed("nlp_analyze_entities")
+def analyze_entities(text, timeout=None) -> list:
     """
     Analyzes the entities in a given text using the Google Cloud Natural Language API.
 
     Parameters:
         text (str): The text to analyze.
+        timeout (float): The timeout of the request in seconds, the client's default if None.
 
     Returns:
         list: A list of entities found in the text.
     """
+    from google.api_core.exceptions import GoogleAPICallError, InvalidArgument
+    from google.cloud import language_v2
+
     try:
-        client = language_v2.LanguageServiceClient()
-        document = language_v2.Document(
-            content=text, type_=language_v2.Document.Type.PLAIN_TEXT
-        )
-        response = client.analyze_entities(request={"document": document})
+        cache = get_cache("entities", language_v2.AnalyzeEntitiesResponse)
+        response = cache.get_or_compute(text, partial(_analyze_entities, timeout=timeout))
         entities = response.entities
         return entities
     except InvalidArgument as invalid_arg:
         raise invalid_arg
     except GoogleAPICallError as api_error:
+        api_errors.inc(api="language")
         raise api_error
     except Exception as exception:
         raise exception
 
 
-def analyze_sentiment(text) -> tuple:
+@timed("nlp_analyze_sentiment")
+def analyze_sentiment(text, timeout=None) -> tuple:
     """
     Analyzes the sentiment of a given text using the Google Cloud Natural Language API.
 
     Parameters:
         text (str): The text to analyze.
+        timeout (float): The timeout of the request in seconds, the client's default if None.
 
     Returns:
         tuple: A tuple containing the sentiment score and magnitude.
     """
+    from google.api_core.exceptions import GoogleAPICallError, InvalidArgument
+    from google.cloud import language_v2
+
     try:
-        client = language_v2.LanguageServiceClient()
-        document = language_v2.Document(
-            content=text, type_=language_v2.Document.Type.PLAIN_TEXT
-        )
-        response = client.analyze_sentiment(request={"document": document})
+        cache = get_cache("sentiment", language_v2.AnalyzeSentimentResponse)
+        response = cache.get_or_compute(text, partial(_analyze_sentiment, timeout=timeout))
         sentiment = response.document_sentiment
         return sentiment.score, sentiment.magnitude
     except InvalidArgument as invalid_arg:
         raise invalid_arg
     except GoogleAPICallError as api_error:
+        api_errors.inc(api="language")
         raise api_error
     except Exception as exception:
         raise exception
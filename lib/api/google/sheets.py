@@ -5,13 +5,15 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
+import atexit
+import logging
+import queue
+import random
 import sys
+import threading
+import time
 from pathlib import Path
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
 current_script_dir = Path(__file__).resolve().parent
 project_root = current_script_dir.parent.parent.parent
 sys.path.append(str(project_root))
@@ -19,6 +21,13 @@ sys.path.append(str(project_root))
 
 """Google Sheets API utility functions."""
 
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Longest wait of the writer thread for a row before it checks whether the writer was closed.
+CLOSE_POLL_INTERVAL = 0.5
+
+_service = None
+_service_lock = threading.Lock()
+
 
 def create_sheets_service():
     from utils import get_google_cloud_service_account
@@ -29,6 +38,9 @@ def create_sheets_service():
     Returns:
         Resource: A Google Sheets service object.
     """
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
     SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
     credentials = service_account.Credentials.from_service_account_file(
@@ -38,6 +50,21 @@ def create_sheets_service():
     return build("sheets", "v4", credentials=credentials)
 
 
+def get_sheets_service():
+    """
+    Return the shared Google Sheets service object, creating it on first use.
+
+    Returns:
+        Resource: A Google Sheets service object.
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = create_sheets_service()
+    return _service
+
+
 def update_sheet(service, spreadsheet_id, range_name, values):
     """
     Writes values to a Google Spreadsheet using the Sheets API.
@@ -66,6 +93,35 @@ def update_sheet(service, spreadsheet_id, range_name, values):
     )
 
 
+def append_rows(service, spreadsheet_id, range_name, values):
+    """
+    Appends rows after the last row of a table in a Google Spreadsheet using the Sheets API.
+
+    Parameters:
+        service: The Google Sheets API service object.
+        spreadsheet_id (str): The ID of the Google Spreadsheet.
+        range_name (str): The range of the table to append to (e.g. 'Sheet1!A1').
+        values (list): A list of lists containing the rows to append.
+
+    Returns:
+        dict: The response from the API after appending the rows.
+    """
+    body = {"values": values}
+
+    return (
+        service.spreadsheets()
+        .values()
+        .append(
+            spreadsheetId=spreadsheet_id,
+            range=range_name,
+            valueInputOption="RAW",
+            insertDataOption="INSERT_ROWS",
+            body=body,
+        )
+        .execute()
+    )
+
+
 def check_spreadsheet_existence(service, spreadsheet_id):
     """
     Checks if a Google Spreadsheet with the given ID exists and is accessible by the service account.
@@ -77,6 +133,8 @@ def check_spreadsheet_existence(service, spreadsheet_id):
     Returns:
         bool: True if the spreadsheet exists and is accessible, False otherwise.
     """
+    from googleapiclient.errors import HttpError
+
     try:
         # Attempt to get the spreadsheet, which verifies its existence and accessibility
         service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
@@ -92,3 +150,130 @@ def check_spreadsheet_existence(service, spreadsheet_id):
     except Exception as e:
         print(f"An error occurred: {e}")
         return False
+
+
+class SheetsBatchWriter:
+    """
+    Background writer that buffers rows in memory and appends them to a
+    Google Spreadsheet in a single request once `max_rows` rows are buffered
+    or `flush_interval` seconds went by.
+
+    `append` only puts the row on a queue, so callers never wait on the
+    Sheets API. Failed requests are retried with exponential backoff, and the
+    buffer is flushed when the writer is closed or the process exits.
+    """
+
+    _close_marker = object()
+
+    def __init__(
+        self,
+        spreadsheet_id,
+        range_name="Sheet1!A1",
+        max_rows=100,
+        flush_interval=5.0,
+        max_retries=5,
+        max_queue_size=10000,
+        service_factory=get_sheets_service,
+    ):
+        self.spreadsheet_id = spreadsheet_id
+        self.range_name = range_name
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.service_factory = service_factory
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flushes = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheets-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, row) -> bool:
+        """
+        Queue a row to be written.
+
+        Parameters:
+            row (list): The values of the row.
+
+        Returns:
+            bool: True if the row was queued, False if the writer is closed or its queue is full.
+        """
+        if self._closed.is_set():
+            return False
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.rows_dropped += 1
+            logging.warning("Google Sheets writer queue is full, dropping a row.")
+            return False
+
+    def queue_depth(self) -> int:
+        """Return the number of rows waiting to be written."""
+        return self._queue.qsize()
+
+    def _run(self):
+        rows = []
+        deadline = None
+        while True:
+            timeout = CLOSE_POLL_INTERVAL
+            if deadline is not None:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            try:
+                row = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                row = None
+            # Closed and drained: `append` no longer queues rows once the writer is closed.
+            closing = row is self._close_marker or (row is None and self._closed.is_set())
+            if row is not None and not closing:
+                rows.append(row)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if rows and (
+                closing or len(rows) >= self.max_rows or time.monotonic() >= deadline
+            ):
+                self._flush(rows)
+                rows = []
+                deadline = None
+            if closing:
+                return
+
+    def _flush(self, rows):
+        from googleapiclient.errors import HttpError
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                append_rows(self.service_factory(), self.spreadsheet_id, self.range_name, rows)
+                self.rows_written += len(rows)
+                self.flushes += 1
+                return
+            except HttpError as error:
+                if error.resp.status not in RETRYABLE_STATUS_CODES:
+                    logging.error(f"Failed to write {len(rows)} rows to Google Sheets: {error}")
+                    break
+                logging.warning(f"Google Sheets returned {error.resp.status}, retrying.")
+            except Exception as e:
+                logging.warning(f"Failed to write to Google Sheets, retrying: {e}")
+            if attempt < self.max_retries:
+                time.sleep(min(60.0, 2**attempt) * (0.5 + random.random() / 2))
+        self.rows_dropped += len(rows)
+        logging.error(f"Dropping {len(rows)} rows that could not be written to Google Sheets.")
+
+    def close(self, timeout=30.0):
+        """
+        Flush the buffered rows and stop the writer.
+
+        Parameters:
+            timeout (float): Maximum number of seconds to wait for the final flush.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        try:
+            # Wakes the writer thread up, which otherwise notices the close within CLOSE_POLL_INTERVAL.
+            self._queue.put_nowait(self._close_marker)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
@@ -6,11 +6,10 @@
 
 import logging
 import os
+import threading
 from enum import Enum
 
-import vertexai
-import vertexai.preview.generative_models as generative_models
-from vertexai.generative_models import GenerativeModel
+SRE_INSTRUCTION = "SRE Style Templating (Single Shot POC)"
 
 
 class VertexAIConfig(Enum):
@@ -18,11 +17,27 @@ class VertexAIConfig(Enum):
     LOCATION = "us-central1"
     MODEL = "gemini-1.5-flash-preview-0514"
     GENERATION_CONFIG = {"max_output_tokens": 8192, "temperature": 1, "top_p": 0.95}
+    # Names of the HarmCategory and HarmBlockThreshold members, resolved when the SDK is loaded.
     SAFETY_SETTINGS = {
-        generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+        "HARM_CATEGORY_HATE_SPEECH": "BLOCK_MEDIUM_AND_ABOVE",
+        "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_MEDIUM_AND_ABOVE",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_MEDIUM_AND_ABOVE",
+        "HARM_CATEGORY_HARASSMENT": "BLOCK_MEDIUM_AND_ABOVE",
+    }
+
+
+def build_safety_settings() -> dict:
+    """
+    Build the safety settings of the generation requests.
+
+    Returns:
+        dict: The HarmBlockThreshold of each HarmCategory.
+    """
+    import vertexai.preview.generative_models as generative_models
+
+    return {
+        generative_models.HarmCategory[category]: generative_models.HarmBlockThreshold[threshold]
+        for category, threshold in VertexAIConfig.SAFETY_SETTINGS.value.items()
     }
 
 
@@ -30,8 +45,8 @@ def get_system_instructions_by_name(name):
     script_dir = os.path.dirname(os.path.realpath(__file__))
 
     file_mapping = {
-        "SRE Style Templating (Single Shot POC)": os.path.join(
-            script_dir, "instructions", "system_instructions_sre.txt"
+        SRE_INSTRUCTION: os.path.join(
+            script_dir, "instructions", "system_instructions_SRE.txt"
         ),
     }
 
@@ -51,26 +66,141 @@ def get_system_instructions_by_name(name):
         return ""
 
 
-def generate_content(text):
-    vertexai.init(
-        project=VertexAIConfig.PROJECT.value, location=VertexAIConfig.LOCATION.value
-    )
-
-    system_instruction_name = "SRE Style Templating (Single Shot POC)"
-    system_instruction_text = get_system_instructions_by_name(system_instruction_name)
+class GenerationService:
+    """
+    Reusable Vertex AI generation service.
+
+    The Vertex AI SDK is imported and initialised on first use, and the system
+    instruction text and the GenerativeModel built from it are cached per
+    instruction name.
+    """
+
+    def __init__(self, instruction_name=SRE_INSTRUCTION):
+        self.instruction_name = instruction_name
+        self._initialized = False
+        self._models = {}
+        self._safety_settings = None
+        self._lock = threading.Lock()
+
+    def _initialize(self):
+        if not self._initialized:
+            import vertexai
+
+            from utils import load_environment
+
+            load_environment()
+            vertexai.init(
+                project=VertexAIConfig.PROJECT.value,
+                location=VertexAIConfig.LOCATION.value,
+            )
+            self._safety_settings = build_safety_settings()
+            self._initialized = True
+
+    def get_model(self, instruction_name=None):
+        """
+        Return the model for a system instruction, creating it on first use.
+
+        Parameters:
+            instruction_name (str): The name of the system instruction, defaults to the service's one.
+
+        Returns:
+            GenerativeModel: The cached model.
+        """
+        instruction_name = instruction_name or self.instruction_name
+        model = self._models.get(instruction_name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(instruction_name)
+                if model is None:
+                    from vertexai.generative_models import GenerativeModel
+
+                    self._initialize()
+                    model = GenerativeModel(
+                        VertexAIConfig.MODEL.value,
+                        system_instruction=[
+                            get_system_instructions_by_name(instruction_name)
+                        ],
+                    )
+                    self._models[instruction_name] = model
+        return model
+
+    def stream(self, text, instruction_name=None, timeout=None):
+        """
+        Generate content for a text, yielding the text of each chunk as it is received.
+
+        Parameters:
+            text (str): The prompt text.
+            instruction_name (str): The name of the system instruction, defaults to the service's one.
+            timeout (float): Number of seconds the request may take, unlimited if None.
+
+        Yields:
+            str: The text of each streamed chunk.
+        """
+        model = self.get_model(instruction_name)
+        if timeout is None:
+            responses = model.generate_content(
+                [text],
+                generation_config=VertexAIConfig.GENERATION_CONFIG.value,
+                safety_settings=self._safety_settings,
+                stream=True,
+            )
+        else:
+            # `generate_content` takes no timeout, so the request it builds is sent with one.
+            request = model._prepare_request(
+                contents=[text],
+                generation_config=VertexAIConfig.GENERATION_CONFIG.value,
+                safety_settings=self._safety_settings,
+            )
+            responses = (
+                model._parse_response(chunk)
+                for chunk in model._prediction_client.stream_generate_content(request=request, timeout=timeout)
+            )
+        for response in responses:
+            yield response.text
+
+    def generate(self, text, instruction_name=None) -> str:
+        """
+        Generate content for a text.
+
+        Parameters:
+            text (str): The prompt text.
+            instruction_name (str): The name of the system instruction, defaults to the service's one.
+
+        Returns:
+            str: The generated text.
+        """
+        return "".join(self.stream(text, instruction_name))
+
+    def stream_to_slack(
+        self, client, channel, text, thread_ts=None, update_interval=1.0, instruction_name=None
+    ) -> str:
+        """
+        Stream generated content into a Slack message, see `lib.api.llm.stream_to_slack`.
+
+        Parameters:
+            client (WebClient): The Slack Web API client.
+            channel (str): The channel to post to.
+            text (str): The prompt text.
+            thread_ts (str): The timestamp of the thread to reply in, if any.
+            update_interval (float): Minimum number of seconds between two message updates.
+            instruction_name (str): The name of the system instruction, defaults to the service's one.
+
+        Returns:
+            str: The generated text.
+        """
+        from lib.api.llm import stream_to_slack
+
+        return stream_to_slack(
+            self.stream(text, instruction_name), client, channel, thread_ts, update_interval
+        )
+
+
+generation_service = GenerationService()
 
-    model = GenerativeModel(
-        VertexAIConfig.MODEL.value, system_instruction=[system_instruction_text]
-    )
-    responses = model.generate_content(
-        [text],
-        generation_config=VertexAIConfig.GENERATION_CONFIG.value,
-        safety_settings=VertexAIConfig.SAFETY_SETTINGS.value,
-        stream=True,
-    )
 
-    for response in responses:
-        print(response.text, end="")
+def generate_content(text):
+    for chunk in generation_service.stream(text):
+        print(chunk, end="")
 
 
 def demo_text():
@@ -85,4 +215,5 @@ def demo_text():
         return ""
 
 
-generate_content(text=demo_text())
+if __name__ == "__main__":
+    generate_content(text=demo_text())
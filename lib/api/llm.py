@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""LLM providers behind a single interface, with optional hedged requests.
+
+Each provider streams the text generated for a prompt from a long-lived
+client (the Vertex AI GenerativeModel and its gRPC channel, or the pooled
+OpenAI HTTP client), with a limit on its number of concurrent requests.
+
+`LLMRouter` sends a request to the primary provider. When hedging is enabled
+and the first chunk takes longer than a percentile of the primary provider's
+recent first-chunk latencies, a second request is sent to the hedge provider
+and the stream that starts first is used. A failed request also starts the
+hedge request right away. `FakeProvider` generates text locally, so the layer
+can be exercised without network access.
+"""
+
+import abc
+import importlib
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY, api_errors, stage_seconds
+from utils import (get_llm_hedge_percentile, get_llm_hedge_provider,
+                   get_llm_max_concurrency, get_llm_provider, get_openai_model)
+
+MIN_LATENCY_SAMPLES = 20
+INITIAL_HEDGE_DELAY = 2.0
+
+hedged_requests = REGISTRY.counter(
+    "mtpm_llm_hedged_requests_total", "LLM requests sent to the hedge provider, by winning provider."
+)
+
+_router = None
+_router_lock = threading.Lock()
+
+
+class LLMProvider(abc.ABC):
+    """Base class of the providers: a concurrency limit and a window of recent first-chunk latencies."""
+
+    name = None
+
+    def __init__(self, max_concurrency=4, window=200):
+        """
+        Parameters:
+            max_concurrency (int): Maximum number of concurrent requests to the provider.
+            window (int): Number of recent first-chunk latencies the percentiles are computed from.
+        """
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def stream(self, text, instruction_name=None, timeout=None):
+        """
+        Generate content for a text, yielding the text of each chunk as it is received.
+
+        Parameters:
+            text (str): The prompt text.
+            instruction_name (str): The name of the system instruction, defaults to the SRE one.
+            timeout (float): Number of seconds the request may take, unlimited if None.
+
+        Yields:
+            str: The text of each streamed chunk.
+        """
+
+    def observe(self, seconds):
+        """Record the first-chunk latency of a request."""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def latency_percentile(self, percent):
+        """
+        Return a percentile of the recent first-chunk latencies.
+
+        Parameters:
+            percent (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The latency in seconds, None when there are too few samples.
+        """
+        with self._lock:
+            if len(self._latencies) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class VertexProvider(LLMProvider):
+    """Google Vertex AI Gemini models, through the shared generation service."""
+
+    name = "vertex"
+
+    def stream(self, text, instruction_name=None, timeout=None):
+        from lib.api.google.vertex import generation_service
+
+        return generation_service.stream(text, instruction_name, timeout)
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completion models, through the shared pooled client."""
+
+    name = "openai"
+
+    def __init__(self, model, max_concurrency=4, window=200):
+        super().__init__(max_concurrency, window)
+        self.model = model
+
+    def stream(self, text, instruction_name=None, timeout=None):
+        from lib.api.google.vertex import (SRE_INSTRUCTION,
+                                           get_system_instructions_by_name)
+
+        openai_module = importlib.import_module("lib.api.openai.openai-gpt")
+        instruction = get_system_instructions_by_name(instruction_name or SRE_INSTRUCTION)
+        return openai_module.stream_request(text, self.model, instruction, timeout)
+
+
+class FakeProvider(LLMProvider):
+    """Local provider streaming a fixed number of chunks after a sampled latency, for offline runs."""
+
+    name = "fake"
+
+    def __init__(self, latency=lambda: 0.0, chunks=8, failure_rate=0.0, max_concurrency=4, window=200):
+        """
+        Parameters:
+            latency (callable): Returns the number of seconds the whole generation takes.
+            chunks (int): The number of chunks streamed.
+            failure_rate (float): The probability of a request failing before its first chunk.
+        """
+        super().__init__(max_concurrency, window)
+        self.latency = latency
+        self.chunks = chunks
+        self.failure_rate = failure_rate
+
+    def stream(self, text, instruction_name=None, timeout=None):
+        import random
+
+        total = self.latency()
+        expires = None if timeout is None else time.monotonic() + timeout
+
+        def wait(seconds):
+            # Like the real clients, give up on a request slower than its timeout.
+            if expires is not None and time.monotonic() + seconds > expires:
+                time.sleep(max(0.0, expires - time.monotonic()))
+                raise TimeoutError("Fake provider request timed out")
+            time.sleep(seconds)
+
+        if random.random() < self.failure_rate:
+            wait(total / self.chunks)
+            raise RuntimeError("Fake provider failure")
+        for index in range(self.chunks):
+            wait(total / self.chunks)
+            yield f"chunk {index} "
+
+
+def build_provider(name):
+    """
+    Build a provider from its name.
+
+    Parameters:
+        name (str): 'vertex', 'openai' or 'fake'.
+
+    Returns:
+        LLMProvider: The provider.
+    """
+    max_concurrency = get_llm_max_concurrency()
+    if name == "vertex":
+        return VertexProvider(max_concurrency)
+    if name == "openai":
+        return OpenAIProvider(get_openai_model(), max_concurrency)
+    if name == "fake":
+        return FakeProvider(max_concurrency=max_concurrency)
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+class _Attempt:
+    """A request to a provider, streaming its chunks into the router's queue from a worker thread."""
+
+    def __init__(self, provider, results):
+        self.provider = provider
+        self.results = results
+        self.cancelled = threading.Event()
+        self._released = False
+        self._release_lock = threading.Lock()
+
+    def release(self):
+        """Give the provider slot of the attempt back, once."""
+        with self._release_lock:
+            if self._released:
+                return
+            self._released = True
+        self.provider.slots.release()
+
+    def cancel(self):
+        """
+        Abandon the attempt and give its slot back at once.
+
+        The request itself stops at its next chunk or at its timeout, so a hung
+        request does not keep the slot from the next ones until then.
+        """
+        self.cancelled.set()
+        self.release()
+
+    def run(self, text, instruction_name, timeout=None):
+        start = time.perf_counter()
+        first = True
+        try:
+            stream = self.provider.stream(text, instruction_name, timeout)
+            try:
+                for chunk in stream:
+                    if first:
+                        self.provider.observe(time.perf_counter() - start)
+                        first = False
+                    if self.cancelled.is_set():
+                        return
+                    self.results.put((self, chunk, None))
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+            self.results.put((self, None, None))
+        except Exception as e:
+            api_errors.inc(api=f"llm_{self.provider.name}")
+            self.results.put((self, None, e))
+        finally:
+            self.release()
+            stage_seconds.observe(time.perf_counter() - start, step=f"llm_{self.provider.name}")
+
+
+class LLMRouter:
+    """Sends the requests to the primary provider, hedged with a second provider if one is configured."""
+
+    def __init__(self, primary, hedge=None, hedge_percentile=95.0, initial_hedge_delay=INITIAL_HEDGE_DELAY):
+        """
+        Parameters:
+            primary (LLMProvider): The provider every request is sent to first.
+            hedge (LLMProvider): The provider slow or failed requests are also sent to, None to disable hedging.
+            hedge_percentile (float): The percentile of the primary's first-chunk latencies after which to hedge.
+            initial_hedge_delay (float): The hedging delay in seconds until enough latencies were observed.
+        """
+        self.primary = primary
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        # Twice the slots, so that cancelled requests still running until their timeout leave
+        # a thread to the requests that took their slots.
+        workers = 2 * (primary.max_concurrency + (hedge.max_concurrency if hedge else 0))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+
+    def hedge_delay(self) -> float:
+        """Return the number of seconds to wait for the primary's first chunk before hedging."""
+        delay = self.primary.latency_percentile(self.hedge_percentile)
+        return self.initial_hedge_delay if delay is None else delay
+
+    def _start(self, provider, results, text, instruction_name, expires=None, blocking=True):
+        """Start a request to a provider once it has a free slot, giving it the time left to `expires`."""
+        wait = None if expires is None else max(0.0, expires - time.monotonic())
+        if not provider.slots.acquire(blocking, wait if blocking else None):
+            return None
+        attempt = _Attempt(provider, results)
+        timeout = None if expires is None else max(0.0, expires - time.monotonic())
+        self.executor.submit(attempt.run, text, instruction_name, timeout)
+        return attempt
+
+    @staticmethod
+    def _next(results, expires, wait=None):
+        """Return the next result, (None, None, None) after `wait` seconds, raise TimeoutError past `expires`."""
+        if expires is not None:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("LLM request timed out")
+            wait = remaining if wait is None else min(wait, remaining)
+        try:
+            return results.get(timeout=wait)
+        except queue.Empty:
+            if expires is not None and time.monotonic() >= expires:
+                raise TimeoutError("LLM request timed out")
+            return None, None, None
+
+    def stream(self, text, instruction_name=None, timeout=None):
+        """
+        Generate content for a text, yielding the text of each chunk of the first provider to answer.
+
+        Parameters:
+            text (str): The prompt text.
+            instruction_name (str): The name of the system instruction, defaults to the SRE one.
+            timeout (float): Number of seconds the whole generation may take, unlimited if None.
+
+        Yields:
+            str: The text of each streamed chunk.
+
+        Raises:
+            TimeoutError: The generation did not complete within the timeout.
+        """
+        expires = None if timeout is None else time.monotonic() + timeout
+        results = queue.Queue()
+        attempts = []
+        primary_attempt = self._start(self.primary, results, text, instruction_name, expires)
+        if primary_attempt is None:
+            raise TimeoutError(f"LLM provider {self.primary.name} has no free slot")
+        attempts.append(primary_attempt)
+        can_hedge = self.hedge is not None
+        hedge_started = False
+        wait = self.hedge_delay() if can_hedge else None
+        error = None
+        try:
+            while True:
+                attempt, chunk, exception = self._next(results, expires, wait)
+                if attempt is not None and exception is None:
+                    break
+                if exception is not None:
+                    error = exception
+                    attempts.remove(attempt)
+                    logging.warning(f"LLM provider {attempt.provider.name} failed: {exception}")
+                if can_hedge:
+                    # Wait for the hedge provider only when no request is left, never queue behind it otherwise.
+                    hedge_attempt = self._start(
+                        self.hedge, results, text, instruction_name, expires, blocking=not attempts
+                    )
+                    if hedge_attempt is not None:
+                        attempts.append(hedge_attempt)
+                        hedge_started = True
+                    can_hedge = False
+                wait = None
+                if not attempts:
+                    raise error
+
+            winner = attempt
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+            if hedge_started:
+                hedged_requests.inc(winner=winner.provider.name)
+
+            while chunk is not None:
+                yield chunk
+                attempt, chunk, exception = self._next(results, expires)
+                while attempt is not winner:
+                    attempt, chunk, exception = self._next(results, expires)
+                if exception is not None:
+                    raise exception
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def generate(self, text, instruction_name=None, timeout=None) -> str:
+        """
+        Generate content for a text.
+
+        Parameters:
+            text (str): The prompt text.
+            instruction_name (str): The name of the system instruction, defaults to the SRE one.
+            timeout (float): Number of seconds the generation may take, unlimited if None.
+
+        Returns:
+            str: The generated text.
+        """
+        return "".join(self.stream(text, instruction_name, timeout))
+
+    def stream_to_slack(
+        self, client, channel, text, thread_ts=None, update_interval=1.0, instruction_name=None, timeout=None
+    ) -> str:
+        """
+        Stream generated content into a Slack message, see `stream_to_slack`.
+
+        Returns:
+            str: The generated text.
+        """
+        return stream_to_slack(
+            self.stream(text, instruction_name, timeout), client, channel, thread_ts, update_interval
+        )
+
+
+def stream_to_slack(chunks, client, channel, thread_ts=None, update_interval=1.0) -> str:
+    """
+    Stream generated content into a Slack message.
+
+    The message is posted as soon as the first chunk arrives and is then
+    edited with `chat.update` at most once every `update_interval` seconds,
+    with a final update once the generation is complete.
+
+    Parameters:
+        chunks (iterable): The text of each generated chunk.
+        client (WebClient): The Slack Web API client.
+        channel (str): The channel to post to.
+        thread_ts (str): The timestamp of the thread to reply in, if any.
+        update_interval (float): Minimum number of seconds between two message updates.
+
+    Returns:
+        str: The generated text.
+    """
+    generated = ""
+    ts = None
+    updated_at = 0.0
+    pending = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        generated += chunk
+        if ts is None:
+            response = client.chat_postMessage(channel=channel, text=generated, thread_ts=thread_ts)
+            ts = response["ts"]
+            updated_at = time.monotonic()
+        elif time.monotonic() - updated_at >= update_interval:
+            client.chat_update(channel=channel, ts=ts, text=generated)
+            updated_at = time.monotonic()
+            pending = False
+        else:
+            pending = True
+    if ts is not None and pending:
+        client.chat_update(channel=channel, ts=ts, text=generated)
+    return generated
+
+
+def get_llm() -> LLMRouter:
+    """
+    Return the shared router of the configured LLM providers, creating it on first use.
+
+    Returns:
+        LLMRouter: The shared router.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                hedge_name = get_llm_hedge_provider()
+                _router = LLMRouter(
+                    build_provider(get_llm_provider()),
+                    build_provider(hedge_name) if hedge_name else None,
+                    hedge_percentile=get_llm_hedge_percentile(),
+                )
+    return _router
+
+
+def set_llm(router):
+    """
+    Replace the shared router, e.g. with one of fake providers.
+
+    Parameters:
+        router (LLMRouter): The router to use.
+    """
+    global _router
+    with _router_lock:
+        _router = router
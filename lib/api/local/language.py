@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import math
+import re
+from collections import namedtuple
+
+import numpy as np
+
+"""Local sentiment and entity analysis with the same interface as lib/api/google/language.py.
+
+Sentiment is scored from a lexicon of word valences with NumPy, handling
+negations and intensifiers, and entities are the keywords of the
+configuration found in the text. It runs in microseconds and is used as the
+first tier in front of the Google Cloud Natural Language API.
+"""
+
+LocalEntity = namedtuple("LocalEntity", ["name", "type_", "salience", "mentions"])
+
+LEXICON = {
+    "thanks": 0.6, "thank": 0.6, "thx": 0.5, "ty": 0.4, "great": 0.8, "good": 0.6,
+    "nice": 0.6, "awesome": 0.9, "amazing": 0.9, "excellent": 0.9, "perfect": 0.8,
+    "love": 0.8, "cool": 0.5, "fixed": 0.5, "resolved": 0.6, "works": 0.4,
+    "working": 0.3, "green": 0.3, "passed": 0.4, "passing": 0.4, "success": 0.6,
+    "successful": 0.6, "happy": 0.7, "glad": 0.6, "yay": 0.8, "lol": 0.4,
+    "haha": 0.5, "congrats": 0.8, "welcome": 0.4, "recovered": 0.5, "stable": 0.4,
+    "ok": 0.1, "okay": 0.1, "sure": 0.2, "better": 0.4, "fast": 0.3,
+    "bad": -0.6, "broken": -0.7, "broke": -0.6, "down": -0.5, "outage": -0.8,
+    "fail": -0.6, "failed": -0.6, "failing": -0.6, "failure": -0.7, "error": -0.5,
+    "errors": -0.5, "crash": -0.7, "crashed": -0.7, "crashing": -0.7, "red": -0.3,
+    "slow": -0.4, "stuck": -0.5, "flaky": -0.5, "timeout": -0.5, "timeouts": -0.5,
+    "blocked": -0.5, "blocker": -0.6, "bug": -0.4, "issue": -0.3, "issues": -0.3,
+    "problem": -0.5, "problems": -0.5, "disruption": -0.7, "degraded": -0.6,
+    "incident": -0.5, "sad": -0.6, "sorry": -0.3, "ugh": -0.6, "terrible": -0.9,
+    "awful": -0.9, "worst": -0.9, "hate": -0.8, "annoying": -0.6, "wrong": -0.5,
+    "unavailable": -0.7, "urgent": -0.4, "critical": -0.5, "panic": -0.7,
+}
+NEGATIONS = {"not", "no", "never", "isn't", "isnt", "don't", "dont", "doesn't", "doesnt",
+             "can't", "cant", "won't", "wont", "didn't", "didnt", "nothing", "without"}
+INTENSIFIERS = {"very": 1.5, "really": 1.4, "so": 1.3, "super": 1.5, "extremely": 1.8,
+                "totally": 1.4, "completely": 1.6, "slightly": 0.6, "kinda": 0.7, "bit": 0.7}
+NEGATION_WINDOW = 3
+NORMALIZATION = 1.0
+
+TOKEN = re.compile(r"[a-z']+")
+
+VOCABULARY = {word: index for index, word in enumerate(sorted(LEXICON))}
+VALENCES = np.ascontiguousarray([LEXICON[word] for word in sorted(LEXICON)], dtype=np.float64)
+
+
+def score_tokens(tokens):
+    """
+    Score a list of lowercase tokens.
+
+    Parameters:
+        tokens (list): The tokens of a text.
+
+    Returns:
+        tuple: The score in [-1, 1], the magnitude and the number of lexicon hits.
+    """
+    lookup = [VOCABULARY.get(token, -1) for token in tokens]
+    if max(lookup, default=-1) < 0:
+        return 0.0, 0.0, 0
+    indices = np.array(lookup, dtype=np.int64)
+    hits = indices >= 0
+    hit_count = int(hits.sum())
+    valences = np.where(hits, VALENCES[np.where(hits, indices, 0)], 0.0)
+
+    negations = np.fromiter((token in NEGATIONS for token in tokens), dtype=np.int64, count=len(tokens))
+    # A word is negated when an odd number of negations precede it within the window.
+    negated = np.convolve(negations, np.r_[0, np.ones(NEGATION_WINDOW, dtype=np.int64)])[: len(tokens)] % 2 == 1
+    multipliers = np.fromiter((INTENSIFIERS.get(token, 1.0) for token in tokens), dtype=np.float64, count=len(tokens))
+    weights = np.r_[1.0, multipliers[:-1]]
+
+    contributions = valences * weights * np.where(negated, -0.75, 1.0)
+    total = float(contributions.sum())
+    score = total / math.sqrt(total * total + NORMALIZATION)
+    magnitude = float(np.abs(contributions).sum())
+    return score, magnitude, hit_count
+
+
+def tokenize(text) -> list:
+    return TOKEN.findall(text.lower())
+
+
+def analyze_sentiment(text) -> tuple:
+    """
+    Analyzes the sentiment of a given text with the local lexicon.
+
+    Parameters:
+        text (str): The text to analyze.
+
+    Returns:
+        tuple: A tuple containing the sentiment score and magnitude.
+    """
+    score, magnitude, _ = score_tokens(tokenize(text))
+    return score, magnitude
+
+
+def analyze_entities(text, matcher=None) -> list:
+    """
+    Finds the entities of a given text from a gazetteer of keywords.
+
+    Parameters:
+        text (str): The text to analyze.
+        matcher (KeywordMatcher): The compiled keywords of the gazetteer.
+
+    Returns:
+        list: LocalEntity tuples (name, type_, salience, mentions), most mentioned first.
+    """
+    if matcher is None:
+        return []
+    mentions = {}
+    for match in matcher.find_all(text):
+        mentions.setdefault(match.keyword, []).append((match.start, match.end))
+    total = sum(len(spans) for spans in mentions.values())
+    entities = [
+        LocalEntity(name, "OTHER", len(spans) / total, spans)
+        for name, spans in mentions.items()
+    ]
+    entities.sort(key=lambda entity: entity.salience, reverse=True)
+    return entities
+
+
+def annotate_text(text, matcher=None) -> dict:
+    """
+    Analyzes the sentiment and entities of a given text locally.
+
+    Parameters:
+        text (str): The text to analyze.
+        matcher (KeywordMatcher): The compiled keywords of the gazetteer.
+
+    Returns:
+        dict: A dictionary containing the sentiment score, magnitude, entities, and the number of lexicon hits.
+    """
+    score, magnitude, hits = score_tokens(tokenize(text))
+    return {
+        "score": score,
+        "magnitude": magnitude,
+        "entities": analyze_entities(text, matcher),
+        "hits": hits,
+        "source": "local",
+    }
+
+
+def is_ambiguous(result, band=0.25) -> bool:
+    """
+    Check whether a local result is too uncertain to decide the sentiment label.
+
+    Text without any sentiment word is confidently neutral. Text with sentiment
+    words whose score still falls inside the decision band (mixed or weak
+    signals) is ambiguous.
+
+    Parameters:
+        result (dict): The result of `annotate_text`.
+        band (float): The half width of the neutral decision band.
+
+    Returns:
+        bool: True if the cloud API should decide, False otherwise.
+    """
+    return result["hits"] > 0 and abs(result["score"]) <= band
@@ -7,6 +7,7 @@
 """OpenAI API module"""
 
 import sys
+import threading
 from pathlib import Path
 
 # Append the project root to the system path for importing modules
@@ -14,26 +15,104 @@ current_script_dir = Path(__file__).resolve().parent
 project_root = current_script_dir.parent.parent.parent
 sys.path.append(str(project_root))
 
+MAX_CONNECTIONS = 20
+MAX_RETRIES = 2
+
+_client = None
+_client_lock = threading.Lock()
+
 
 def initialize_openai_client():
+    """
+    Create an OpenAI client with a pool of keep-alive HTTP connections.
+
+    Returns:
+        OpenAI: The client.
+    """
+    import httpx
     from openai import OpenAI
 
     from utils import get_openai_project_id, get_openai_project_service_account
 
-    client = OpenAI()
-    client.api_key = get_openai_project_service_account()
-    client.project_id = get_openai_project_id()
+    return OpenAI(
+        api_key=get_openai_project_service_account(),
+        project=get_openai_project_id(),
+        max_retries=MAX_RETRIES,
+        http_client=httpx.Client(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+            ),
+        ),
+    )
+
+
+def get_openai_client():
+    """
+    Return the shared OpenAI client, creating it on first use.
+
+    The client keeps its HTTP connections alive, so it is created once and
+    reused by every request instead of opening new connections per request.
+
+    Returns:
+        OpenAI: The shared client instance.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = initialize_openai_client()
+    return _client
+
+
+def build_messages(prompt, instruction=None) -> list:
+    messages = []
+    if instruction:
+        messages.append({"role": "system", "content": instruction})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def send_request(prompt, model, instruction=None):
+    """
+    Send a chat completion request.
+
+    Parameters:
+        prompt (str): The prompt text.
+        model (str): The model to use.
+        instruction (str): The system instruction, if any.
+
+    Returns:
+        ChatCompletion: The completion.
+    """
+    return get_openai_client().chat.completions.create(
+        model=model,
+        messages=build_messages(prompt, instruction),
+    )
 
-    return client
 
+def stream_request(prompt, model, instruction=None, timeout=None):
+    """
+    Send a streamed chat completion request, yielding the text of each chunk as it is received.
 
-# def send_request(prompt):
-#     client = initialize_openai_client()
+    Parameters:
+        prompt (str): The prompt text.
+        model (str): The model to use.
+        instruction (str): The system instruction, if any.
+        timeout (float): Number of seconds the request may take, the client's default if None.
 
-#     completion = client.chat.completions.create(
-#         model="gpt-3.5-turbo",
-#         messages=[
-#             {"role": "user", "content": prompt},
-#         ],
-#     )
-#     return completion
\ No newline at end of file
+    Yields:
+        str: The text of each streamed chunk.
+    """
+    stream = get_openai_client().chat.completions.create(
+        model=model,
+        messages=build_messages(prompt, instruction),
+        stream=True,
+        **({} if timeout is None else {"timeout": timeout}),
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Logging setup: records are queued by the threads that log them and formatted
+and written by a background listener thread, so no handler thread waits on log
+I/O.
+
+Records are written as text lines or, with the JSON format, one JSON object per
+line holding the `extra` fields of the record. A sampling filter keeps at most
+a number of records per second from each line of code at WARNING level and
+below, and reports how many were suppressed on the next record it keeps, so
+that a burst of identical lines (e.g. one per message while an API is down)
+costs neither the handler threads nor the log volume.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+from datetime import datetime, timezone
+
+from metrics import REGISTRY
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# The attributes of every record, the others are the `extra` fields.
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+suppressed_records = REGISTRY.counter(
+    "mtpm_log_records_suppressed_total", "Log records dropped by the sampling filter, by level."
+)
+
+_listener = None
+
+
+class TextFormatter(logging.Formatter):
+    """The text format, noting how many records of the same line were suppressed before."""
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" ({suppressed} similar suppressed)"
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with its `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queues the records as they are, to be formatted by the listener thread.
+
+    The queue never leaves the process, so the records need not be made picklable:
+    their arguments and exception info are kept for the formatters of the listener.
+    """
+
+    def prepare(self, record):
+        return copy.copy(record)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps at most `per_second` records per second from each line of code, up to a level."""
+
+    def __init__(self, per_second, level=logging.WARNING):
+        """
+        Parameters:
+            per_second (int): The number of records kept per second from each line of code.
+            level (int): Records above this level are always kept.
+        """
+        super().__init__()
+        self.per_second = per_second
+        self.level = level
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        second = int(record.created)
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None or state[0] != second:
+                # A new second: keep the record and report the ones dropped since the last kept one.
+                if state is not None and state[2]:
+                    record.suppressed = state[2]
+                self._sites[site] = [second, 1, 0]
+                return True
+            if state[1] < self.per_second:
+                state[1] += 1
+                return True
+            state[2] += 1
+        suppressed_records.inc(level=record.levelname)
+        return False
+
+
+def setup_logging(level="INFO", log_format="text", sample_per_second=0):
+    """
+    Route the records of the root logger through a queue to a background writer thread.
+
+    Parameters:
+        level (str): The minimum level of the records, e.g. 'DEBUG'.
+        log_format (str): 'text' or 'json'.
+        sample_per_second (int): The number of records kept per second from each line of code
+                                 at WARNING level and below, 0 keeps every record.
+
+    Returns:
+        QueueListener: The started listener, stopped (and its queue flushed) at exit.
+    """
+    global _listener
+    stop_logging()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JSONFormatter() if log_format == "json" else TextFormatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(records)
+    if sample_per_second:
+        queue_handler.addFilter(SamplingFilter(sample_per_second))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _listener = logging.handlers.QueueListener(records, stream_handler)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write the queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# Registered at import, before the exit handlers of the app, so that it runs after them and writes their records.
+atexit.register(stop_logging)
@@ -5,31 +5,148 @@
 
 
 import importlib
+import logging
 
-from lib.api.google.language import analyze_entities, analyze_sentiment
+from deadline import BreakerOpen, degraded, get_breakers, open_call
+from lib.api.google.language import annotate_text, async_annotate_text
+from lib.api.local import language as local_language
+from metrics import REGISTRY, timed
+from utils import get_nlp_backend
 
-keywords_module = importlib.import_module("mobile-slack-app.config.keywords")
-members_module = importlib.import_module("mobile-slack-app.config.members")
-template_module = importlib.import_module("mobile-slack-app.config.template")
+matcher_module = importlib.import_module("mobile-slack-app.config.matcher")
+reloader_module = importlib.import_module("mobile-slack-app.config.reloader")
 slack_module = importlib.import_module("mobile-slack-app.config.slack")
 
-allowed_members = members_module.load_allowed_members()
-allowed_keywords = keywords_module.load_keywords()
+# The interval is given to `config.start`, so that importing the app reads no configuration.
+config = reloader_module.ConfigReloader()
 
+nlp_requests = REGISTRY.counter(
+    "mtpm_nlp_requests_total", "Messages analyzed, by the tier that produced the result."
+)
 
-def process_message(message) -> dict:
+
+def get_allowed_members() -> frozenset:
+    """Return the IDs of the allowed members from the current configuration."""
+    return config.current().members
+
+
+def get_allowed_keywords() -> dict:
+    """Return the keywords configuration from the current configuration."""
+    return config.current().keywords
+
+
+def analyze_locally(message, matches=None):
+    """
+    Analyze a message with the local tier and decide whether the cloud API is needed.
+
+    Parameters:
+        message (dict): The message to analyze.
+        matches (list): The keyword matches of the message, the message is scanned when they are not given.
+
+    Returns:
+        tuple: The local result, or None when the NLP backend is 'cloud', and whether to escalate to the cloud API.
+    """
+    backend = get_nlp_backend()
+    if backend == "cloud":
+        return None, True
+    result = local_language.annotate_text(
+        message["text"], get_keyword_matcher(get_allowed_keywords())
+    )
+    if backend == "local":
+        return result, False
+    if matches is None:
+        matches = match_keywords(message)
+    return result, bool(matches) or local_language.is_ambiguous(result)
+
+
+def degrade(message, result, error=None) -> dict:
+    """
+    Fall back to the local analysis of a message when the cloud API is skipped or fails.
+
+    Parameters:
+        message (dict): The message.
+        result (dict): The local result, None if the message was not analyzed locally.
+        error (Exception): The error of the cloud API call, if it failed.
+
+    Returns:
+        dict: The local result.
+    """
+    if error is not None:
+        logging.warning(f"Natural Language API call failed, using the local analysis: {error}")
+        degraded.inc(stage="nlp", reason="error")
+    nlp_requests.inc(tier="local")
+    if result is None:
+        result = local_language.annotate_text(
+            message["text"], get_keyword_matcher(get_allowed_keywords())
+        )
+    return result
+
+
+@timed("process_message")
+def process_message(message, matches=None, deadline=None) -> dict:
     """
     Process a message by analyzing its sentiment and entities.
 
+    With the default 'tiered' NLP backend the message is analyzed locally first, and the
+    Google Cloud Natural Language API is only called when the message matches a keyword
+    or the local sentiment is ambiguous. The local result is used when the call would
+    exceed the deadline of the event, when the NLP circuit breaker is open, or when the
+    call fails.
+
     Parameters:
         message (dict): The message to process.
+        matches (list): The keyword matches of the message, as returned by `match_keywords`.
+        deadline (Deadline): The deadline of the event, the cloud API call has no timeout without it.
 
     Returns:
         dict: A dictionary containing the sentiment score, magnitude, and entities.
     """
-    score, magnitude = analyze_sentiment(message["text"])
-    entities = analyze_entities(message["text"])
-    return {"score": score, "magnitude": magnitude, "entities": entities}
+    result, escalate = analyze_locally(message, matches)
+    if not escalate:
+        nlp_requests.inc(tier="local")
+        return result
+    timeout, skipped = open_call("nlp", deadline, check_breaker=False)
+    if skipped:
+        return degrade(message, result)
+    try:
+        cloud_result = annotate_text(message["text"], timeout=timeout, breaker=get_breakers()["nlp"])
+    except BreakerOpen:
+        degraded.inc(stage="nlp", reason="breaker")
+        return degrade(message, result)
+    except Exception as e:
+        return degrade(message, result, e)
+    nlp_requests.inc(tier="cloud")
+    return cloud_result
+
+
+async def async_process_message(message, matches=None, deadline=None) -> dict:
+    """
+    Asynchronous version of `process_message`.
+
+    Parameters:
+        message (dict): The message to process.
+        matches (list): The keyword matches of the message, as returned by `match_keywords`.
+        deadline (Deadline): The deadline of the event, the cloud API call has no timeout without it.
+
+    Returns:
+        dict: A dictionary containing the sentiment score, magnitude, and entities.
+    """
+    result, escalate = analyze_locally(message, matches)
+    if not escalate:
+        nlp_requests.inc(tier="local")
+        return result
+    timeout, skipped = open_call("nlp", deadline, check_breaker=False)
+    if skipped:
+        return degrade(message, result)
+    try:
+        cloud_result = await async_annotate_text(message["text"], timeout=timeout, breaker=get_breakers()["nlp"])
+    except BreakerOpen:
+        degraded.inc(stage="nlp", reason="breaker")
+        return degrade(message, result)
+    except Exception as e:
+        return degrade(message, result, e)
+    nlp_requests.inc(tier="cloud")
+    return cloud_result
 
 
 def process_score(score) -> str:
@@ -50,6 +167,38 @@ def process_score(score) -> str:
         return ":thumbsup:"
 
 
+def get_keyword_matcher(keywords):
+    """
+    Return the compiled matcher of a keywords configuration.
+
+    Parameters:
+        keywords (dictionary): The keywords configuration, as returned by `load_keywords`.
+
+    Returns:
+        KeywordMatcher: The matcher compiled at load time, or a newly compiled one
+                        if the configuration is a plain dictionary.
+    """
+    matcher = getattr(keywords, "matcher", None)
+    if matcher is None:
+        matcher = matcher_module.KeywordMatcher(keywords.keys())
+    return matcher
+
+
+@timed("keyword_match")
+def find_keywords(text, keywords) -> list:
+    """
+    Find every occurrence of the specified keywords (keys) in a text.
+
+    Parameters:
+        text (str): The text to check.
+        keywords (dictionary): A dictionary of keywords to search for.
+
+    Returns:
+        list: KeywordMatch tuples (keyword, start, end) ordered by position.
+    """
+    return get_keyword_matcher(keywords).find_all(text)
+
+
 def contains_keywords(text, keywords) -> dict:
     """
     Check if a text contains any of the specified keywords (keys) and return the matching keyword.
@@ -61,10 +210,7 @@ def contains_keywords(text, keywords) -> dict:
     Returns:
         dict: The keyword if found, None otherwise.
     """
-    for keyword in keywords.keys():
-        if keyword.lower() in text.lower():
-            return keyword
-    return None
+    return get_keyword_matcher(keywords).first(text)
 
 
 def filter_message_by_keyword(message, keywords) -> dict:
@@ -95,9 +241,7 @@ def process_and_filter_message(message, keywords):
         None: If the message does not contain any of the specified keywords.
     """
     if contains_keywords(message["text"], keywords):
-        score, magnitude = analyze_sentiment(message["text"])
-        entities = analyze_entities(message["text"])
-        return {"score": score, "magnitude": magnitude, "entities": entities}
+        return annotate_text(message["text"])
     else:
         return None
 
@@ -112,7 +256,7 @@ def check_member(message) -> bool:
     Returns:
         bool: True if the message is from an allowed member, False otherwise.
     """
-    return message["user"] in allowed_members
+    return message["user"] in get_allowed_members()
 
 
 def check_keyword(message) -> bool:
@@ -125,7 +269,42 @@ def check_keyword(message) -> bool:
     Returns:
         bool: True if the message contains any of the allowed keywords, False otherwise.
     """
-    return contains_keywords(message["text"], allowed_keywords)
+    return contains_keywords(message["text"], get_allowed_keywords())
+
+
+def match_keywords(message) -> list:
+    """
+    Find every allowed keyword occurring in a message.
+
+    Parameters:
+        message (dict): The message to check.
+
+    Returns:
+        list: KeywordMatch tuples (keyword, start, end) ordered by position.
+    """
+    return find_keywords(message["text"], get_allowed_keywords())
+
+
+def resolve_actions(message, matches=None, score=None) -> tuple:
+    """
+    Look up the actions of a message in the routing table of the current configuration.
+
+    Parameters:
+        message (dict): The message.
+        matches (list): The keyword matches of the message, as returned by `match_keywords`.
+        score (float): The sentiment score of the message, None if it was not analyzed.
+
+    Returns:
+        tuple: The names of the actions to run, the actions of each matched keyword in turn.
+    """
+    routing = config.current().rules
+    member = message.get("user")
+    channel = message.get("channel")
+    keywords = dict.fromkeys(match.keyword for match in matches or ()) or [None]
+    actions = {}
+    for keyword in keywords:
+        actions.update(dict.fromkeys(routing.resolve(member, keyword, channel, score)))
+    return tuple(actions)
 
 
 def get_keyword_object(keyword, config):
@@ -142,25 +321,92 @@ def get_keyword_object(keyword, config):
     return config.get(keyword, None)
 
 
-def process_message_for_keyword(message) -> dict:
+def escape_mrkdwn(text) -> str:
+    """Escape the characters Slack reserves for links and mentions in a text put in a template."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def template_fields(message, keyword=None, processed_message=None) -> dict:
+    """
+    Build the values of the template placeholders for a message.
+
+    Parameters:
+        message (dict): The message, or the channel of a summary of alerts.
+        keyword (str): The keyword the template belongs to.
+        processed_message (dict): The sentiment score, magnitude and entities of the message, if analyzed.
+
+    Returns:
+        dict: The values of the placeholders the message has: 'keyword', 'channel', 'user', 'text', 'ts',
+              'link', 'score', 'magnitude', 'sentiment' and 'entities'.
+    """
+    fields = {}
+    if keyword:
+        fields["keyword"] = keyword
+    channel = message.get("channel")
+    if channel:
+        fields["channel"] = f"<#{channel}>"
+    if message.get("user"):
+        fields["user"] = f"<@{message['user']}>"
+    if message.get("text"):
+        fields["text"] = escape_mrkdwn(message["text"])
+    if message.get("ts"):
+        fields["ts"] = message["ts"]
+        if channel:
+            fields["link"] = f"https://slack.com/archives/{channel}/p{message['ts'].replace('.', '')}"
+    if processed_message:
+        score = processed_message.get("score")
+        if score is not None:
+            fields["score"] = score
+            fields["sentiment"] = process_score(score)
+        if processed_message.get("magnitude") is not None:
+            fields["magnitude"] = processed_message["magnitude"]
+        fields["entities"] = ", ".join(
+            escape_mrkdwn(entity.name) for entity in processed_message.get("entities") or ()
+        )
+    return fields
+
+
+@timed("template_build")
+def get_keyword_blocks(keyword, fields=None) -> list:
+    """
+    Render the Slack blocks of the template associated with a keyword.
+
+    Parameters:
+        keyword (str): The keyword.
+        fields (dict): The values of the template placeholders, as returned by `template_fields`.
+
+    Returns:
+        list: The Slack blocks of the keyword's template if found, None otherwise.
+    """
+    snapshot = config.current()
+    keyword_object = get_keyword_object(keyword, snapshot.keywords)
+    if keyword_object:
+        template_name = keyword_object.get("template")
+        if template_name:
+            template_data = snapshot.templates.render(template_name, fields)
+            if template_data:
+                return slack_module.SlackMessageFormatter.format_slack_message(
+                    template_data
+                )
+    return None
+
+
+def process_message_for_keyword(message, matches=None, processed_message=None) -> dict:
     """
-    Process a message to check for keywords and retrieve associated objects if any keyword is found, then load the associated template.
+    Process a message to check for keywords and retrieve associated objects if any keyword is found, then render the associated template.
 
     Parameters:
         message (dict): The message to process.
+        matches (list): The keyword matches of the message, as returned by `match_keywords`.
+                        The message is scanned when they are not given.
+        processed_message (dict): The analysis of the message filled into the template, if any.
 
     Returns:
         dict: The template object associated with the keyword if found, None otherwise.
     """
-    keyword = contains_keywords(message["text"], allowed_keywords)
-    if keyword:
-        keyword_object = get_keyword_object(keyword, allowed_keywords)
-        if keyword_object:
-            template_name = keyword_object.get("template")
-            if template_name:
-                template_data_str = template_module.build_template(template_name)
-                if template_data_str:
-                    return slack_module.SlackMessageFormatter.format_slack_message(
-                        template_data_str
-                    )
+    if matches is None:
+        matches = match_keywords(message)
+    if matches:
+        keyword = matches[0].keyword
+        return get_keyword_blocks(keyword, template_fields(message, keyword, processed_message))
     return None
@@ -8,19 +8,36 @@
 import json
 import os
 
+from .matcher import KeywordConfig
 
-def load_keywords():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    keywords_file = os.path.join(script_dir, "keywords.json")
+keywords_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keywords.json")
 
-    """Load the keywords from the JSON file."""
+
+def load_keywords(strict=False) -> KeywordConfig:
+    """
+    Load the keywords from the JSON file and compile their matcher.
+
+    Parameters:
+        strict (bool): Raise loading errors instead of returning an empty configuration.
+
+    Returns:
+        KeywordConfig: The keywords configuration.
+    """
     try:
         with open(keywords_file, "r") as file:
             config = json.load(file)
-        return config
+        if not isinstance(config, dict):
+            raise ValueError(f"{keywords_file} must contain a JSON object.")
+        return KeywordConfig(config)
     except FileNotFoundError:
-        return []
+        if strict:
+            raise
+        return KeywordConfig()
     except json.JSONDecodeError:
-        return []
+        if strict:
+            raise
+        return KeywordConfig()
     except Exception:
-        return []
+        if strict:
+            raise
+        return KeywordConfig()
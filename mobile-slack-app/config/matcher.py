@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import bisect
+import re
+from collections import deque, namedtuple
+
+"""Multi-pattern keyword matching with an Aho-Corasick automaton."""
+
+KeywordMatch = namedtuple("KeywordMatch", ["keyword", "start", "end"])
+
+# Slack wraps links as <https://example.com|label>, bare URLs are matched too.
+URL_PATTERN = re.compile(r"<[a-zA-Z][\w+.-]*://[^>]*>|\b[a-zA-Z][\w+.-]*://\S+")
+
+
+def is_word_char(char) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a set of keywords.
+
+    The automaton is compiled once, and a search walks the message a single
+    time, so its cost is linear in the message length whatever the number of
+    keywords.
+    """
+
+    def __init__(self, keywords, word_boundary=True, case_fold=True, skip_urls=True):
+        """
+        Compile the automaton.
+
+        Parameters:
+            keywords (iterable): The keywords to match.
+            word_boundary (bool): Only match keywords that are whole words.
+            case_fold (bool): Match keywords regardless of case.
+            skip_urls (bool): Ignore matches inside URLs and Slack links.
+        """
+        self.keywords = list(keywords)
+        self.word_boundary = word_boundary
+        self.case_fold = case_fold
+        self.skip_urls = skip_urls
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for index, keyword in enumerate(self.keywords):
+            self._add(self._fold(keyword), index)
+        self._build_failure_links()
+
+    def _fold(self, text) -> str:
+        return text.casefold() if self.case_fold else text
+
+    def _add(self, pattern, index):
+        if not pattern:
+            return
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((index, len(pattern)))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def _fold_with_offsets(self, text):
+        """Fold a text and map every folded character back to its original index."""
+        if not self.case_fold:
+            return text, None
+        folded = []
+        offsets = []
+        for index, char in enumerate(text):
+            folded_char = char.casefold()
+            folded.append(folded_char)
+            offsets.extend([index] * len(folded_char))
+        return "".join(folded), offsets
+
+    def _url_spans(self, text):
+        if not self.skip_urls:
+            return [], []
+        spans = [match.span() for match in URL_PATTERN.finditer(text)]
+        return [start for start, _ in spans], [end for _, end in spans]
+
+    def find_all(self, text) -> list:
+        """
+        Find every keyword occurrence in a text in a single pass.
+
+        Parameters:
+            text (str): The text to search.
+
+        Returns:
+            list: KeywordMatch tuples (keyword, start, end) ordered by position,
+                  with positions referring to the original text.
+        """
+        if not text or not self.keywords:
+            return []
+        folded, offsets = self._fold_with_offsets(text)
+        url_starts, url_ends = self._url_spans(text)
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        matches = []
+        node = 0
+        for position, char in enumerate(folded):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for index, length in output[node]:
+                first = position - length + 1
+                start = offsets[first] if offsets else first
+                end = offsets[position] + 1 if offsets else position + 1
+                if self.word_boundary and (
+                    (start > 0 and is_word_char(text[start - 1]))
+                    or (end < len(text) and is_word_char(text[end]))
+                ):
+                    continue
+                if url_starts:
+                    span = bisect.bisect_right(url_starts, start) - 1
+                    if span >= 0 and start < url_ends[span]:
+                        continue
+                matches.append(KeywordMatch(self.keywords[index], start, end))
+        matches.sort(key=lambda match: (match.start, -match.end))
+        return matches
+
+    def first(self, text):
+        """
+        Find the first keyword occurring in a text.
+
+        Parameters:
+            text (str): The text to search.
+
+        Returns:
+            str: The first matching keyword, or None if no keyword matches.
+        """
+        matches = self.find_all(text)
+        return matches[0].keyword if matches else None
+
+
+class KeywordConfig(dict):
+    """The keywords configuration along with its compiled matcher."""
+
+    def __init__(self, config=None):
+        super().__init__(config or {})
+        self.matcher = KeywordMatcher(self.keys())
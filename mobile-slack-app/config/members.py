@@ -8,21 +8,38 @@
 import json
 import os
 
+allowed_members_file = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "allowed_members.json"
+)
 
-def load_allowed_members():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    allowed_members_file = os.path.join(script_dir, "allowed_members.json")
 
-    """Load the allowed members from the JSON file."""
+def load_allowed_members(strict=False) -> frozenset:
+    """
+    Load the allowed members from the JSON file.
+
+    Parameters:
+        strict (bool): Raise loading errors instead of returning an empty set.
+
+    Returns:
+        frozenset: The IDs of the allowed members.
+    """
     try:
         with open(allowed_members_file, "r") as file:
             config = json.load(file)
-        return set(config["allowed_member_ids"])
+        return frozenset(config["allowed_member_ids"])
     except FileNotFoundError:
-        return set()
+        if strict:
+            raise
+        return frozenset()
     except json.JSONDecodeError:
-        return set()
+        if strict:
+            raise
+        return frozenset()
     except KeyError:
-        return set()
+        if strict:
+            raise
+        return frozenset()
     except Exception:
-        return set()
+        if strict:
+            raise
+        return frozenset()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from . import keywords, members, rules, template
+
+"""Hot reload of the keywords, members, templates and rules configuration."""
+
+ConfigSnapshot = namedtuple("ConfigSnapshot", ["keywords", "members", "templates", "rules"])
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+class ConfigReloader:
+    """
+    Watches the configuration files by polling their modification times and
+    rebuilds the configuration in a background thread when they change.
+
+    The current configuration is an immutable snapshot swapped in with a single
+    assignment, so readers never block on a reload and always see a consistent
+    set of keywords, members, templates and routing rules. When a file fails to load, the last
+    good version of that part of the configuration is kept.
+
+    The configuration is loaded on the first call to `current` or `start`,
+    not when the reloader is created.
+    """
+
+    def __init__(self, interval=2.0):
+        """
+        Parameters:
+            interval (float): Number of seconds between two checks of the configuration files.
+        """
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._signature = None
+        self._snapshot = None
+        self._load_lock = threading.Lock()
+
+    def load(self) -> ConfigSnapshot:
+        """
+        Load the configuration, unless it is already loaded.
+
+        Returns:
+            ConfigSnapshot: The current configuration.
+        """
+        with self._load_lock:
+            if self._snapshot is None:
+                self._signature = self._files_signature()
+                self._snapshot = self._build(None)
+        return self._snapshot
+
+    def _files_signature(self):
+        signature = [
+            (keywords.keywords_file, file_signature(keywords.keywords_file)),
+            (members.allowed_members_file, file_signature(members.allowed_members_file)),
+            (rules.rules_file, file_signature(rules.rules_file)),
+        ]
+        try:
+            names = sorted(os.listdir(template.templates_dir))
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(template.templates_dir, name)
+            signature.append((path, file_signature(path)))
+        return tuple(signature)
+
+    def _build(self, previous):
+        failed = False
+        try:
+            keywords_config = keywords.load_keywords(strict=True)
+        except Exception as e:
+            logging.error(f"Failed to load {keywords.keywords_file}, keeping the last good keywords: {e}")
+            keywords_config = previous.keywords if previous else keywords.load_keywords()
+            failed = True
+
+        try:
+            allowed_members = members.load_allowed_members(strict=True)
+        except Exception as e:
+            logging.error(
+                f"Failed to load {members.allowed_members_file}, keeping the last good members: {e}"
+            )
+            allowed_members = previous.members if previous else members.load_allowed_members()
+            failed = True
+
+        try:
+            routing = rules.compile_rules(keywords_config, rules.load_rules(strict=True))
+        except Exception as e:
+            logging.error(f"Failed to load {rules.rules_file}, keeping the last good rules: {e}")
+            routing = rules.compile_rules(keywords_config, previous.rules.file_rules if previous else ())
+            failed = True
+
+        templates = template.TemplateRegistry(check_interval=None)
+        templates.load_all(fallback=previous.templates if previous else None)
+        templates.report_missing(keywords_config)
+
+        if failed:
+            self.failures += 1
+        return ConfigSnapshot(keywords_config, allowed_members, templates, routing)
+
+    def current(self) -> ConfigSnapshot:
+        """
+        Return the current configuration.
+
+        Returns:
+            ConfigSnapshot: The keywords configuration, the allowed members, the template registry
+                            and the routing table.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.load()
+        return snapshot
+
+    def check(self) -> bool:
+        """
+        Reload the configuration if any of its files changed.
+
+        Returns:
+            bool: True if the configuration was reloaded, False otherwise.
+        """
+        if self._snapshot is None:
+            self.load()
+            return False
+        signature = self._files_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        self._snapshot = self._build(self._snapshot)
+        self.reloads += 1
+        logging.info("Reloaded the keywords, members, templates and rules configuration.")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Failed to reload the configuration: {e}")
+
+    def start(self, interval=None):
+        """
+        Load the configuration and start watching its files in a background thread.
+
+        Parameters:
+            interval (float): Number of seconds between two checks of the configuration files,
+                              the one given to the constructor by default.
+        """
+        if interval is not None:
+            self.interval = interval
+        self.load()
+        if self._thread is not None or not self.interval:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="config-reloader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching the configuration files."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
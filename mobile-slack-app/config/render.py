@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import logging
+import string
+
+"""Render plans of the templates.
+
+The strings of a template may hold `str.format` placeholders filled from the
+message and its analysis, e.g. "*Bitrise* outage reported by {user} in
+{channel}: {sentiment}". A template is compiled once into a render plan: the
+parts of the template without placeholders are kept as they are and shared by
+every render, and the paths leading to the strings with placeholders (the
+slots) are recorded. Rendering copies the containers along those paths and
+formats the slot strings only, the rest of the template is never copied.
+"""
+
+FORMATTER = string.Formatter()
+
+
+class Fields(dict):
+    """The values of the placeholders, missing ones rendering as empty strings."""
+
+    def __missing__(self, key):
+        return ""
+
+
+class StringSlot:
+    """A template string with placeholders."""
+
+    def __init__(self, template, names):
+        self.template = template
+        self.names = names
+        self._pieces = list(FORMATTER.parse(template))
+
+    def render(self, fields):
+        try:
+            return self.template.format_map(fields)
+        except (ValueError, TypeError):
+            # A value that does not fit the format spec of its placeholder, e.g. a
+            # missing score under {score:.2f}, is rendered without the spec.
+            return self._render_pieces(fields)
+
+    def _render_pieces(self, fields):
+        parts = []
+        for literal, name, spec, conversion in self._pieces:
+            parts.append(literal)
+            if name is None:
+                continue
+            value = fields[name]
+            if conversion:
+                value = FORMATTER.convert_field(value, conversion)
+            try:
+                parts.append(format(value, spec or ""))
+            except (ValueError, TypeError):
+                parts.append(str(value))
+        return "".join(parts)
+
+
+class ContainerSlot:
+    """A dictionary or list of the template holding slots, copied on render."""
+
+    def __init__(self, node, slots):
+        self.node = node
+        self.slots = slots
+
+    def render(self, fields):
+        copy = self.node.copy()
+        for key, slot in self.slots:
+            copy[key] = slot.render(fields)
+        return copy
+
+
+def parse_placeholders(template):
+    """
+    Find the placeholders of a template string.
+
+    Parameters:
+        template (str): The string.
+
+    Returns:
+        list: The names of the placeholders, None if the string is static (invalid format strings,
+              or placeholders that are not plain names, are kept as static text).
+    """
+    try:
+        names = [name for _, name, _, _ in FORMATTER.parse(template) if name is not None]
+    except ValueError as e:
+        logging.warning(f"Keeping template string {template!r} as static text: {e}")
+        return None
+    if not names:
+        return None
+    if not all(name.isidentifier() for name in names):
+        logging.warning(f"Keeping template string {template!r} as static text: placeholders must be names.")
+        return None
+    return names
+
+
+def compile_node(node):
+    """
+    Compile a part of a template.
+
+    Parameters:
+        node: A dictionary, list, string or other JSON value of the template.
+
+    Returns:
+        StringSlot or ContainerSlot: The slot rendering the part, None if the part is static.
+    """
+    if isinstance(node, str):
+        names = parse_placeholders(node)
+        return StringSlot(node, names) if names else None
+    if isinstance(node, dict):
+        items = node.items()
+    elif isinstance(node, list):
+        items = enumerate(node)
+    else:
+        return None
+    slots = [(key, slot) for key, slot in ((key, compile_node(child)) for key, child in items) if slot is not None]
+    return ContainerSlot(node, slots) if slots else None
+
+
+class RenderPlan:
+    """A template compiled into its static parts and the slots patched on render."""
+
+    def __init__(self, template):
+        """
+        Compile a template.
+
+        Parameters:
+            template (dict): The template merged with the base template. It is shared and not modified.
+        """
+        self.template = template
+        self._slot = compile_node(template)
+
+    def render(self, fields=None) -> dict:
+        """
+        Render the template.
+
+        Parameters:
+            fields (dict): The values of the placeholders.
+
+        Returns:
+            dict: The rendered template. Its static parts are shared with the template
+                  and every other render, and must not be modified.
+        """
+        if self._slot is None:
+            return self.template
+        if not isinstance(fields, Fields):
+            fields = Fields(fields or {})
+        return self._slot.render(fields)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import itertools
+import json
+import os
+from collections import namedtuple
+
+"""Routing rules compiled into a lookup table.
+
+A rule names the actions to run for messages matching all of its conditions on
+the member, the keyword, the channel and the sentiment band; a condition left
+out matches anything. Every keyword of keywords.json with an `action` is a rule
+on that keyword alone, rules.json adds rules such as:
+
+    {"rules": [{"keywords": ["firebase"], "channels": ["C0123"],
+                "sentiment": ["negative"], "actions": ["Escalate"]}]}
+
+At load time, the values of each dimension are grouped into classes of values
+matched by the same rules (values no rule names share one default class), and
+the actions of every combination of classes are computed once. Routing a
+message is then one dictionary lookup per dimension and one in the table,
+whatever the number of rules.
+"""
+
+rules_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+
+DIMENSIONS = ("members", "keywords", "channels", "sentiment")
+BANDS = ("negative", "neutral", "positive", "unknown")
+
+Rule = namedtuple("Rule", ["members", "keywords", "channels", "sentiment", "actions"])
+
+
+def sentiment_band(score) -> str:
+    """
+    Return the sentiment band of a score, with the thresholds of the sentiment replies.
+
+    Parameters:
+        score (float): The sentiment score, None if the message was not analyzed.
+
+    Returns:
+        str: 'negative', 'neutral', 'positive' or 'unknown'.
+    """
+    if score is None:
+        return "unknown"
+    if score > 0.25:
+        return "positive"
+    if score < -0.25:
+        return "negative"
+    return "neutral"
+
+
+def parse_rule(config) -> Rule:
+    """
+    Parse a rule of rules.json.
+
+    Parameters:
+        config (dict): The rule, with optional 'members', 'keywords', 'channels' and 'sentiment'
+                       lists and an 'actions' list (or an 'action' name).
+
+    Returns:
+        Rule: The rule, with None for the conditions that match anything.
+    """
+    if not isinstance(config, dict):
+        raise ValueError(f"A rule must be a JSON object, got {config!r}.")
+    actions = config.get("actions", [config["action"]] if "action" in config else [])
+    if isinstance(actions, str) or not actions:
+        raise ValueError(f"A rule must name its actions: {config!r}.")
+    conditions = {}
+    for dimension in DIMENSIONS:
+        values = config.get(dimension)
+        if isinstance(values, str):
+            values = [values]
+        conditions[dimension] = frozenset(values) if values is not None else None
+    unknown_bands = (conditions["sentiment"] or frozenset()) - set(BANDS)
+    if unknown_bands:
+        raise ValueError(f"Unknown sentiment bands {sorted(unknown_bands)}, expected {list(BANDS)}.")
+    return Rule(actions=tuple(actions), **conditions)
+
+
+def keyword_rules(keywords_config) -> list:
+    """
+    Build the rules of the keywords that have an action.
+
+    Parameters:
+        keywords_config (dict): The keywords configuration.
+
+    Returns:
+        list: A rule per keyword with an action, matching any member, channel and sentiment.
+    """
+    return [
+        Rule(None, frozenset([keyword]), None, None, (keyword_object["action"],))
+        for keyword, keyword_object in keywords_config.items()
+        if isinstance(keyword_object, dict) and keyword_object.get("action")
+    ]
+
+
+def load_rules(strict=False) -> list:
+    """
+    Load the rules from the JSON file, which is optional.
+
+    Parameters:
+        strict (bool): Raise loading errors instead of returning no rules.
+
+    Returns:
+        list: The rules.
+    """
+    try:
+        with open(rules_file, "r") as file:
+            config = json.load(file)
+        return [parse_rule(rule) for rule in config.get("rules", [])]
+    except FileNotFoundError:
+        return []
+    except Exception:
+        if strict:
+            raise
+        return []
+
+
+class RoutingTable:
+    """The actions of every combination of member, keyword, channel and sentiment band classes."""
+
+    def __init__(self, rules=(), keywords_config=None):
+        """
+        Compile the table.
+
+        Parameters:
+            rules (list): The rules loaded from rules.json.
+            keywords_config (dict): The keywords configuration, whose rules come first.
+        """
+        self.file_rules = list(rules)
+        self.rules = keyword_rules(keywords_config or {}) + self.file_rules
+        self._classes = {}
+        class_rules = {}
+        for dimension in DIMENSIONS:
+            values = BANDS if dimension == "sentiment" else self._named_values(dimension)
+            self._classes[dimension], class_rules[dimension] = self._partition(dimension, values)
+        self._table = {}
+        for member, keyword, channel in itertools.product(
+            *(enumerate(class_rules[dimension]) for dimension in DIMENSIONS[:3])
+        ):
+            matching = member[1] & keyword[1] & channel[1]
+            if not matching:
+                continue
+            for band, band_rules in enumerate(class_rules["sentiment"]):
+                actions = self._actions(matching & band_rules)
+                if actions:
+                    self._table[(member[0], keyword[0], channel[0], band)] = actions
+
+    def _named_values(self, dimension):
+        values = set()
+        for rule in self.rules:
+            values |= getattr(rule, dimension) or frozenset()
+        return values
+
+    def _partition(self, dimension, values):
+        """
+        Group the values of a dimension by the set of rules matching them.
+
+        Returns:
+            tuple: The class of each value, and the rules of each class. Class 0 holds the
+                   values no rule names, matched by the rules without condition on the dimension.
+        """
+        wildcard = frozenset(
+            index for index, rule in enumerate(self.rules) if getattr(rule, dimension) is None
+        )
+        class_ids = {wildcard: 0}
+        classes = {}
+        for value in values:
+            matching = wildcard | frozenset(
+                index for index, rule in enumerate(self.rules)
+                if getattr(rule, dimension) is not None and value in getattr(rule, dimension)
+            )
+            classes[value] = class_ids.setdefault(matching, len(class_ids))
+        return classes, list(class_ids)
+
+    def _actions(self, rule_indexes) -> tuple:
+        actions = []
+        for index in sorted(rule_indexes):
+            for action in self.rules[index].actions:
+                if action not in actions:
+                    actions.append(action)
+        return tuple(actions)
+
+    def _class(self, dimension, value):
+        return self._classes[dimension].get(value, 0)
+
+    def resolve(self, member, keyword, channel, score=None) -> tuple:
+        """
+        Look up the actions of a message.
+
+        Parameters:
+            member (str): The ID of the user who posted the message.
+            keyword (str): The keyword the message matched, None if it matched none.
+            channel (str): The ID of the channel.
+            score (float): The sentiment score, None if the message was not analyzed.
+
+        Returns:
+            tuple: The names of the actions to run, in rule order.
+        """
+        return self._table.get(
+            (
+                self._class("members", member),
+                self._class("keywords", keyword),
+                self._class("channels", channel),
+                self._class("sentiment", sentiment_band(score)),
+            ),
+            (),
+        )
+
+    def __len__(self):
+        return len(self._table)
+
+
+def compile_rules(keywords_config, rules=()) -> RoutingTable:
+    """
+    Compile the rules of the keywords and the rules of rules.json into a routing table.
+
+    Parameters:
+        keywords_config (dict): The keywords configuration.
+        rules (list): The rules loaded from rules.json.
+
+    Returns:
+        RoutingTable: The compiled table, the actions of a message being run in rule order.
+    """
+    return RoutingTable(rules, keywords_config)
@@ -11,15 +11,17 @@ class SlackMessageFormatter:
     @staticmethod
     def format_slack_message(template_data_str):
         """
-        Convert a JSON string from a template into Slack block format.
+        Convert a template into Slack block format.
 
         Parameters:
-            template_data_str (str): JSON string containing template data.
+            template_data_str (str or dict): JSON string or already parsed dictionary containing template data.
 
         Returns:
             list: A list of dictionaries formatted as Slack blocks.
         """
         try:
+            if isinstance(template_data_str, dict):
+                return template_data_str.get('blocks', [])
             # Convert JSON string back to dictionary
             template_data = json.loads(template_data_str)
             # Return the blocks directly if they exist
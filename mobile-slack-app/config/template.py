@@ -6,9 +6,17 @@
 
 
 import json
+import logging
 import os
+import threading
+import time
+
+from .render import RenderPlan
 
 base_template = "base.json"
+templates_dir = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"
+)
 
 
 def load_template(template_name) -> str:
@@ -53,32 +61,218 @@ def load_base_template() -> str:
     return load_base_template.cache
 
 
-def build_template(template_name) -> str:
+def build_template(template_name, fields=None) -> dict:
     """
-    Build a template by combining the base template with the specified template.
+    Build a template by combining the base template with the specified template and filling its placeholders.
 
     Parameters:
         template_name (str): The name of the template file to build.
+        fields (dict): The values of the placeholders, e.g. 'channel', 'user' or 'score'.
 
     Returns:
-        str: A JSON string containing the combined template, or None if an error occurs.
+        dict: The rendered template, or None if an error occurs. Its static parts are shared and must not be modified.
     """
-    base_template_data = load_base_template()
-    if base_template_data is None:
-        return None
+    return registry.render(template_name, fields)
 
-    template_data = load_template(template_name)
-    if template_data is None:
-        return None
 
-    try:
-        base_template_dict = json.loads(base_template_data)
-        template_dict = json.loads(template_data)
-        base_template_dict["blocks"].extend(template_dict["blocks"])
-        return json.dumps(base_template_dict)
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON from the template file {template_name}.")
-        return None
-    except Exception as e:
-        print(f"An error occurred while building template {template_name}: {e}")
+class TemplateRegistry:
+    """
+    In-memory registry of the templates merged with the base template.
+
+    Every template is parsed once and kept as a ready-to-send dictionary of
+    Slack blocks. An entry is reloaded when the modification time of its file,
+    or of the base template, changes. The returned dictionaries are shared and
+    must not be modified.
+    """
+
+    def __init__(self, directory=templates_dir, base_name=base_template, check_interval=1.0):
+        """
+        Parameters:
+            directory (str): The directory containing the template files.
+            base_name (str): The name of the base template file.
+            check_interval (float): Minimum number of seconds between two modification time checks of an entry,
+                                    or None to never check them (the registry is then rebuilt by the config reloader).
+        """
+        self.directory = directory
+        self.base_name = base_name
+        self.check_interval = check_interval
+        self._fallback = None
+        self._entries = {}
+        self._plans = {}
+        self._lock = threading.RLock()
+
+    def _path(self, template_name):
+        return os.path.join(self.directory, template_name)
+
+    def _mtime(self, template_name):
+        try:
+            return os.stat(self._path(template_name)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self, template_name):
+        try:
+            with open(self._path(template_name), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            logging.error(f"Template file {template_name} not found.")
+        except json.JSONDecodeError:
+            logging.error(f"Error decoding JSON from the template file {template_name}.")
+        except Exception as e:
+            logging.error(f"An error occurred while loading template {template_name}: {e}")
         return None
+
+    def _load(self, template_name, base_mtime):
+        mtime = self._mtime(template_name)
+        template_data = self._read(template_name) if mtime is not None else None
+        if template_data is None:
+            return (mtime, base_mtime, None)
+        if template_name == self.base_name:
+            return (mtime, base_mtime, template_data)
+        base_data = self.get(self.base_name)
+        if base_data is None:
+            return (mtime, base_mtime, None)
+        merged = dict(base_data)
+        merged["blocks"] = base_data.get("blocks", []) + template_data.get("blocks", [])
+        return (mtime, base_mtime, merged)
+
+    def _is_stale(self, template_name, entry, now):
+        if self.check_interval is None:
+            return False
+        checked_at = entry[3]
+        if now - checked_at < self.check_interval:
+            return False
+        if self._mtime(template_name) != entry[0]:
+            return True
+        if template_name != self.base_name and self._mtime(self.base_name) != entry[1]:
+            return True
+        entry[3] = now
+        return False
+
+    def get(self, template_name) -> dict:
+        """
+        Return a template merged with the base template.
+
+        Parameters:
+            template_name (str): The name of the template file.
+
+        Returns:
+            dict: The merged template, or None if it could not be loaded.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(template_name)
+        if entry is not None and not self._is_stale(template_name, entry, now):
+            return entry[2]
+        with self._lock:
+            base_mtime = self._mtime(self.base_name)
+            mtime, base_mtime, data = self._load(template_name, base_mtime)
+            if data is None and mtime is not None and self._fallback is not None:
+                data = self._fallback.get(template_name)
+                if data is not None:
+                    logging.error(f"Keeping the last good version of template {template_name}.")
+            self._entries[template_name] = [mtime, base_mtime, data, now]
+        return data
+
+    def plan(self, template_name) -> RenderPlan:
+        """
+        Return the render plan of a template, compiled once per version of the template.
+
+        Parameters:
+            template_name (str): The name of the template file.
+
+        Returns:
+            RenderPlan: The plan of the merged template, or None if it could not be loaded.
+        """
+        data = self.get(template_name)
+        if data is None:
+            return None
+        plan = self._plans.get(template_name)
+        if plan is None or plan.template is not data:
+            plan = self._plans[template_name] = RenderPlan(data)
+        return plan
+
+    def render(self, template_name, fields=None) -> dict:
+        """
+        Render a template merged with the base template.
+
+        Parameters:
+            template_name (str): The name of the template file.
+            fields (dict): The values of the placeholders.
+
+        Returns:
+            dict: The rendered template, or None if it could not be loaded. Its static parts are shared
+                  and must not be modified.
+        """
+        plan = self.plan(template_name)
+        return plan.render(fields) if plan is not None else None
+
+    def load_all(self, fallback=None):
+        """
+        Load the base template and every template of the directory, and compile their render plans.
+
+        Parameters:
+            fallback (TemplateRegistry): A registry whose entries are kept for templates that fail to load.
+        """
+        try:
+            names = sorted(
+                name for name in os.listdir(self.directory) if name.endswith(".json")
+            )
+        except OSError as e:
+            logging.error(f"Failed to list the templates directory {self.directory}: {e}")
+            return
+        self._fallback = fallback
+        try:
+            for name in [self.base_name] + [name for name in names if name != self.base_name]:
+                self.plan(name)
+        finally:
+            self._fallback = None
+
+    def missing(self, template_names) -> list:
+        """
+        Find the templates that cannot be loaded.
+
+        Parameters:
+            template_names (iterable): The names of the template files to check.
+
+        Returns:
+            list: The names of the missing or invalid templates.
+        """
+        return [name for name in template_names if self.get(name) is None]
+
+    def report_missing(self, keywords):
+        """
+        Log the templates referenced by the keywords configuration that cannot be loaded.
+
+        Parameters:
+            keywords (dict): The keywords configuration.
+
+        Returns:
+            list: The names of the missing or invalid templates.
+        """
+        referenced = sorted(
+            {
+                keyword_object["template"]
+                for keyword_object in keywords.values()
+                if isinstance(keyword_object, dict) and keyword_object.get("template")
+            }
+        )
+        missing = self.missing(referenced)
+        for name in missing:
+            logging.error(f"Template {name} referenced in keywords.json cannot be loaded.")
+        return missing
+
+
+registry = TemplateRegistry()
+
+
+def get_template(template_name) -> dict:
+    """
+    Return a template merged with the base template from the shared registry.
+
+    Parameters:
+        template_name (str): The name of the template file.
+
+    Returns:
+        dict: The merged template, or None if it could not be loaded. It is shared and must not be modified.
+    """
+    return registry.get(template_name)
@@ -10,6 +10,226 @@
    As well determined by the classification of the message passed through machine-learning to determine
    the relevancy of the message: nature of the event, the urgency of the event, target audience, and the
    action to be taken.
+
+   Messages are scored in batches: their word unigrams and bigrams are hashed into a fixed number of
+   features, and a linear model scores the whole batch with matrix operations. Each head (nature,
+   urgency, audience, action) is a softmax over its labels.
 """
 
-def process_relevancy()
\ No newline at end of file
+import re
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from utils import get_relevancy_model_path
+
+HEADS = {
+    "nature": ("outage", "degradation", "maintenance", "information"),
+    "urgency": ("high", "medium", "low"),
+    "audience": ("android", "ios", "all"),
+    "action": ("investigate", "notify", "ignore"),
+}
+N_FEATURES = 1 << 16
+BIAS_FEATURE = "__bias__"
+
+TOKEN = re.compile(r"[a-z0-9']+")
+
+# Seed weights used when no trained model is available: term -> {(head, label): weight}.
+SEED_TERMS = {
+    "outage": {("nature", "outage"): 2.0, ("urgency", "high"): 1.5, ("action", "investigate"): 1.5},
+    "down": {("nature", "outage"): 1.5, ("urgency", "high"): 1.0, ("action", "investigate"): 1.0},
+    "unavailable": {("nature", "outage"): 1.5, ("urgency", "high"): 1.0, ("action", "investigate"): 1.0},
+    "failed": {("nature", "degradation"): 1.0, ("urgency", "medium"): 1.0, ("action", "investigate"): 1.0},
+    "failing": {("nature", "degradation"): 1.0, ("urgency", "medium"): 1.0, ("action", "investigate"): 1.0},
+    "disruption": {("nature", "degradation"): 1.5, ("urgency", "high"): 1.0, ("action", "investigate"): 1.0},
+    "degraded": {("nature", "degradation"): 1.5, ("urgency", "medium"): 1.0, ("action", "notify"): 1.0},
+    "slow": {("nature", "degradation"): 1.0, ("urgency", "medium"): 0.5, ("action", "notify"): 0.5},
+    "flaky": {("nature", "degradation"): 1.0, ("urgency", "medium"): 0.5, ("action", "notify"): 0.5},
+    "incident": {("nature", "outage"): 1.0, ("urgency", "high"): 1.0, ("action", "investigate"): 1.0},
+    "investigating": {("nature", "outage"): 0.5, ("urgency", "high"): 0.5, ("action", "notify"): 1.0},
+    "maintenance": {("nature", "maintenance"): 2.0, ("urgency", "low"): 1.0, ("action", "notify"): 1.0},
+    "scheduled": {("nature", "maintenance"): 1.5, ("urgency", "low"): 1.0, ("action", "notify"): 0.5},
+    "resolved": {("nature", "information"): 1.5, ("urgency", "low"): 1.5, ("action", "notify"): 0.5},
+    "android": {("audience", "android"): 2.0},
+    "fenix": {("audience", "android"): 2.0},
+    "emulator": {("audience", "android"): 1.0},
+    "x86": {("audience", "android"): 1.0},
+    "ios": {("audience", "ios"): 2.0},
+    "iphone": {("audience", "ios"): 1.5},
+    "xcode": {("audience", "ios"): 1.5},
+    "simulator": {("audience", "ios"): 1.0},
+    "bitrise": {("audience", "all"): 0.5, ("action", "investigate"): 0.5},
+    "firebase": {("audience", "android"): 0.5, ("action", "investigate"): 0.5},
+    "github": {("audience", "all"): 0.5, ("action", "investigate"): 0.5},
+    "thanks": {("nature", "information"): 1.0, ("urgency", "low"): 1.0, ("action", "ignore"): 1.5},
+    "lunch": {("nature", "information"): 1.0, ("urgency", "low"): 1.0, ("action", "ignore"): 2.0},
+}
+SEED_BIAS = {("nature", "information"): 0.5, ("urgency", "low"): 0.5, ("audience", "all"): 0.5, ("action", "ignore"): 1.0}
+
+
+def head_slices() -> dict:
+    """Return the columns of each head in the output matrix."""
+    slices = {}
+    start = 0
+    for head, labels in HEADS.items():
+        slices[head] = slice(start, start + len(labels))
+        start += len(labels)
+    return slices
+
+
+HEAD_SLICES = head_slices()
+N_OUTPUTS = sum(len(labels) for labels in HEADS.values())
+
+
+def output_index(head, label) -> int:
+    return HEAD_SLICES[head].start + HEADS[head].index(label)
+
+
+def hash_feature(feature) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % N_FEATURES
+
+
+def extract_features(text) -> list:
+    """
+    Extract the word unigrams and bigrams of a message, plus the bias feature.
+
+    Parameters:
+        text (str): The text of the message.
+
+    Returns:
+        list: The features of the message.
+    """
+    tokens = TOKEN.findall(text.lower())
+    return [BIAS_FEATURE] + tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class RelevancyModel:
+    """Linear model over hashed features, with one softmax per head."""
+
+    def __init__(self, weights):
+        """
+        Parameters:
+            weights (ndarray): The (N_FEATURES, N_OUTPUTS) weight matrix.
+        """
+        if weights.shape != (N_FEATURES, N_OUTPUTS):
+            raise ValueError(f"Expected weights of shape {(N_FEATURES, N_OUTPUTS)}, got {weights.shape}.")
+        self.weights = np.ascontiguousarray(weights, dtype=np.float32)
+
+    @classmethod
+    def seed(cls):
+        """Build the model from the seed terms."""
+        weights = np.zeros((N_FEATURES, N_OUTPUTS), dtype=np.float32)
+        for term, outputs in SEED_TERMS.items():
+            for (head, label), weight in outputs.items():
+                weights[hash_feature(term), output_index(head, label)] += weight
+        for (head, label), weight in SEED_BIAS.items():
+            weights[hash_feature(BIAS_FEATURE), output_index(head, label)] += weight
+        return cls(weights)
+
+    @classmethod
+    def load(cls, path):
+        """Load the model weights saved with `save`."""
+        with np.load(path) as data:
+            return cls(data["weights"])
+
+    def save(self, path):
+        """Save the model weights to a .npz file."""
+        np.savez_compressed(path, weights=self.weights)
+
+    def score(self, texts) -> np.ndarray:
+        """
+        Score a batch of messages.
+
+        Parameters:
+            texts (list): The texts of the messages.
+
+        Returns:
+            ndarray: The (len(texts), N_OUTPUTS) matrix of per-head probabilities.
+        """
+        if not texts:
+            return np.zeros((0, N_OUTPUTS), dtype=np.float32)
+        features = [extract_features(text) for text in texts]
+        lengths = np.fromiter((len(row) for row in features), dtype=np.int64, count=len(features))
+        flat = [feature for row in features for feature in row]
+
+        # Hash each distinct feature of the batch once.
+        unique, inverse = np.unique(np.array(flat, dtype=object), return_inverse=True)
+        columns = np.fromiter((hash_feature(feature) for feature in unique), dtype=np.int64, count=len(unique))[inverse]
+
+        # Every message has the bias feature, so no segment is empty.
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        logits = np.add.reduceat(self.weights[columns], offsets, axis=0)
+        logits /= np.sqrt(lengths, dtype=np.float32)[:, None]
+
+        probabilities = np.empty_like(logits)
+        for head_slice in HEAD_SLICES.values():
+            head = logits[:, head_slice]
+            exponentials = np.exp(head - head.max(axis=1, keepdims=True))
+            probabilities[:, head_slice] = exponentials / exponentials.sum(axis=1, keepdims=True)
+        return probabilities
+
+
+@lru_cache(maxsize=1)
+def load_model(path=None) -> RelevancyModel:
+    """
+    Load the relevancy model once.
+
+    Parameters:
+        path (str): The .npz file of a trained model, defaults to the configured one. The seed model is used when there is none.
+
+    Returns:
+        RelevancyModel: The shared model.
+    """
+    path = path or get_relevancy_model_path()
+    if path:
+        return RelevancyModel.load(path)
+    return RelevancyModel.seed()
+
+
+def relevancy_scores(probabilities) -> np.ndarray:
+    """Combine the head probabilities into a relevancy in [0, 1]: urgency weighted by the need to act."""
+    urgency = probabilities[:, HEAD_SLICES["urgency"]] @ np.array([1.0, 0.5, 0.0], dtype=np.float32)
+    act = 1.0 - probabilities[:, output_index("action", "ignore")]
+    return urgency * act
+
+
+def process_relevancy(messages, model=None) -> list:
+    """
+    Assess the relevancy of a batch of messages.
+
+    Parameters:
+        messages (list): The messages, as Slack message dictionaries or texts.
+        model (RelevancyModel): The model to use, defaults to the shared model.
+
+    Returns:
+        list: For each message, a dictionary with the most likely label of each head
+              (nature, urgency, audience, action) and its relevancy.
+    """
+    texts = [message["text"] if isinstance(message, dict) else message for message in messages]
+    probabilities = (model or load_model()).score(texts)
+    relevancy = relevancy_scores(probabilities)
+    labels = {
+        head: np.asarray(HEADS[head], dtype=object)[probabilities[:, head_slice].argmax(axis=1)]
+        for head, head_slice in HEAD_SLICES.items()
+    }
+    return [
+        dict({head: labels[head][index] for head in HEADS}, relevancy=float(relevancy[index]))
+        for index in range(len(texts))
+    ]
+
+
+def rank_by_relevancy(messages, model=None) -> list:
+    """
+    Rank a batch of messages from the most to the least relevant.
+
+    Parameters:
+        messages (list): The messages, as Slack message dictionaries or texts.
+        model (RelevancyModel): The model to use, defaults to the shared model.
+
+    Returns:
+        list: The indices of the messages, most relevant first.
+    """
+    texts = [message["text"] if isinstance(message, dict) else message for message in messages]
+    relevancy = relevancy_scores((model or load_model()).score(texts))
+    return np.argsort(-relevancy, kind="stable").tolist()
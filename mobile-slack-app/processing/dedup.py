@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+"""This module contains the near-duplicate detection of recent messages.
+   Messages are fingerprinted with SimHash after masking the parts that change between
+   otherwise identical alerts (numbers, identifiers, links). Fingerprints are indexed by
+   channel in bands, so that looking up a near-duplicate only visits the messages sharing
+   a band with it instead of every recent message.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import deque
+
+URL = re.compile(r"<[^>]*>|\b[a-zA-Z][\w+.-]*://\S+")
+IDENTIFIER = re.compile(r"\b(?=[0-9a-f]*\d)[0-9a-f]{7,}\b")
+NUMBER = re.compile(r"\d+")
+TOKEN = re.compile(r"\w+")
+
+FINGERPRINT_BITS = 64
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def normalize_alert(text) -> list:
+    """
+    Tokenize a message with the volatile parts masked.
+
+    Parameters:
+        text (str): The text of the message.
+
+    Returns:
+        list: The lowercase tokens, with links, identifiers and numbers replaced by placeholders.
+    """
+    text = URL.sub(" url ", text.lower())
+    text = IDENTIFIER.sub(" id ", text)
+    text = NUMBER.sub("0", text)
+    return TOKEN.findall(text)
+
+
+def feature_hash(feature) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def simhash(text) -> int:
+    """
+    Compute the 64-bit SimHash fingerprint of a message over its word unigrams and bigrams.
+
+    Parameters:
+        text (str): The text of the message.
+
+    Returns:
+        int: The fingerprint.
+    """
+    tokens = normalize_alert(text)
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        value = feature_hash(feature)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class Alert:
+    """A message indexed for near-duplicate detection."""
+
+    __slots__ = ("channel", "fingerprint", "ts", "seen_at", "duplicates")
+
+    def __init__(self, channel, fingerprint, ts, seen_at):
+        self.channel = channel
+        self.fingerprint = fingerprint
+        self.ts = ts
+        self.seen_at = seen_at
+        self.duplicates = 0
+
+
+class NearDuplicateIndex:
+    """
+    Index of the recent messages of every channel.
+
+    With 4 bands of 16 bits, two fingerprints at a Hamming distance of 3 or less
+    share at least one band, so only the messages in the matching band buckets
+    need to be compared.
+    """
+
+    def __init__(self, window=600.0, max_distance=3):
+        """
+        Parameters:
+            window (float): Number of seconds a message stays in the index.
+            max_distance (int): Maximum Hamming distance between near-duplicate fingerprints (at most 3).
+        """
+        self.window = window
+        self.max_distance = min(max_distance, BANDS - 1)
+        self.duplicates = 0
+        self._buckets = {}
+        self._alerts = deque()
+        self._lock = threading.Lock()
+
+    def _band_keys(self, channel, fingerprint):
+        return [
+            (channel, band, fingerprint >> (band * BAND_BITS) & BAND_MASK)
+            for band in range(BANDS)
+        ]
+
+    def _expire(self, now):
+        while self._alerts and now - self._alerts[0].seen_at > self.window:
+            alert = self._alerts.popleft()
+            for key in self._band_keys(alert.channel, alert.fingerprint):
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                bucket.remove(alert)
+                if not bucket:
+                    del self._buckets[key]
+
+    def check(self, channel, text, ts=None, now=None):
+        """
+        Check whether a message is a near-duplicate of a recent message of the same channel.
+
+        A near-duplicate increments the duplicate counter of the original message,
+        any other message is added to the index.
+
+        Parameters:
+            channel (str): The channel of the message.
+            text (str): The text of the message.
+            ts (str): The Slack timestamp of the message.
+            now (float): The current time, defaults to the monotonic clock.
+
+        Returns:
+            Alert: The original message if the message is a near-duplicate, None otherwise.
+        """
+        now = time.monotonic() if now is None else now
+        fingerprint = simhash(text)
+        keys = self._band_keys(channel, fingerprint)
+        with self._lock:
+            self._expire(now)
+            for key in keys:
+                for alert in self._buckets.get(key, ()):
+                    if bin(alert.fingerprint ^ fingerprint).count("1") <= self.max_distance:
+                        alert.duplicates += 1
+                        self.duplicates += 1
+                        return alert
+            alert = Alert(channel, fingerprint, ts, now)
+            self._alerts.append(alert)
+            for key in keys:
+                self._buckets.setdefault(key, []).append(alert)
+        return None
+
+    def __len__(self):
+        return len(self._alerts)
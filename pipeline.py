@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Staged message pipeline ordered from cheap to expensive checks.
+
+Every stage receives the processing context of a message (a dictionary holding
+the message and the results of the previous stages) and returns whether the
+message should go on to the next stage. The first stage returning False stops
+the pipeline, so the paid Natural Language and LLM calls only run for messages
+that went through the cheap filters. The llm stage only requests the summary of
+a message: it is streamed by `MessagePipeline.finish` once the message was
+replied to.
+"""
+
+import asyncio
+import importlib
+import logging
+import threading
+from collections import namedtuple
+
+from message import (async_process_message, check_member, match_keywords,
+                     process_message)
+from deadline import Deadline, degraded, get_breakers, open_call
+from metrics import messages
+from utils import get_dedup_max_distance, get_dedup_window
+
+dedup_module = importlib.import_module("mobile-slack-app.processing.dedup")
+
+Stage = namedtuple("Stage", ["name", "run", "run_async"])
+
+BOT_SUBTYPES = {"bot_message", "bot_add", "bot_remove"}
+
+_duplicate_index = None
+_duplicate_index_lock = threading.Lock()
+
+
+def get_duplicate_index():
+    """
+    Return the shared index of the recent alerts, creating it on first use.
+
+    Returns:
+        NearDuplicateIndex: The shared index.
+    """
+    global _duplicate_index
+    if _duplicate_index is None:
+        with _duplicate_index_lock:
+            if _duplicate_index is None:
+                _duplicate_index = dedup_module.NearDuplicateIndex(
+                    window=get_dedup_window(), max_distance=get_dedup_max_distance()
+                )
+    return _duplicate_index
+
+
+def is_human_message(context) -> bool:
+    """Drop messages posted by bots, including this app, and messages without text."""
+    message = context["message"]
+    if message.get("bot_id") or message.get("subtype") in BOT_SUBTYPES:
+        return False
+    return bool(message.get("user")) and bool(message.get("text"))
+
+
+def is_allowed_member(context) -> bool:
+    """Keep messages posted by allowed members."""
+    return check_member(context["message"])
+
+
+def has_keyword(context) -> bool:
+    """Keep messages mentioning an allowed keyword and record the matches, unless they were found at intake."""
+    if context.get("matches") is None:
+        context["matches"] = match_keywords(context["message"])
+    return bool(context["matches"])
+
+
+def is_new_alert(context) -> bool:
+    """Drop near-duplicates of a recent message of the same channel, counting them on the original."""
+    message = context["message"]
+    original = get_duplicate_index().check(
+        message.get("channel"), message["text"], ts=message.get("ts")
+    )
+    if original is not None:
+        context["duplicate_of"] = original
+        on_duplicate_hook = context.get("on_duplicate")
+        if on_duplicate_hook is not None:
+            on_duplicate_hook(context)
+        logging.debug(
+            "Message %s is a near-duplicate of %s (%s so far)",
+            message.get("ts"),
+            original.ts,
+            original.duplicates,
+        )
+        return False
+    return True
+
+
+def analyze(context) -> bool:
+    """Analyze the sentiment and entities of the message."""
+    context["nlp"] = process_message(
+        context["message"], context.get("matches"), context.get("deadline")
+    )
+    return True
+
+
+async def analyze_async(context) -> bool:
+    """Asynchronous version of `analyze`."""
+    context["nlp"] = await async_process_message(
+        context["message"], context.get("matches"), context.get("deadline")
+    )
+    return True
+
+
+def run_summarize_hook(summarize_hook, context, timeout):
+    """Run the LLM summary hook under the LLM circuit breaker, the message goes on without summary on failure."""
+    try:
+        with get_breakers()["llm"].track():
+            return summarize_hook(context, timeout)
+    except Exception as e:
+        logging.warning(f"LLM summary of message {context['message'].get('ts')} failed: {e}")
+        degraded.inc(stage="llm", reason="error")
+        return None
+
+
+def request_summary(context) -> bool:
+    """Mark the message for the LLM summary, streamed by `MessagePipeline.finish` once it was replied to."""
+    context["summary_requested"] = context.get("summarize") is not None
+    return True
+
+
+def summarize(context) -> bool:
+    """Run the LLM summary hook given with the context, if any, within the LLM budget of the deadline."""
+    summarize_hook = context.get("summarize")
+    if summarize_hook is not None:
+        timeout, skipped = open_call("llm", context.get("deadline"))
+        if not skipped:
+            context["summary"] = run_summarize_hook(summarize_hook, context, timeout)
+    return True
+
+
+async def summarize_async(context) -> bool:
+    """Asynchronous version of `summarize`, running the hook in a worker thread."""
+    summarize_hook = context.get("summarize")
+    if summarize_hook is not None:
+        timeout, skipped = open_call("llm", context.get("deadline"))
+        if not skipped:
+            context["summary"] = await asyncio.to_thread(
+                run_summarize_hook, summarize_hook, context, timeout
+            )
+    return True
+
+
+STAGES = {
+    "self": Stage("self", is_human_message, None),
+    "member": Stage("member", is_allowed_member, None),
+    "keyword": Stage("keyword", has_keyword, None),
+    "dedup": Stage("dedup", is_new_alert, None),
+    "nlp": Stage("nlp", analyze, analyze_async),
+    "llm": Stage("llm", request_summary, None),
+}
+
+DEFAULT_STAGES = ("self", "member", "keyword", "dedup", "nlp")
+
+
+class MessagePipeline:
+    def __init__(self, stages, report_interval=100, deadline=None, budgets=None):
+        """
+        Parameters:
+            stages (list): The Stage tuples to run, in order.
+            report_interval (int): Log the pass rates every that many messages, 0 to disable.
+            deadline (float): Number of seconds allowed to process a message, unlimited if None.
+            budgets (dict): The maximum number of seconds of the external API stages, keyed by stage name.
+        """
+        self.stages = list(stages)
+        self.report_interval = report_interval
+        self.deadline = deadline
+        self.budgets = budgets or {}
+        self._lock = threading.Lock()
+        self._messages = 0
+        self._entered = {stage.name: 0 for stage in self.stages}
+        self._passed = {stage.name: 0 for stage in self.stages}
+
+    def _record(self, name, passed):
+        with self._lock:
+            self._entered[name] += 1
+            if passed:
+                self._passed[name] += 1
+        if not passed:
+            messages.inc(outcome="short_circuited", stage=name)
+
+    def start_deadline(self):
+        """
+        Start the deadline of an event, to be passed to `run` when the event waits before it is run.
+
+        Returns:
+            Deadline: The deadline, None if the pipeline has none.
+        """
+        if self.deadline is None:
+            return None
+        return Deadline(self.deadline, self.budgets)
+
+    def _start(self, context):
+        if context.get("deadline") is None:
+            context["deadline"] = self.start_deadline()
+        with self._lock:
+            self._messages += 1
+            report = self.report_interval and self._messages % self.report_interval == 0
+        if report:
+            logging.info(f"Pipeline pass rates: {self.stats()}")
+
+    def run(self, message, **context):
+        """
+        Run a message through the stages.
+
+        Parameters:
+            message (dict): The message to process.
+            **context: Extra values made available to the stages.
+
+        Returns:
+            dict: The processing context if the message went through every stage, None otherwise.
+        """
+        self._start(context)
+        context["message"] = message
+        for stage in self.stages:
+            passed = bool(stage.run(context))
+            self._record(stage.name, passed)
+            if not passed:
+                logging.debug(
+                    "Message %s stopped at stage %s",
+                    message.get("ts"),
+                    stage.name,
+                    extra={"ts": message.get("ts"), "stage": stage.name},
+                )
+                return None
+        messages.inc(outcome="processed")
+        return context
+
+    async def run_async(self, message, **context):
+        """
+        Asynchronous version of `run`, awaiting the stages that have an asynchronous implementation.
+
+        Parameters:
+            message (dict): The message to process.
+            **context: Extra values made available to the stages.
+
+        Returns:
+            dict: The processing context if the message went through every stage, None otherwise.
+        """
+        self._start(context)
+        context["message"] = message
+        for stage in self.stages:
+            if stage.run_async is not None:
+                passed = bool(await stage.run_async(context))
+            else:
+                passed = bool(stage.run(context))
+            self._record(stage.name, passed)
+            if not passed:
+                logging.debug(
+                    "Message %s stopped at stage %s",
+                    message.get("ts"),
+                    stage.name,
+                    extra={"ts": message.get("ts"), "stage": stage.name},
+                )
+                return None
+        messages.inc(outcome="processed")
+        return context
+
+    def finish(self, context):
+        """
+        Stream the LLM summary of a message the llm stage requested it for. It is called once the
+        message was replied to, so that the keyword reply does not wait for the generation.
+
+        Parameters:
+            context (dict): The processing context returned by `run`.
+        """
+        if context.get("summary_requested"):
+            summarize(context)
+
+    async def finish_async(self, context):
+        """Asynchronous version of `finish`."""
+        if context.get("summary_requested"):
+            await summarize_async(context)
+
+    def stats(self) -> dict:
+        """
+        Report how many messages entered and passed each stage.
+
+        Returns:
+            dict: The entered and passed counters and the pass rate, keyed by stage name.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "entered": self._entered[name],
+                    "passed": self._passed[name],
+                    "rate": (
+                        self._passed[name] / self._entered[name]
+                        if self._entered[name]
+                        else 0.0
+                    ),
+                }
+                for name in self._entered
+            }
+
+
+def build_pipeline(
+    stage_names=DEFAULT_STAGES, report_interval=100, deadline=None, budgets=None
+) -> MessagePipeline:
+    """
+    Build a pipeline from stage names.
+
+    Parameters:
+        stage_names (list): The names of the stages to run, in order (see STAGES).
+        report_interval (int): Log the pass rates every that many messages, 0 to disable.
+        deadline (float): Number of seconds allowed to process a message, unlimited if None.
+        budgets (dict): The maximum number of seconds of the external API stages, keyed by stage name.
+
+    Returns:
+        MessagePipeline: The pipeline.
+    """
+    unknown = [name for name in stage_names if name not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown pipeline stages: {', '.join(unknown)}")
+    return MessagePipeline(
+        [STAGES[name] for name in stage_names],
+        report_interval=report_interval,
+        deadline=deadline,
+        budgets=budgets,
+    )
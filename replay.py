@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Replay of Slack message events through the listeners of the app, without Bolt.
+
+`setup_message_listeners` registers the listeners with the Bolt decorators;
+`ReplayApp` captures them instead, so that the backfill and the benchmark can
+call the message listener directly with recorded or fetched messages.
+"""
+
+
+class ReplayApp:
+    """Captures the listeners registered with the Bolt decorators so they can be called directly."""
+
+    def __init__(self, client):
+        self.client = client
+        self.message_listeners = []
+
+    def message(self, keyword=None):
+        def register(listener):
+            if keyword is None:
+                self.message_listeners.append(listener)
+            return listener
+
+        return register
+
+    def command(self, command):
+        return lambda listener: listener
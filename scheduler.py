@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Priority scheduling of the message processing.
+
+The message listener only rates the priority and urgency of a message from
+cheap signals (keyword match, allowed member, priority channel) and queues it;
+worker threads run the pipeline. High priority messages have their own pool of
+workers, so a keyword alert never waits behind chatter going through the
+Natural Language API. The low priority workers take the most urgent message
+of either queue.
+
+Aging keeps low priority messages from starving: a message is ordered as if
+it had arrived `aging` seconds earlier per level of urgency, so any message
+eventually gets ahead of the more urgent messages that arrive after it.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from metrics import REGISTRY
+
+HIGH = "high"
+LOW = "low"
+
+wait_seconds = REGISTRY.histogram(
+    "mtpm_scheduler_wait_seconds", "Seconds messages waited in the scheduler queue, by priority."
+)
+latency_seconds = REGISTRY.histogram(
+    "mtpm_scheduler_latency_seconds", "Seconds from queuing to the end of the processing of messages, by priority."
+)
+
+
+class Scheduler:
+    """Priority queues of work items served by a high and a low priority pool of worker threads."""
+
+    def __init__(self, high_workers=2, low_workers=4, aging=5.0):
+        """
+        Parameters:
+            high_workers (int): The number of workers serving high priority items only.
+            low_workers (int): The number of workers serving the most urgent item of either priority.
+            aging (float): The number of seconds of waiting worth one level of urgency.
+        """
+        self.aging = aging
+        self.completed = {HIGH: 0, LOW: 0}
+        self._queues = {HIGH: [], LOW: []}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._run, args=((HIGH,),), name=f"scheduler-high-{index}", daemon=True)
+            for index in range(high_workers)
+        ] + [
+            threading.Thread(target=self._run, args=((HIGH, LOW),), name=f"scheduler-low-{index}", daemon=True)
+            for index in range(low_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, function, *args, priority=LOW, urgency=0, **kwargs):
+        """
+        Queue a work item.
+
+        Parameters:
+            function (callable): The work, called with the other arguments by a worker.
+            priority (str): HIGH for the items served by the high priority workers, LOW otherwise.
+            urgency (int): The urgency of the item within the queues, higher is more urgent.
+        """
+        queued_at = time.monotonic()
+        item = (queued_at - urgency * self.aging, next(self._sequence), queued_at, function, args, kwargs)
+        with self._condition:
+            heapq.heappush(self._queues[priority], item)
+            self._condition.notify_all()
+
+    def queue_depth(self) -> dict:
+        """Return the number of queued items of each priority."""
+        with self._condition:
+            return {priority: len(queue) for priority, queue in self._queues.items()}
+
+    def _next(self, priorities):
+        """Pop the item with the earliest aged arrival time among the queues of the priorities."""
+        queues = [(self._queues[priority][0], priority) for priority in priorities if self._queues[priority]]
+        if not queues:
+            return None, None
+        _, priority = min(queues)
+        return heapq.heappop(self._queues[priority]), priority
+
+    def _run(self, priorities):
+        while True:
+            with self._condition:
+                item, priority = self._next(priorities)
+                while item is None:
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                    item, priority = self._next(priorities)
+            _, _, queued_at, function, args, kwargs = item
+            wait_seconds.observe(time.monotonic() - queued_at, priority=priority)
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"Scheduled {priority} priority work failed: {e}")
+            latency_seconds.observe(time.monotonic() - queued_at, priority=priority)
+            with self._condition:
+                self.completed[priority] += 1
+
+    def close(self, timeout=30.0):
+        """
+        Run the queued items and stop the workers.
+
+        Parameters:
+            timeout (float): Maximum number of seconds to wait for the queued items.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
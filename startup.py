@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Startup time report.
+
+`mark_startup` records how many seconds after the start of the process the
+app reaches each phase of its startup (modules imported, listeners ready,
+first event handled), logs it and exports it on the metrics endpoint.
+`preload` imports the SDKs the configuration will need in the background while
+Socket Mode connects.
+
+Run as a script, this module reports the import cost of each module of the
+app, measured by `python -X importtime` in a fresh interpreter.
+
+Usage:
+    python startup.py --module app --top 30
+    python startup.py --module async_app --json
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+def process_start_time() -> float:
+    """
+    Return the time the process started at, falling back to now when it is unknown.
+
+    Returns:
+        float: The start time of the process, in seconds since the epoch.
+    """
+    try:
+        with open("/proc/self/stat", "r") as file:
+            # The command name may contain spaces, the fields after it can be split safely.
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as file:
+            uptime = float(file.read().split()[0])
+        started_after_boot = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.time() - (uptime - started_after_boot)
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+STARTED_AT = process_start_time()
+
+_phases = {}
+_phases_lock = threading.Lock()
+
+
+def mark_startup(phase) -> float:
+    """
+    Record the first time the app reaches a startup phase.
+
+    Parameters:
+        phase (str): The name of the phase, e.g. 'first_event'.
+
+    Returns:
+        float: The number of seconds since the start of the process the phase was first reached at.
+    """
+    if phase in _phases:
+        return _phases[phase]
+    with _phases_lock:
+        if phase not in _phases:
+            _phases[phase] = time.time() - STARTED_AT
+            logging.info(f"Startup: {phase} after {_phases[phase]:.3f}s")
+        return _phases[phase]
+
+
+def startup_phases() -> dict:
+    """Return the number of seconds since the start of the process each phase was reached at."""
+    with _phases_lock:
+        return dict(_phases)
+
+
+def preload(modules) -> threading.Thread:
+    """
+    Import modules in a background thread, so that the first event using them does not wait for the import.
+
+    Parameters:
+        modules (list): The names of the modules to import.
+
+    Returns:
+        Thread: The started thread.
+    """
+
+    def run():
+        for module in modules:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                logging.warning(f"Failed to preload {module}: {e}")
+                continue
+            logging.debug(f"Preloaded {module} in {time.perf_counter() - start:.3f}s")
+
+    thread = threading.Thread(target=run, name="preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def parse_importtime(output) -> list:
+    """
+    Parse the output of `python -X importtime`.
+
+    Parameters:
+        output (str): The standard error of the interpreter.
+
+    Returns:
+        list: (module, self seconds, cumulative seconds) tuples, in import order.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def import_report(module="app", top=25) -> dict:
+    """
+    Measure the import cost of a module of the app and of everything it imports.
+
+    Parameters:
+        module (str): The module to import, e.g. 'app' or 'async_app'.
+        top (int): The number of most expensive modules to report.
+
+    Returns:
+        dict: The total import time, the time spent in each top-level package and the most expensive modules.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}: {completed.stderr.strip().splitlines()[-1:]}")
+    modules = parse_importtime(completed.stderr)
+    packages = {}
+    for name, self_seconds, _ in modules:
+        package = name.split(".", 1)[0]
+        packages[package] = packages.get(package, 0.0) + self_seconds
+    return {
+        "module": module,
+        "seconds": next((cumulative for name, _, cumulative in modules if name == module), 0.0),
+        "packages": sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top],
+        "modules": sorted(modules, key=lambda item: item[2], reverse=True)[:top],
+    }
+
+
+def print_report(report):
+    print(f"import {report['module']}: {report['seconds'] * 1000:.1f} ms")
+    print(f"\n{'package':<48}{'self ms':>10}")
+    for package, seconds in report["packages"]:
+        print(f"{package:<48}{seconds * 1000:>10.1f}")
+    print(f"\n{'module':<48}{'self ms':>10}{'total ms':>10}")
+    for name, self_seconds, cumulative in report["modules"]:
+        print(f"{name:<48}{self_seconds * 1000:>10.1f}{cumulative * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app", help="module of the app to import")
+    parser.add_argument("--top", type=int, default=25, help="number of packages and modules to report")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = import_report(args.module, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Backfill runs against the local fake Slack Web API."""
+
+import threading
+
+import pytest
+from slack_sdk import WebClient
+
+from backfill import Backfill, Checkpoints
+from fake_slack import FakeSlackAPI
+from idempotency import MemoryIdempotencyStore
+
+CHANNEL = "C0001"
+
+
+def ts(seconds):
+    return f"{1700000000 + seconds}.000100"
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class Recorder:
+    """A message listener recording the messages it is called with, optionally interrupting the run."""
+
+    def __init__(self, interrupt_at=None, fail_at=None):
+        self.interrupt_at = interrupt_at
+        self.fail_at = fail_at
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def __call__(self, message):
+        if message["ts"] == self.interrupt_at:
+            raise Interrupted()
+        if message["ts"] == self.fail_at:
+            self.fail_at = None
+            raise RuntimeError("handler failed")
+        with self._lock:
+            self.messages.append(message["ts"])
+
+
+@pytest.fixture
+def api():
+    api = FakeSlackAPI(page_size=3)
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def client(api):
+    return WebClient(token="xoxb-test", base_url=api.start())
+
+
+def run_backfill(client, checkpoints, handler, since=ts(0), store=None, thread_lookback=0):
+    backfill = Backfill(client, handler, checkpoints, workers=2, store=store, thread_lookback=thread_lookback)
+    try:
+        backfill.run([CHANNEL], since)
+    finally:
+        backfill.close()
+    return backfill
+
+
+def test_pages_through_the_whole_history(api, client, tmp_path):
+    for seconds in range(1, 11):
+        api.add_message(CHANNEL, ts(seconds), f"message {seconds}")
+    checkpoints = Checkpoints(str(tmp_path / "checkpoint.json"))
+    handler = Recorder()
+
+    run_backfill(client, checkpoints, handler)
+
+    assert sorted(handler.messages) == [ts(seconds) for seconds in range(1, 11)]
+    assert api.calls["conversations.history"] == 4
+    assert checkpoints.get(CHANNEL) == {"done": ts(10)}
+
+
+def test_resumes_from_the_checkpoint(api, client, tmp_path):
+    for seconds in range(1, 11):
+        api.add_message(CHANNEL, ts(seconds), f"message {seconds}")
+    path = str(tmp_path / "checkpoint.json")
+    interrupted = Recorder(interrupt_at=ts(5))
+
+    with pytest.raises(Interrupted):
+        run_backfill(client, Checkpoints(path), interrupted)
+
+    # Pages are newest first: the pages before the interrupted one are checkpointed.
+    assert Checkpoints(path).get(CHANNEL) == {"newest": ts(10), "latest": ts(8)}
+
+    resumed = Recorder()
+    run_backfill(client, Checkpoints(path), resumed)
+
+    assert sorted(resumed.messages) == [ts(seconds) for seconds in range(1, 8)]
+    assert Checkpoints(path).get(CHANNEL) == {"done": ts(10)}
+
+    api.add_message(CHANNEL, ts(11), "posted after the backfill")
+    later = Recorder()
+    run_backfill(client, Checkpoints(path), later)
+    assert later.messages == [ts(11)]
+
+
+def test_handles_thread_replies(api, client, tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    api.add_message(CHANNEL, ts(1), "old thread")
+    api.add_message(CHANNEL, ts(2), "old reply", thread_ts=ts(1))
+    api.add_message(CHANNEL, ts(3), "new thread")
+    api.add_message(CHANNEL, ts(4), "reply", thread_ts=ts(3))
+    Checkpoints(path).update(CHANNEL, done=ts(2))
+    for seconds in range(5, 10):
+        api.add_message(CHANNEL, ts(seconds), "reply of a thread older than the checkpoint", thread_ts=ts(1))
+
+    handler = Recorder()
+    run_backfill(client, Checkpoints(path), handler, thread_lookback=3600)
+
+    assert sorted(handler.messages) == [ts(seconds) for seconds in range(3, 10)]
+    assert Checkpoints(path).get(CHANNEL) == {"done": ts(3)}
+
+
+def test_skips_messages_already_handled(api, client, tmp_path):
+    for seconds in range(1, 5):
+        api.add_message(CHANNEL, ts(seconds), f"message {seconds}")
+    store = MemoryIdempotencyStore()
+    store.claim(f"message:{CHANNEL}:{ts(2)}")
+
+    handler = Recorder()
+    backfill = run_backfill(client, Checkpoints(str(tmp_path / "checkpoint.json")), handler, store=store)
+
+    assert sorted(handler.messages) == [ts(1), ts(3), ts(4)]
+    assert (backfill.handled, backfill.skipped) == (3, 1)
+
+
+def test_retries_messages_that_failed(api, client, tmp_path):
+    for seconds in range(1, 5):
+        api.add_message(CHANNEL, ts(seconds), f"message {seconds}")
+    store = MemoryIdempotencyStore()
+
+    path = str(tmp_path / "checkpoint.json")
+
+    handler = Recorder(fail_at=ts(3))
+    backfill = run_backfill(client, Checkpoints(path), handler, store=store)
+    assert (backfill.handled, backfill.failed) == (3, 1)
+    assert Checkpoints(path).get(CHANNEL) == {"done": ts(4), "failed": [{"ts": ts(3)}]}
+
+    backfill = run_backfill(client, Checkpoints(path), handler, store=store)
+    assert handler.messages.count(ts(3)) == 1
+    assert (backfill.handled, backfill.skipped, backfill.failed) == (1, 0, 0)
+    assert Checkpoints(path).get(CHANNEL) == {"done": ts(4)}
+
+
+def test_retries_thread_replies_that_failed(api, client, tmp_path):
+    api.add_message(CHANNEL, ts(1), "thread")
+    api.add_message(CHANNEL, ts(2), "reply", thread_ts=ts(1))
+    api.add_message(CHANNEL, ts(3), "reply", thread_ts=ts(1))
+    path = str(tmp_path / "checkpoint.json")
+
+    handler = Recorder(fail_at=ts(2))
+    run_backfill(client, Checkpoints(path), handler)
+    assert Checkpoints(path).get(CHANNEL)["failed"] == [{"ts": ts(2), "thread_ts": ts(1)}]
+
+    run_backfill(client, Checkpoints(path), handler)
+    assert sorted(handler.messages) == [ts(1), ts(2), ts(3)]
+    assert Checkpoints(path).get(CHANNEL) == {"done": ts(1)}
@@ -8,15 +8,28 @@ import logging
 import os
 from enum import Enum
 
-from dotenv import find_dotenv, load_dotenv
+_environment_loaded = False
 
-from lib.api.google.config import get_google_cloud_credentials
 
-dotenv_path = find_dotenv()
-if dotenv_path:
-    load_dotenv(dotenv_path)
-else:
-    logging.debug("No .env file found.")
+def load_environment():
+    """Load the .env file into the environment variables, once, on the first lookup."""
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    _environment_loaded = True
+    from dotenv import find_dotenv, load_dotenv
+
+    dotenv_path = find_dotenv()
+    if dotenv_path:
+        load_dotenv(dotenv_path)
+    else:
+        logging.debug("No .env file found.")
+
+
+def getenv(name, default=None):
+    """Retrieve an environment variable, after loading the .env file."""
+    load_environment()
+    return os.environ.get(name, default)
 
 
 class Tokens(Enum):
@@ -26,29 +39,225 @@ class Tokens(Enum):
 
 def get_slack_bot_token():
     """Retrieve the Slack bot token from environment variables."""
-    return os.environ.get(Tokens.SLACK_BOT_TOKEN.value)
+    return getenv(Tokens.SLACK_BOT_TOKEN.value)
 
 
 def get_slack_app_token():
     """Retrieve the Slack app token from environment variables."""
-    return os.environ.get(Tokens.SLACK_APP_TOKEN.value)
+    return getenv(Tokens.SLACK_APP_TOKEN.value)
 
 
 def get_google_cloud_service_account():
     """Retrieve the Google Cloud application credentials from environment variables."""
+    from lib.api.google.config import get_google_cloud_credentials
+
+    load_environment()
     return get_google_cloud_credentials()
 
 
 def get_google_sheet_id():
     """Retrieve the Google Sheet ID from environment variables."""
-    return os.environ.get("GOOGLE_SHEET_ID")
+    return getenv("GOOGLE_SHEET_ID")
+
+
+def get_google_sheet_range():
+    """Retrieve the Google Sheet range scored alerts are appended to from environment variables."""
+    return getenv("GOOGLE_SHEET_RANGE", "Sheet1!A1")
 
 
 def get_openai_project_service_account():
     """Retrieve the OpenAI API key from environment variables."""
-    return os.environ.get("OPENAI_API_KEY")
+    return getenv("OPENAI_API_KEY")
 
 
 def get_openai_project_id():
     """Retrieve the OpenAI project ID from environment variables."""
-    return os.environ.get("OPENAI_PROJECT_ID")
+    return getenv("OPENAI_PROJECT_ID")
+
+
+def get_openai_model():
+    """Retrieve the OpenAI chat completion model from environment variables."""
+    return getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+
+def get_nlp_backend():
+    """Retrieve the sentiment and entity analysis backend ('tiered', 'local' or 'cloud') from environment variables."""
+    return getenv("NLP_BACKEND", "tiered")
+
+
+def get_nlp_cache_size():
+    """Retrieve the maximum number of in-memory NLP cache entries from environment variables."""
+    return int(getenv("NLP_CACHE_SIZE", "1024"))
+
+
+def get_nlp_cache_ttl():
+    """Retrieve the NLP cache entry time-to-live in seconds from environment variables."""
+    return float(getenv("NLP_CACHE_TTL", "3600"))
+
+
+def get_nlp_cache_path():
+    """Retrieve the path of the on-disk NLP cache from environment variables."""
+    return getenv("NLP_CACHE_PATH")
+
+
+def get_max_in_flight():
+    """Retrieve the maximum number of messages processed concurrently in asyncio mode."""
+    return int(getenv("MAX_IN_FLIGHT", "32"))
+
+
+def get_pipeline_stages():
+    """Retrieve the comma separated message pipeline stages from environment variables."""
+    stages = getenv("PIPELINE_STAGES", "self,member,keyword,dedup,nlp")
+    return [stage.strip() for stage in stages.split(",") if stage.strip()]
+
+
+def get_pipeline_report_interval():
+    """Retrieve how many messages go by between pipeline pass rate reports from environment variables."""
+    return int(getenv("PIPELINE_REPORT_INTERVAL", "100"))
+
+
+def get_config_reload_interval():
+    """Retrieve the number of seconds between two configuration file checks from environment variables (0 disables)."""
+    return float(getenv("CONFIG_RELOAD_INTERVAL", "2"))
+
+
+def get_llm_stream_update_interval():
+    """Retrieve the minimum number of seconds between two updates of a streamed LLM summary from environment variables."""
+    return float(getenv("LLM_STREAM_UPDATE_INTERVAL", "1"))
+
+
+def get_dedup_window():
+    """Retrieve the number of seconds messages are kept for near-duplicate detection from environment variables."""
+    return float(getenv("DEDUP_WINDOW_SECONDS", "600"))
+
+
+def get_dedup_max_distance():
+    """Retrieve the maximum SimHash distance of near-duplicate messages from environment variables."""
+    return int(getenv("DEDUP_MAX_DISTANCE", "3"))
+
+
+def get_alert_window():
+    """Retrieve the number of seconds keyword alerts are coalesced into one summary from environment variables (0 disables)."""
+    return float(getenv("ALERT_WINDOW_SECONDS", "30"))
+
+
+def get_metrics_port():
+    """Retrieve the port of the local metrics endpoint from environment variables (0 disables)."""
+    return int(getenv("METRICS_PORT", "0"))
+
+
+def get_metrics_profiling_enabled():
+    """Retrieve whether the metrics endpoint serves the sampling profiler from environment variables."""
+    return getenv("METRICS_PROFILING", "").lower() in ("1", "true", "yes")
+
+
+def get_relevancy_model_path():
+    """Retrieve the path of the trained relevancy model (.npz) from environment variables."""
+    return getenv("RELEVANCY_MODEL_PATH")
+
+
+def get_llm_provider():
+    """Retrieve the LLM provider ('vertex', 'openai' or 'fake') from environment variables."""
+    return getenv("LLM_PROVIDER", "vertex")
+
+
+def get_llm_hedge_provider():
+    """Retrieve the LLM provider slow requests are hedged with from environment variables (unset disables)."""
+    return getenv("LLM_HEDGE_PROVIDER") or None
+
+
+def get_llm_hedge_percentile():
+    """Retrieve the first-chunk latency percentile after which LLM requests are hedged from environment variables."""
+    return float(getenv("LLM_HEDGE_PERCENTILE", "95"))
+
+
+def get_llm_max_concurrency():
+    """Retrieve the maximum number of concurrent requests per LLM provider from environment variables."""
+    return int(getenv("LLM_MAX_CONCURRENCY", "4"))
+
+
+def get_event_deadline():
+    """Retrieve the number of seconds allowed to process an event from environment variables."""
+    return float(getenv("EVENT_DEADLINE_SECONDS", "10"))
+
+
+def get_stage_budgets():
+    """Retrieve the maximum number of seconds of the external API stages ('nlp=2,llm=6') from environment variables."""
+    budgets = {}
+    for item in getenv("STAGE_BUDGETS", "nlp=2,llm=6").split(","):
+        name, _, seconds = item.partition("=")
+        if name.strip() and seconds.strip():
+            budgets[name.strip()] = float(seconds)
+    return budgets
+
+
+def get_breaker_error_rate():
+    """Retrieve the failed call rate that opens a circuit breaker from environment variables."""
+    return float(getenv("BREAKER_ERROR_RATE", "0.5"))
+
+
+def get_breaker_slow_rate():
+    """Retrieve the slow call rate that opens a circuit breaker from environment variables."""
+    return float(getenv("BREAKER_SLOW_RATE", "0.5"))
+
+
+def get_breaker_cooldown():
+    """Retrieve the number of seconds a circuit breaker stays open from environment variables."""
+    return float(getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+
+def get_idempotency_ttl():
+    """Retrieve the number of seconds a handled event is remembered to drop its redeliveries from environment variables."""
+    return float(getenv("IDEMPOTENCY_TTL_SECONDS", "900"))
+
+
+def get_idempotency_cache_size():
+    """Retrieve the maximum number of handled events remembered in memory from environment variables."""
+    return int(getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+
+def get_idempotency_store_path():
+    """Retrieve the path of the SQLite file of handled events shared by worker processes from environment variables."""
+    return getenv("IDEMPOTENCY_STORE_PATH")
+
+
+def get_workers():
+    """Retrieve the number of Socket Mode worker processes from environment variables."""
+    return int(getenv("WORKERS", "1"))
+
+
+def get_log_level():
+    """Retrieve the minimum level of the log records from environment variables."""
+    return getenv("LOG_LEVEL", "INFO")
+
+
+def get_log_format():
+    """Retrieve the format of the log records ('text' or 'json') from environment variables."""
+    return getenv("LOG_FORMAT", "text")
+
+
+def get_log_sample_per_second():
+    """Retrieve the number of log records kept per second from each line of code from environment variables (0 keeps all)."""
+    return int(getenv("LOG_SAMPLE_PER_SECOND", "10"))
+
+
+def get_scheduler_high_workers():
+    """Retrieve the number of workers processing only high priority messages from environment variables."""
+    return int(getenv("SCHEDULER_HIGH_WORKERS", "2"))
+
+
+def get_scheduler_low_workers():
+    """Retrieve the number of workers processing messages of any priority from environment variables (0 disables the scheduler)."""
+    return int(getenv("SCHEDULER_LOW_WORKERS", "4"))
+
+
+def get_scheduler_aging():
+    """Retrieve the number of seconds of waiting worth one level of message urgency from environment variables."""
+    return float(getenv("SCHEDULER_AGING_SECONDS", "5"))
+
+
+def get_priority_channels():
+    """Retrieve the comma separated IDs of the channels whose messages are more urgent from environment variables."""
+    return frozenset(
+        channel.strip() for channel in getenv("PRIORITY_CHANNELS", "").split(",") if channel.strip()
+    )